@@ -11,8 +11,6 @@ import gc
 import json
 import sys
 import time
-from collections import namedtuple
-
 
 from microcontroller import watchdog as wd
 from watchdog import WatchDogMode
@@ -38,6 +36,10 @@ cwd = ("/" + __file__).rsplit("/", 1)[
 ]  # the current working directory (where this file is)
 sys.path.append(cwd)
 import openweather_graphics  # pylint: disable=wrong-import-position
+import metrics  # pylint: disable=wrong-import-position
+from sampler import Deadband, Sampler  # pylint: disable=wrong-import-position
+from status import StatusEncoder  # pylint: disable=wrong-import-position
+from scheduler import Scheduler  # pylint: disable=wrong-import-position
 
 # Get wifi details and more from a secrets.py file
 try:
@@ -81,6 +83,14 @@ adt.high_resolution = True
 # init. the light sensor
 adc = AnalogIn(board.LIGHT)
 
+# Both are read every SAMPLE_INTERVAL seconds, and the status reports the
+# aggregates of the last SAMPLE_WINDOW readings: 10 minutes of them
+SAMPLE_INTERVAL = 5
+SAMPLE_WINDOW = 120
+# Celsius to Fahrenheit. The moving averages follow changes within seconds.
+temperature = Sampler(lambda: (adt.temperature * 9 / 5) + 32, SAMPLE_WINDOW, 0.3)
+light = Sampler(lambda: adc.value, SAMPLE_WINDOW, 0.3)
+
 # ------- Leds  ------- #
 
 # ref: https://www.devdungeon.com/content/pyportal-circuitpy-tutorial-adabox-011#toc-27
@@ -92,28 +102,58 @@ board_led.switch_to_output()
 
 # ------- Stats  ------- #
 
-counters = {}
-
-
-def _inc_counter(name):
-    global counters
-    curr_value = counters.get(name, 0)
-    counters[name] = curr_value + 1
+# Every name is registered here, updating an unknown one raises KeyError
+stats = metrics.Metrics()
+stats.counter(
+    "ping",
+    "brightness",
+    "neo",
+    "blink",
+    "weather_too_big",
+    "weather_mqtt",
+    "local_time_mqtt",
+    "local_time_mqtt_failed",
+    "inside_temp",
+    "connect",
+    "disconnected",
+    "subscribe",
+    "publish",
+    "local_time_fetch",
+    "weather_fetch",
+    "fail_loop",
+    "esp_reset",
+    "reconnect",
+    "fail_runtime",
+    "fail_other",
+    "loop_busy",
+)
+stats.gauge("mem_free", "offline_queued")
+# Main loop iteration and client.loop() times. Message handlers and intervals
+# get theirs as msg_<handler> and run_<interval>, registered with them below.
+stats.histogram("main_loop", "mqtt_loop")
+# Publish the status as CBOR, and the metrics packed with their layout, instead
+# of as JSON. Decode them on the host with tools/status_decode.py
+TELEMETRY_BINARY = False
+# The status carries only what changed since the previous one, see StatusEncoder
+status_encoder = StatusEncoder(binary=TELEMETRY_BINARY)
 
 
 # ------------- MQTT Topic Setup ------------- #
 
 
 def _parse_ping(_topic, message):
-    global tss
-    tss["send_status"] = None  # clear to force send status now
-    _inc_counter("ping")
+    status_encoder.force_full()
+    for _, _, deadband, _ in reports:
+        deadband.force()
+    intervals.reschedule("send_status", 0)  # send status now
+    intervals.reschedule("send_metrics", 0)
+    stats.inc("ping")
 
 
 def _parse_brightness(topic, message):
     print("_parse_brightness: {0} {1} {2}".format(len(message), topic, message))
     set_backlight(message)
-    _inc_counter("brightness")
+    stats.inc("brightness")
 
 
 def _parse_neopixel(_topic, message):
@@ -124,7 +164,7 @@ def _parse_neopixel(_topic, message):
         print(f"bad neo value: {e}")
         return
     pixels[0] = ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
-    _inc_counter("neo")
+    stats.inc("neo")
 
 
 LED_BLINK = "led_blink"
@@ -132,7 +172,7 @@ LED_BLINK_DEFAULT = 60
 
 
 def _parse_blinkrate(_topic, message):
-    global tss, TS_INTERVALS, board_led
+    global board_led
 
     message = message.lower()
     value_map = {"off": 0, "no": 0, "on": None, "yes": None, "": LED_BLINK_DEFAULT}
@@ -146,28 +186,39 @@ def _parse_blinkrate(_topic, message):
         return
 
     if value:
-        TS_INTERVALS[LED_BLINK] = TS(value, interval_led_blink)
-        tss[LED_BLINK] = None
+        intervals.add(LED_BLINK, value, interval_led_blink)
     else:
         # Stop blinking. Turn off if value is 0. Turn on if value is None.
-        try:
-            del TS_INTERVALS[LED_BLINK]
-            del tss[LED_BLINK]
-        except KeyError:
-            pass
+        intervals.cancel(LED_BLINK)
         board_led.value = value is None
-    _inc_counter("blink")
+    stats.inc("blink")
+
+
+# OpenWeather JSON is streamed into this buffer, allocated once
+WEATHER_MAX = 2048
+weather_buf = bytearray(WEATHER_MAX)
+
+
+def _stream_openweather_message(_client, topic, chunk, offset, total):
+    if total > WEATHER_MAX:
+        if not offset:
+            print(f"Dropped {topic}: {total} bytes is over {WEATHER_MAX}")
+            stats.inc("weather_too_big")
+        return
+    weather_buf[offset : offset + len(chunk)] = chunk
+    if offset + len(chunk) == total:
+        start = metrics.now()
+        _parse_openweather_message(topic, memoryview(weather_buf)[:total])
+        stats.observe_since(msg_histograms[topic], start)
 
 
 def _parse_openweather_message(topic, message):
-    global tss, gfx
-    print(
-        "_parse_openweather_message: {0} {1} {2}".format(len(message), topic, message)
-    )
+    global gfx
+    print("_parse_openweather_message: {0} {1}".format(len(message), topic))
     try:
         gfx.display_weather(message)
-        tss["weather"] = time.monotonic()  # reset so no new update is needed
-        _inc_counter("weather_mqtt")
+        intervals.reschedule("weather")  # reset so no new update is needed
+        stats.inc("weather_mqtt")
     except Exception as e:
         print(f"Error in _parse_openweather_message -", e)
 
@@ -189,32 +240,45 @@ def _parse_localtime_message(topic, message):
             (year, month, mday, hours, minutes, seconds, week_day, year_day, is_dst)
         )
         rtc.RTC().datetime = now
-        tss["localtime"] = time.monotonic()  # reset so no new update is needed
-        _inc_counter("local_time_mqtt")
+        intervals.reschedule("localtime")  # reset so no new update is needed
+        stats.inc("local_time_mqtt")
     except Exception as e:
         print(f"Error in _parse_localtime_message -", e)
-        _inc_counter("local_time_mqtt_failed")
+        stats.inc("local_time_mqtt_failed")
 
 
 def _parse_temperature_house(topic, message):
     gfx.display_inside_temp(int(message))
-    _inc_counter("inside_temp")
+    stats.inc("inside_temp")
 
 
 mqtt_topic = secrets.get("topic_prefix") or "/pyportal"
 mqtt_pub_temperature = f"{mqtt_topic}/temperature"
 mqtt_pub_light = f"{mqtt_topic}/light"
+# Report by exception: these are published once they change by the threshold,
+# in the units published, at most every min and at least every max seconds.
+# The min keeps them to one message per 10 minutes at most, as when they were
+# sent with the status, the max to two per hour when they hold steady.
+DEADBANDS = {
+    mqtt_pub_temperature: (0.5, 10 * 60, 30 * 60),
+    mqtt_pub_light: (16, 10 * 60, 30 * 60),
+}
 mqtt_pub_status = f"{mqtt_topic}/status"
+mqtt_pub_status_info = f"{mqtt_topic}/status/info"
+mqtt_pub_metrics = f"{mqtt_topic}/metrics"
 
 mqtt_subs = {
     f"{mqtt_topic}/ping": _parse_ping,
     f"{mqtt_topic}/brightness": _parse_brightness,
     f"{mqtt_topic}/neopixel": _parse_neopixel,
     f"{mqtt_topic}/blinkrate": _parse_blinkrate,
-    "/openweather/raw": _parse_openweather_message,
+    "/openweather/raw": _parse_openweather_message,  # streamed, see below
     "/aio/local_time": _parse_localtime_message,
     "/sensor/temperature_house": _parse_temperature_house,
 }
+# e.g. msg_ping for _parse_ping
+msg_histograms = {topic: "msg" + fun.__name__[6:] for topic, fun in mqtt_subs.items()}
+stats.histogram(*msg_histograms.values())
 
 
 # ------------- MQTT Functions ------------- #
@@ -227,28 +291,30 @@ def connect(client, userdata, flags, rc):
     print("Connected to MQTT Broker!", end=" ")
     print(f"mqtt_msg: {client.mqtt_msg}", end=" ")
     print(f"Flags: {flags} RC: {rc}")
-    for mqtt_sub in mqtt_subs:
-        print(f"Subscribing to {mqtt_sub}")
-        client.subscribe(mqtt_sub)
-    _inc_counter("connect")
+    if flags:
+        print("Broker kept the session, still subscribed")
+    else:
+        print(f"Subscribing to {list(mqtt_subs)}")
+        client.subscribe([(mqtt_sub, 0) for mqtt_sub in mqtt_subs])
+    stats.inc("connect")
 
 
 def disconnected(_client, _userdata, rc):
     # This method is called when the client is disconnected
     print(f"Disconnected from MQTT Broker! RC: {rc}")
-    _inc_counter("disconnected")
+    stats.inc("disconnected")
 
 
 def subscribe(_client, _userdata, topic, granted_qos):
     # This method is called when the client subscribes to a new feed.
     print(f"Subscribed to {topic} with QOS level {granted_qos}")
-    _inc_counter("subscribe")
+    stats.inc("subscribe")
 
 
 def publish(_client, userdata, topic, pid):
     # This method is called when the client publishes data to a feed.
     print(f"Published to {topic} with PID {pid}")
-    _inc_counter("publish")
+    stats.inc("publish")
 
 
 def message(_client, topic, message):
@@ -259,7 +325,9 @@ def message(_client, topic, message):
     """
     # print("New message on topic {0}: {1}".format(topic, message))
     if topic in mqtt_subs:
+        start = metrics.now()
         mqtt_subs[topic](topic, message)
+        stats.observe_since(msg_histograms[topic], start)
 
 
 # ------------- Network Connection ------------- #
@@ -277,14 +345,25 @@ MQTT.set_socket(socket, pyportal.network._wifi.esp)
 broker_user = secrets["broker_user"] if secrets["broker_user"] else None
 broker_pass = secrets["broker_pass"] if secrets["broker_pass"] else None
 
+# Stable across reboots, so the broker finds the persistent session again
+# instead of keeping an orphaned one per boot
+client_id = secrets.get("client_id") or "pyportal-" + "".join(
+    "{:02x}".format(b) for b in microcontroller.cpu.uid
+)
+
 client = MQTT.MQTT(
     broker=secrets["broker"],
     port=1883,
     username=broker_user,
     password=broker_pass,
+    client_id=client_id,
+    recv_buffer_size=512,  # allocated once, /openweather/raw is streamed
+    max_inflight=8,  # QoS 1 publishes are acked from client.loop()
+    offline_queue_size=1024,  # bytes kept for the broker while disconnected
+    trace_size=32,  # last packets, printed when the connection fails
 )
 try:
-    client.enable_logger(logging, logging.DEBUG)
+    client.enable_logger(logging, logging.INFO)
 except:
     client.attach_logger()
     client.set_logger_level("DEBUG")
@@ -295,10 +374,38 @@ client.on_disconnect = disconnected
 client.on_subscribe = subscribe
 client.on_publish = publish
 client.on_message = message
+# Never held whole: chunks go straight from the receive buffer into weather_buf
+client.add_stream_callback("/openweather/raw", _stream_openweather_message)
+
+# Topics published for the whole uptime, validated and encoded only once.
+# While offline, only their latest value is kept for the broker.
+pub_temperature = client.prepare_topic(mqtt_pub_temperature, latest=True)
+pub_light = client.prepare_topic(mqtt_pub_light, latest=True)
+pub_status = client.prepare_topic(mqtt_pub_status, latest=True)
+# (topic, sampler, deadband, scale of what is published)
+reports = [
+    (
+        pub_temperature,
+        temperature,
+        Deadband(*DEADBANDS[mqtt_pub_temperature]),
+        lambda value: round(value, 1),
+    ),
+    (
+        pub_light,
+        light,
+        Deadband(*DEADBANDS[mqtt_pub_light]),
+        # map 65535 to 1024 (16 to 10 bits)
+        lambda value: int(value) // 64,
+    ),
+]
+pub_status_info = client.prepare_topic(mqtt_pub_status_info, latest=True)
+pub_metrics = client.prepare_topic(mqtt_pub_metrics, latest=True)
+pub_metrics_layout = client.prepare_topic(f"{mqtt_pub_metrics}/layout", latest=True)
 
 print(f"Attempting to MQTT connect to {client.broker}")
 try:
-    client.connect()
+    # persistent session: the broker keeps our subscriptions across reconnects
+    client.connect(clean_session=False)
 except Exception as e:
     print(f"FATAL! Unable to MQTT connect to {client.broker}: {e}")
     time.sleep(120)
@@ -343,85 +450,179 @@ set_backlight("on")
 
 def interval_localtime():
     # pyportal.get_local_time()
-    _inc_counter("local_time_fetch")
+    stats.inc("local_time_fetch")
 
 
 def interval_weather():
     # value = pyportal.fetch()
     # print("interval_weather response is", value)
     # gfx.display_weather(value)
-    _inc_counter("weather_fetch")
+    stats.inc("weather_fetch")
 
 
 def interval_send_status():
-    global counters
-
-    value = {
-        "lux": adc.value,
-        "uptime_mins": int(time.monotonic() - t0) // 60,
+    # Rarely changing, published retained when they change
+    info = {
         "brightness": board.DISPLAY.brightness,
         "ip": pyportal.network.ip_address,
-        "counters": str(counters),
+    }
+    if not len(temperature):
+        interval_sample()
+    temp_agg = temperature.aggregate()
+    light_agg = light.aggregate()
+    value = {
+        "lux": int(light_agg[2]),
+        # min, max, mean and moving average of the last readings
+        "temperature": [round(x, 1) for x in temp_agg],
+        "light": [int(x) for x in light_agg],
+        "uptime_mins": int(time.monotonic() - t0) // 60,
+        "counters": stats.counters(),
         "mem_free": gc.mem_free(),
     }
-    client.publish(
-        mqtt_pub_temperature, (adt.temperature * 9 / 5) + 32
-    )  # Celsius to Fahrenheit
-    client.publish(
-        mqtt_pub_light, value["lux"] // 64
-    )  # map 65535 to 1024 (16 to 10 bits)
-    client.publish(mqtt_pub_status, json.dumps(value))
+    retained = []
+    rtt = client.ping_rtt
+    if rtt:
+        # min/avg/max broker round trip of the last keepalive pings
+        value["ping_ms"] = [int(t * 1000) for t in rtt]
+    _, reconnect_secs = client.reconnect_stats
+    if reconnect_secs is not None:
+        value["reconnect_ms"] = int(reconnect_secs * 1000)
+    if not client.is_connected():
+        # Goes to the offline queue, which keeps only the latest status: make
+        # it a full one, as the deltas before it would be lost
+        status_encoder.force_full()
+    encoded_info = status_encoder.encode_static(info)
+    if encoded_info is not None:
+        retained.append((pub_status_info, encoded_info, 1, True))
+        print(f"send_status: {mqtt_pub_status_info}: {info}")
+    try:
+        client.publish_many(
+            [(pub_status, status_encoder.encode(value), 1)] + retained
+        )
+    except Exception:
+        # Not sent, so the next status can not be a delta of this one
+        status_encoder.force_full()
+        raise
     print(f"send_status: {mqtt_pub_status}: {value}")
 
 
+def interval_send_metrics():
+    # A few KB, so sent at QoS 0 to stay out of the in-flight window, and
+    # never queued offline: the counters of the next ones include these
+    if not client.is_connected():
+        intervals.retry("send_metrics", INTERVAL_RETRY)
+        return
+    stats.set("mem_free", gc.mem_free())
+    stats.set("offline_queued", client.offline_stats[0])
+    if TELEMETRY_BINARY:
+        messages = [
+            (pub_metrics_layout, json.dumps(stats.layout()), 0, True),
+            (pub_metrics, stats.pack(), 0),
+        ]
+    else:
+        messages = [(pub_metrics, json.dumps(stats.as_dict()), 0)]
+    client.publish_many(messages)
+    print(f"send_metrics: {mqtt_pub_metrics}")
+
+
+def interval_sample():
+    temperature.sample()
+    light.sample()
+    messages = []
+    for topic, sampler, deadband, scale in reports:
+        value = scale(sampler.ema)
+        if deadband.due(value):
+            messages.append((topic, value, deadband))
+    if messages:
+        client.publish_many([(topic, value, 1) for topic, value, _ in messages])
+        # Only once sent or queued, a failure leaves them due for the next sample
+        for _, value, deadband in messages:
+            deadband.published(value)
+
+
 def interval_led_blink():
     board_led.value = not board_led.value
 
 
-TS = namedtuple("TS", "interval fun")
-TS_INTERVALS = {
-    "localtime": TS(3620, interval_localtime),
-    "weather": TS(11 * 60, interval_weather),
-    "update_time": TS(16, gfx.update_time),
-    "send_status": TS(10 * 60, interval_send_status),
-    LED_BLINK: TS(LED_BLINK_DEFAULT, interval_led_blink),  # may be overridden via mqtt
-}
+# Each runs as soon as the main loop starts, then every interval seconds
+intervals = Scheduler()
+intervals.add("localtime", 3620, interval_localtime)
+intervals.add("weather", 11 * 60, interval_weather)
+intervals.add("update_time", 16, gfx.update_time)
+intervals.add("sample", SAMPLE_INTERVAL, interval_sample)
+intervals.add("send_status", 10 * 60, interval_send_status)
+intervals.add("send_metrics", 60 * 60, interval_send_metrics)
+intervals.add(LED_BLINK, LED_BLINK_DEFAULT, interval_led_blink)  # may be overridden via mqtt
+stats.histogram(
+    "run_localtime",
+    "run_weather",
+    "run_update_time",
+    "run_sample",
+    "run_send_status",
+    "run_send_metrics",
+    "run_" + LED_BLINK,
+)
+# Delay before an interval that failed with ValueError or RuntimeError is retried
+INTERVAL_RETRY = 10
+
+
+# Longest client.loop() wait, well within the watchdog timeout
+LOOP_WAIT_MAX = 5
+# Most messages and seconds a client.loop() call handles, so bursts of retained
+# messages do not hold off the intervals and the watchdog
+LOOP_MAX_MESSAGES = 16
+LOOP_MAX_TIME = 1
+
+
+# Reconnect attempts are made from the main loop, see _reconnect_step
+reconnect_since = None
+esp_was_reset = False
+# Outage length after which the ESP32 is reset, and the board
+ESP_RESET_AFTER = 60
+BOARD_RESET_AFTER = 600
 
 
 def _try_reconnect(e):
+    global reconnect_since, esp_was_reset
     print(f"Failed mqtt loop: {e}")
-    _inc_counter("fail_loop")
-    feed_dog()
-    time.sleep(3)
+    stats.inc("fail_loop")
+    client.dump_trace()
+    reconnect_since = time.monotonic()
+    esp_was_reset = False
+
 
-    disc_ok = False
+def _reset_esp():
     try:
+        stats.inc("esp_reset")
+        feed_dog()
+        pyportal.network._wifi.esp.reset()
+        print("Reconnecting to WiFi...")
         feed_dog()
-        client.disconnect()
-        disc_ok = True
+        pyportal.network.connect()
+        print("Reset esp and Wifi connected")
     except Exception as e:
-        print(f"Failed mqtt disconnect: {e}")
+        print(f"Failed esp reset: {e}")
 
-    try:
-        if not disc_ok:
-            _inc_counter("esp_reset")
-            feed_dog()
-            pyportal.network._wifi.esp.reset()
-            print("Reconnecting to WiFi...")
-            feed_dog()
-            pyportal.network.connect()
-            print("Reset esp and Wifi connected")
-    except Exception as e:
-        print(f"FATAL! Failed esp reset: {e}")
 
-    try:
-        feed_dog()
-        client.connect()
-        print("Reconnected to mqtt broker")
-    except Exception as e:
+def _reconnect_step():
+    """Makes a reconnect attempt when one is due. Returns without waiting
+    otherwise, so the main loop keeps feeding the watchdog."""
+    global reconnect_since, esp_was_reset
+    down = time.monotonic() - reconnect_since
+    if down > BOARD_RESET_AFTER:
         # bye bye cruel world
-        print(f"FATAL! Failed reconnect: {e}")
+        print(f"FATAL! No mqtt broker for {int(down)}s")
         microcontroller.reset()
+    if down > ESP_RESET_AFTER and not esp_was_reset:
+        esp_was_reset = True
+        _reset_esp()
+    feed_dog()
+    # on_connect resubscribes if the broker did not keep the session
+    if client.reconnect_step(resub_topics=False):
+        _, seconds = client.reconnect_stats
+        print(f"Reconnected to mqtt broker in {seconds:.2f}s")
+        stats.inc("reconnect")
+        reconnect_since = None
 
 
 def run_once():
@@ -460,46 +661,53 @@ run_once()
 
 # ------------- Main loop ------------- #
 
-tss = {interval: None for interval in TS_INTERVALS}
 t0 = time.monotonic()
-now = t0
 loop_failures = 0
 while True:
+    loop_start = metrics.now()
     feed_dog()
 
     try:
-        if not client.loop(timeout=0.5):
-            ## if not client.loop():
-            # Take a little break if nothing really happened
-            time.sleep(0.123)
+        if reconnect_since is not None:
+            _reconnect_step()
+            time.sleep(0.05)
+        else:
+            # Wait for MQTT data, but no longer than until the next interval is due
+            deadline = intervals.next_deadline()
+            wait = LOOP_WAIT_MAX if deadline is None else deadline - time.monotonic()
+            start = metrics.now()
+            client.loop(
+                timeout=max(0, min(wait, LOOP_WAIT_MAX)),
+                max_messages=LOOP_MAX_MESSAGES,
+                max_time=LOOP_MAX_TIME,
+            )
+            stats.observe_since("mqtt_loop", start)
+            if client.loop_stats[1]:
+                stats.inc("loop_busy")
         loop_failures = 0
     except Exception as e:
         loop_failures += 1
-        if loop_failures > 2:
+        # e.g. no PINGRESP: the client dropped the connection itself
+        dropped = reconnect_since is None and not client.is_connected()
+        if loop_failures > 2 or dropped:
             _try_reconnect(e)
             loop_failures = 0
 
-    now = time.monotonic()
-    for ts_interval in TS_INTERVALS:
-        if (
-            not tss[ts_interval]
-            or now > tss[ts_interval] + TS_INTERVALS[ts_interval].interval
-        ):
-            try:
-                if TS_INTERVALS[ts_interval].interval >= 60:
-                    lt = time.localtime()
-                    print(
-                        f"{lt.tm_hour}:{lt.tm_min}:{lt.tm_sec} Interval {ts_interval} triggered"
-                    )
-                else:
-                    print(".", end="")
-                TS_INTERVALS[ts_interval].fun()
-            except (ValueError, RuntimeError) as e:
-                print(f"Error in {ts_interval}, retrying in 10s: {e}")
-                tss[ts_interval] = (now - TS_INTERVALS[ts_interval].interval) + 10
-                _inc_counter("fail_runtime")
-                continue
-            except Exception as e:
-                print(f"Failed {ts_interval}: {e}")
-                _inc_counter("fail_other")
-            tss[ts_interval] = time.monotonic()
+    for name, interval, fun in intervals.due():
+        try:
+            if interval >= 60:
+                lt = time.localtime()
+                print(f"{lt.tm_hour}:{lt.tm_min}:{lt.tm_sec} Interval {name} triggered")
+            else:
+                print(".", end="")
+            start = metrics.now()
+            fun()
+            stats.observe_since("run_" + name, start)
+        except (ValueError, RuntimeError) as e:
+            print(f"Error in {name}, retrying in {INTERVAL_RETRY}s: {e}")
+            intervals.retry(name, INTERVAL_RETRY)
+            stats.inc("fail_runtime")
+        except Exception as e:
+            print(f"Failed {name}: {e}")
+            stats.inc("fail_other")
+    stats.observe_since("main_loop", loop_start)
@@ -30,9 +30,22 @@ Adapted from https://github.com/micropython/micropython-lib/tree/master/umqtt.si
 import errno
 import struct
 import time
-from random import randint
+from random import randint, uniform
 from micropython import const
 from .matcher import MQTTMatcher
+from .parser import MQTTParser
+
+try:
+    import select
+except ImportError:
+    select = None
+
+try:
+    import os
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    threading = None
 
 __version__ = "0.0.0+auto.0"
 __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_MiniMQTT.git"
@@ -43,17 +56,44 @@ MQTT_MSG_SZ_LIM = const(10000000)
 MQTT_TOPIC_LENGTH_LIMIT = const(65535)
 MQTT_TCP_PORT = const(1883)
 MQTT_TLS_PORT = const(8883)
+# How often sockets without select() support are checked for data, in seconds
+MQTT_POLL_INTERVAL = 0.02
+# How many PINGREQ round-trip times ping_rtt is computed from
+MQTT_RTT_SAMPLES = const(8)
+# Bounds of the delay between reconnect attempts, in seconds
+MQTT_RECONNECT_MIN = 0.5
+MQTT_RECONNECT_MAX = const(60)
+# How many received topic names are kept decoded, see _topic_str
+MQTT_TOPIC_CACHE_SIZE = const(32)
+# Packet trace event: direction, fixed header, packet id, size, milliseconds
+MQTT_TRACE_EVENT = "<BBHII"
+MQTT_TRACE_EVENT_SIZE = const(12)
 
 # MQTT Commands
 MQTT_PINGREQ = b"\xc0\0"
 MQTT_PINGRESP = const(0xD0)
+MQTT_PUBLISH = const(0x30)
 MQTT_SUB = b"\x82"
 MQTT_UNSUB = b"\xA2"
 MQTT_DISCONNECT = b"\xe0\0"
 
 # Variable CONNECT header [MQTT 3.1.2]
-MQTT_HDR_CONNECT = bytearray(b"\x04MQTT\x04\x02\0\0")
-
+MQTT_HDR_CONNECT = b"\x04MQTT\x04\x02\0\0"
+
+
+MQTT_PACKET_NAMES = {
+    const(0x10): "CONNECT",
+    const(0x20): "CONNACK",
+    const(0x30): "PUBLISH",
+    const(0x40): "PUBACK",
+    const(0x80): "SUBSCRIBE",
+    const(0x90): "SUBACK",
+    const(0xA0): "UNSUBSCRIBE",
+    const(0xB0): "UNSUBACK",
+    const(0xC0): "PINGREQ",
+    const(0xD0): "PINGRESP",
+    const(0xE0): "DISCONNECT",
+}
 
 CONNACK_ERRORS = {
     const(0x01): "Connection Refused - Incorrect Protocol Version",
@@ -117,6 +157,27 @@ class _FakeSSLContext:
         return _FakeSSLSocket(socket, self._iface.TLS_MODE)
 
 
+class PreparedTopic:
+    """A publish topic validated and encoded once, see `MQTT.prepare_topic`.
+
+    :param str topic: Unique topic identifier.
+    :param bool latest: Only the latest message is kept in the offline queue.
+    """
+
+    # pylint: disable=too-few-public-methods
+    __slots__ = "topic", "prefix", "latest"
+
+    def __init__(self, topic, latest=False):
+        MQTT._valid_topic(topic)
+        if "+" in topic or "#" in topic:
+            raise MMQTTException("Publish topic can not contain wildcards.")
+        self.topic = topic
+        # variable header = 2-byte Topic length (big endian) and Topic name
+        encoded = topic.encode("utf-8")
+        self.prefix = struct.pack("!H", len(encoded)) + encoded
+        self.latest = latest
+
+
 class MQTT:
     """MQTT Client for CircuitPython.
 
@@ -135,6 +196,32 @@ class MQTT:
     :param int socket_timeout: How often to check socket state for read/write/connect operations,
         in seconds.
     :param int connect_retries: How many times to try to connect to broker before giving up.
+    :param int recv_buffer_size: Size, in bytes, of a client-owned read-ahead buffer.
+        When set, the socket is read in bulk into this buffer and an incremental
+        parser takes complete packets out of it. Partial packets never block: they
+        are kept, with the parser's progress, for the next `loop()`. No buffer is
+        allocated per received message: with ``use_binary_mode`` the payload is handed
+        to callbacks as a `memoryview` slice of that buffer, valid only for the
+        duration of the callback. Only small objects, such as those slices and the
+        tuples handed between the parser and the callbacks, are allocated per packet,
+        and freed before the next one. Packets larger than the buffer are discarded,
+        unless streamed with `add_stream_callback`.
+        Defaults to ``0`` (read from the socket as needed, allocate per message).
+    :param int max_inflight: When set, QoS 1 publishes do not wait for their PUBACK.
+        Up to this many messages are kept in flight, acknowledged from `loop()`,
+        retransmitted with the DUP flag after ``recv_timeout`` seconds, and reported
+        through ``on_publish`` once acknowledged. Defaults to ``0`` (publish blocks
+        until the PUBACK arrives).
+    :param int offline_queue_size: When set, messages published while disconnected
+        are queued, up to this many bytes of topics and payloads with the oldest
+        dropped first, and sent with a single write once connected again, after
+        the in-flight messages are retransmitted. Topics prepared with
+        ``latest=True`` only keep their last message queued.
+        Defaults to ``0`` (publishing while disconnected raises).
+    :param int trace_size: When set, the type, size, packet id and time of the
+        last ``trace_size`` packets sent and received are recorded in a binary
+        ring buffer, at no formatting cost, until `dump_trace` prints them.
+        Defaults to ``0`` (no trace).
 
     """
 
@@ -154,6 +241,10 @@ class MQTT:
         use_binary_mode=False,
         socket_timeout=1,
         connect_retries=5,
+        recv_buffer_size=0,
+        max_inflight=0,
+        offline_queue_size=0,
+        trace_size=0,
     ):
 
         self._socket_pool = socket_pool
@@ -162,6 +253,21 @@ class MQTT:
         self._backwards_compatible_sock = False
         self._use_binary_mode = use_binary_mode
 
+        # Scratch buffer outgoing packets are assembled in, see _tx_reserve
+        self._tx_buf = bytearray(128)
+        self._tx_view = memoryview(self._tx_buf)
+
+        # Client-owned read-ahead buffer and parser
+        self._parser = None
+        self._rx_body = None
+        self._rx_reads = 0
+        self._rx_packets = 0
+        self._loop_handled = 0
+        self._loop_pending = False
+        self._rx_puback = bytearray(b"\x40\x02\0\0")
+        if recv_buffer_size:
+            self._parser = MQTTParser(recv_buffer_size)
+
         if recv_timeout <= socket_timeout:
             raise MMQTTException(
                 "recv_timeout must be strictly greater than socket_timeout"
@@ -170,12 +276,44 @@ class MQTT:
         self._recv_timeout = recv_timeout
         self._connect_retries = connect_retries
 
+        # CONNECT packet of the last connect(), and what it was built from
+        self._connect_frame = None
+        self._connect_key = None
+        self._clean_session = True
+        # Reconnect state, see reconnect_step
+        self._down_since = None
+        self._retry_at = 0
+        self._backoff = 0
+        self._reconnects = 0
+        self._reconnect_time = None
+
         self.keep_alive = keep_alive
         self._user_data = None
         self._is_connected = False
         self._msg_size_lim = MQTT_MSG_SZ_LIM
         self._pid = 0
+        # QoS 1 messages awaiting a PUBACK: pid -> [topic, packet, sent stamp]
+        self._inflight = {}
+        self._max_inflight = max_inflight
+        # Messages published while disconnected: [topic, msg, qos, retain]
+        self._offline = []
+        self._offline_size = offline_queue_size
+        self._offline_bytes = 0
+        self._offline_dropped = 0
         self._timestamp = 0
+        # Packet trace ring buffer and the offset of its next event, see _trace
+        self._trace_buf = None
+        self._trace_next = 0
+        self._trace_count = 0
+        if trace_size:
+            self._trace_buf = bytearray(trace_size * MQTT_TRACE_EVENT_SIZE)
+        # Debug messages are only formatted if the logger level allows them
+        self._debug = False
+        # Stamp of the PINGREQ awaiting its PINGRESP, 0 when none is
+        self._ping_sent = 0
+        # Last round-trip times, in seconds, see ping_rtt
+        self._rtt = []
+        self._rtt_next = 0
         self.logger = None
 
         self.broker = broker
@@ -216,6 +354,16 @@ class MQTT:
         # List of subscribed topics, used for tracking
         self._subscribed_topics = []
         self._on_message_filtered = MQTTMatcher()
+        # Streamed topics, and the payload being streamed, see add_stream_callback
+        self._on_stream_filtered = MQTTMatcher()
+        self._streaming = False
+        self._stream = None
+        # Payload types of subscriptions made with one, see subscribe
+        self._payload_types = MQTTMatcher()
+        self._payload_typed = False
+        # Received topic names: length -> [(encoded, str)], see _topic_str
+        self._topics = {}
+        self._topics_count = 0
 
         # Default topic callback methods
         self._on_message = None
@@ -225,14 +373,25 @@ class MQTT:
         self.on_subscribe = None
         self.on_unsubscribe = None
 
+        # Background network thread, see loop_start
+        self._thread = None
+        self._thread_stop = False
+        self._lock = None
+        self._outbox = []
+        self._wake = None
+        self._executor = None
+
     # pylint: disable=too-many-branches
-    def _get_connect_socket(self, host, port, *, timeout=1):
+    def _get_connect_socket(self, host, port, *, timeout=1, retries=None):
         """Obtains a new socket and connects to a broker.
 
         :param str host: Desired broker hostname
         :param int port: Desired broker port
         :param int timeout: Desired socket timeout, in seconds
+        :param int retries: Connection attempts, defaults to ``connect_retries``
         """
+        if retries is None:
+            retries = self._connect_retries
         # For reconnections - check if we're using a socket already and close it
         if self._sock:
             self._sock.close()
@@ -270,7 +429,7 @@ class MQTT:
         sock = None
         retry_count = 0
         last_exception = None
-        while retry_count < self._connect_retries and sock is None:
+        while retry_count < retries and sock is None:
             retry_count += 1
 
             try:
@@ -386,6 +545,7 @@ class MQTT:
         self._lw_topic = topic
         self._lw_msg = payload
         self._lw_retain = retain
+        self._connect_frame = None
 
     def add_topic_callback(self, mqtt_topic, callback_method):
         """Registers a callback_method for a specific MQTT topic.
@@ -397,6 +557,40 @@ class MQTT:
             raise ValueError("MQTT topic and callback method must both be defined.")
         self._on_message_filtered[mqtt_topic] = callback_method
 
+    def add_stream_callback(self, mqtt_topic, callback_method, chunk_size=256):
+        """Registers a callback_method receiving the payloads of a topic in chunks,
+        straight from the receive buffer, so that payloads larger than it never
+        need to be held whole. Such messages do not go to the other callbacks.
+
+        Expected method signature is ``callback(client, topic, chunk, offset, total)``
+        where ``chunk`` is a `memoryview` of at most ``chunk_size`` bytes, valid
+        only during the call, starting at ``offset`` in a payload of ``total``
+        bytes. The payload is complete when ``offset + len(chunk) == total``.
+        Requires ``recv_buffer_size``.
+
+        :param str mqtt_topic: MQTT topic identifier.
+        :param function callback_method: The callback method.
+        :param int chunk_size: Largest chunk passed to the callback, in bytes.
+        """
+        if mqtt_topic is None or callback_method is None:
+            raise ValueError("MQTT topic and callback method must both be defined.")
+        if self._parser is None:
+            raise MMQTTException("Streaming payloads requires recv_buffer_size.")
+        self._on_stream_filtered[mqtt_topic] = (callback_method, chunk_size)
+        self._streaming = True
+
+    def remove_stream_callback(self, mqtt_topic):
+        """Removes a callback method registered with `add_stream_callback`.
+
+        :param str mqtt_topic: MQTT topic identifier string.
+        """
+        try:
+            del self._on_stream_filtered[mqtt_topic]
+        except KeyError:
+            raise KeyError(
+                "MQTT topic callback not added with add_stream_callback."
+            ) from None
+
     def remove_topic_callback(self, mqtt_topic):
         """Removes a registered callback method.
 
@@ -424,6 +618,15 @@ class MQTT:
         self._on_message = method
 
     def _handle_on_message(self, client, topic, message):
+        if self._executor is not None:
+            # The body may be a view of the receive buffer, copy it for the worker
+            if not isinstance(message, str):
+                message = bytes(message)
+            self._executor.submit(self._dispatch_message, client, topic, message)
+            return
+        self._dispatch_message(client, topic, message)
+
+    def _dispatch_message(self, client, topic, message):
         matched = False
         if topic is not None:
             for callback in self._on_message_filtered.iter_match(topic):
@@ -445,6 +648,7 @@ class MQTT:
         self._username = username
         if password is not None:
             self._password = password
+        self._connect_frame = None
 
     # pylint: disable=too-many-branches, too-many-statements, too-many-locals
     def connect(self, clean_session=True, host=None, port=None, keep_alive=None):
@@ -463,94 +667,47 @@ class MQTT:
         if keep_alive:
             self.keep_alive = keep_alive
 
+        return self._connect(clean_session)
+
+    def _connect(self, clean_session, retries=None):
+        """Opens a socket to the broker and sends the CONNECT packet, returning
+        the session present flag.
+
+        :param bool clean_session: Establishes a persistent session.
+        :param int retries: Connection attempts, defaults to ``connect_retries``.
+        """
         if self.logger is not None:
             self.logger.debug("Attempting to establish MQTT connection...")
 
         # Get a new socket
         self._sock = self._get_connect_socket(
-            self.broker, self.port, timeout=self._socket_timeout
+            self.broker, self.port, timeout=self._socket_timeout, retries=retries
         )
+        if self._parser is not None:
+            self._parser.reset()
+        self._stream = None
+        self._ping_sent = 0
+        self._timestamp = 0
 
-        # Fixed Header
-        fixed_header = bytearray([0x10])
-
-        # NOTE: Variable header is
-        # MQTT_HDR_CONNECT = bytearray(b"\x04MQTT\x04\x02\0\0")
-        # because final 4 bytes are 4, 2, 0, 0
-        var_header = MQTT_HDR_CONNECT
-        var_header[6] = clean_session << 1
-
-        # Set up variable header and remaining_length
-        remaining_length = 12 + len(self.client_id.encode("utf-8"))
-        if self._username:
-            remaining_length += (
-                2
-                + len(self._username.encode("utf-8"))
-                + 2
-                + len(self._password.encode("utf-8"))
-            )
-            var_header[6] |= 0xC0
-        if self.keep_alive:
-            assert self.keep_alive < MQTT_TOPIC_LENGTH_LIMIT
-            var_header[7] |= self.keep_alive >> 8
-            var_header[8] |= self.keep_alive & 0x00FF
-        if self._lw_topic:
-            remaining_length += (
-                2 + len(self._lw_topic.encode("utf-8")) + 2 + len(self._lw_msg)
-            )
-            var_header[6] |= 0x4 | (self._lw_qos & 0x1) << 3 | (self._lw_qos & 0x2) << 3
-            var_header[6] |= self._lw_retain << 5
-
-        # Remaining length calculation
-        large_rel_length = False
-        if remaining_length > 0x7F:
-            large_rel_length = True
-            # Calculate Remaining Length [2.2.3]
-            while remaining_length > 0:
-                encoded_byte = remaining_length % 0x80
-                remaining_length = remaining_length // 0x80
-                # if there is more data to encode, set the top bit of the byte
-                if remaining_length > 0:
-                    encoded_byte |= 0x80
-                fixed_header.append(encoded_byte)
-        if large_rel_length:
-            fixed_header.append(0x00)
-        else:
-            fixed_header.append(remaining_length)
-            fixed_header.append(0x00)
-
+        frame = self._connect_packet(clean_session)
         if self.logger is not None:
             self.logger.debug("Sending CONNECT to broker...")
-            self.logger.debug(
-                "Fixed Header: %s\nVariable Header: %s", fixed_header, var_header
-            )
-        self._sock.send(fixed_header)
-        self._sock.send(var_header)
-        # [MQTT-3.1.3-4]
-        self._send_str(self.client_id)
-        if self._lw_topic:
-            # [MQTT-3.1.3-11]
-            self._send_str(self._lw_topic)
-            self._send_str(self._lw_msg)
-        if self._username is None:
-            self._username = None
-        else:
-            self._send_str(self._username)
-            self._send_str(self._password)
+            self.logger.debug("Packet: %s", frame)
+        self._send_all(frame)
+        self._trace(1, 0x10, len(frame), 0)
         if self.logger is not None:
             self.logger.debug("Receiving CONNACK packet from broker")
         stamp = time.monotonic()
         while True:
             op = self._wait_for_msg()
             if op == 32:
-                rc = self._sock_exact_recv(3)
-                assert rc[0] == 0x02
-                if rc[2] != 0x00:
-                    raise MMQTTException(CONNACK_ERRORS[rc[2]])
-                self._is_connected = True
-                result = rc[0] & 1
-                if self.on_connect is not None:
-                    self.on_connect(self, self._user_data, result, rc[2])
+                result = self._handle_connack(self._rx_body)
+                # In-flight messages are older than the queued ones, and go
+                # first so that a queued latest value is not overtaken
+                if self._inflight:
+                    self._retransmit()
+                if self._offline:
+                    self._flush_offline()
                 return result
 
             if op is None:
@@ -559,13 +716,85 @@ class MQTT:
                         f"No data received from broker for {self._recv_timeout} seconds."
                     )
 
+    def _connect_packet(self, clean_session):
+        """Returns the CONNECT packet, only encoding it again when what it is
+        built from has changed since the last connect.
+
+        :param bool clean_session: Establishes a persistent session.
+        """
+        self._clean_session = clean_session
+        key = (clean_session, self.keep_alive, self.client_id)
+        if self._connect_frame is None or self._connect_key != key:
+            size = self._encode_connect(clean_session)
+            self._connect_frame = bytes(self._tx_buf[:size])
+            self._connect_key = key
+        return self._connect_frame
+
+    def _encode_connect(self, clean_session):
+        """Encodes a CONNECT packet into the scratch buffer, returning its size.
+
+        :param bool clean_session: Establishes a persistent session.
+        """
+        client_id = self.client_id.encode("utf-8")
+        flags = clean_session << 1
+        # Variable header and client id [MQTT-3.1.3-4]
+        remaining_length = 12 + len(client_id)
+        if self._lw_topic:
+            lw_topic = self._lw_topic.encode("utf-8")
+            remaining_length += 2 + len(lw_topic) + 2 + len(self._lw_msg)
+            flags |= 0x4 | (self._lw_qos & 0x1) << 3 | (self._lw_qos & 0x2) << 3
+            flags |= self._lw_retain << 5
+        if self._username:
+            username = self._username.encode("utf-8")
+            password = (self._password or "").encode("utf-8")
+            remaining_length += 2 + len(username) + 2 + len(password)
+            flags |= 0xC0
+        assert self.keep_alive < MQTT_TOPIC_LENGTH_LIMIT
+
+        buf = self._tx_reserve(5 + remaining_length)
+        buf[0] = 0x10
+        i = self._encode_remaining_length(buf, 1, remaining_length)
+        # NOTE: Variable header is 0, followed by
+        # MQTT_HDR_CONNECT = b"\x04MQTT\x04\x02\0\0"
+        # where the final 3 bytes are the flags and the keep alive
+        buf[i] = 0x00
+        buf[i + 1 : i + 10] = MQTT_HDR_CONNECT
+        buf[i + 7] = flags
+        buf[i + 8] = self.keep_alive >> 8
+        buf[i + 9] = self.keep_alive & 0x00FF
+        i = self._encode_str(buf, i + 10, client_id)
+        if self._lw_topic:
+            # [MQTT-3.1.3-11]
+            i = self._encode_str(buf, i, lw_topic)
+            i = self._encode_str(buf, i, self._lw_msg)
+        if self._username:
+            i = self._encode_str(buf, i, username)
+            i = self._encode_str(buf, i, password)
+        return i
+
+    def _handle_connack(self, rc):
+        """Completes a connection, returning the session present flag.
+
+        :param memoryview rc: Body of the CONNACK packet.
+        """
+        if rc[1] != 0x00:
+            raise MMQTTException(CONNACK_ERRORS[rc[1]])
+        self._is_connected = True
+        result = rc[0] & 1
+        if self.on_connect is not None:
+            self.on_connect(self, self._user_data, result, rc[1])
+        return result
+
     def disconnect(self):
         """Disconnects the MiniMQTT client from the MQTT broker."""
+        if self._off_thread():
+            return self._call(self.disconnect)
         self._connected()
         if self.logger is not None:
             self.logger.debug("Sending DISCONNECT packet to broker")
         try:
-            self._sock.send(MQTT_DISCONNECT)
+            self._send_all(MQTT_DISCONNECT)
+            self._trace(1, MQTT_DISCONNECT[0], 0, 0)
         except RuntimeError as e:
             if self.logger is not None:
                 self.logger.warning("Unable to send DISCONNECT packet: {}".format(e))
@@ -582,14 +811,14 @@ class MQTT:
         there is an active network connection.
         Returns response codes of any messages received while waiting for PINGRESP.
         """
+        if self._off_thread():
+            return self._call(self.ping)
         self._connected()
-        if self.logger is not None:
-            self.logger.debug("Sending PINGREQ")
-        self._sock.send(MQTT_PINGREQ)
+        self._send_ping()
         ping_timeout = self.keep_alive
         stamp = time.monotonic()
-        rc, rcs = None, []
-        while rc != MQTT_PINGRESP:
+        rcs = []
+        while self._ping_sent:
             rc = self._wait_for_msg()
             if rc:
                 rcs.append(rc)
@@ -597,20 +826,263 @@ class MQTT:
                 raise MMQTTException("PINGRESP not returned from broker.")
         return rcs
 
+    def _send_ping(self):
+        """Sends a PINGREQ without waiting for its PINGRESP."""
+        if self._debug:
+            self.logger.debug("Sending PINGREQ")
+        self._send_all(MQTT_PINGREQ)
+        self._trace(1, MQTT_PINGREQ[0], 0, 0)
+        self._ping_sent = time.monotonic()
+
+    def _handle_pingresp(self):
+        """Records the round-trip time of the PINGREQ a PINGRESP answers."""
+        if not self._ping_sent:
+            return
+        rtt = time.monotonic() - self._ping_sent
+        self._ping_sent = 0
+        if len(self._rtt) < MQTT_RTT_SAMPLES:
+            self._rtt.append(rtt)
+        else:
+            self._rtt[self._rtt_next] = rtt
+        self._rtt_next = (self._rtt_next + 1) % MQTT_RTT_SAMPLES
+
+    @property
+    def ping_rtt(self):
+        """Returns the ``(min, avg, max)`` round-trip time, in seconds, of the last
+        PINGREQs answered, or ``None`` before the first PINGRESP."""
+        if not self._rtt:
+            return None
+        return min(self._rtt), sum(self._rtt) / len(self._rtt), max(self._rtt)
+
     # pylint: disable=too-many-branches, too-many-statements
     def publish(self, topic, msg, retain=False, qos=0):
         """Publishes a message to a topic provided.
 
-        :param str topic: Unique topic identifier.
+        :param str|PreparedTopic topic: Unique topic identifier.
         :param str|int|float|bytes msg: Data to send to the broker.
         :param bool retain: Whether the message is saved by the broker.
         :param int qos: Quality of Service level for the message, defaults to zero.
 
         """
+        self.publish_many([(topic, msg, qos, retain)])
+
+    def publish_many(self, messages):
+        """Publishes several messages with a single write. With QoS 1, the PUBACKs
+        are collected together once all messages are on the wire, or left to
+        `loop()` when ``max_inflight`` is set.
+
+        :param list messages: ``(topic, msg, qos, retain)`` tuples, see `publish`
+            for their meaning. Topics may be a `PreparedTopic`. ``qos`` and
+            ``retain`` may be left out.
+
+        While the network thread runs, publishes never wait for their PUBACK, and
+        those made from other threads are queued for it to send, once the in-flight
+        window has room for their QoS 1 messages. A batch of more QoS 1 messages
+        than ``max_inflight`` raises, wherever it is published from.
+
+        """
+        if self._off_thread():
+            if self._max_inflight and self._acks(messages) > self._max_inflight:
+                # Would wait in the queue forever, holding up what follows it
+                raise MMQTTException(
+                    "In-flight window of {} messages is full.".format(self._max_inflight)
+                )
+            self._submit((None, messages))
+            return
+        if self._offline_size and not self.is_connected():
+            self._queue_offline(messages)
+            return
         self._connected()
-        self._valid_topic(topic)
-        if "+" in topic or "#" in topic:
-            raise MMQTTException("Publish topic can not contain wildcards.")
+        size, packets, pending = self._encode_publishes(messages)
+        try:
+            self._send_packet(size)
+        except (OSError, MMQTTException):
+            if not self._offline_size:
+                raise
+            # Keep the messages for the next connection, and let the caller know
+            for pid in pending:
+                self._inflight.pop(pid, None)
+            self._queue_offline(messages)
+            raise
+        if self.on_publish is not None:
+            for topic, _, _, qos, _ in packets:
+                if qos == 0:
+                    self.on_publish(self, self._user_data, topic, self._pid)
+        if self._max_inflight or self._thread is not None:
+            return
+        stamp = time.monotonic()
+        while pending:
+            op = self._wait_for_msg()
+            if op == 0x40:
+                pending = [pid for pid in pending if pid in self._inflight]
+
+            if op is None:
+                if time.monotonic() - stamp > self._recv_timeout:
+                    for pid in pending:
+                        self._inflight.pop(pid, None)
+                    raise MMQTTException(
+                        f"No data received from broker for {self._recv_timeout} seconds."
+                    )
+
+    def _queue_offline(self, messages):
+        """Queues messages published while disconnected, dropping the oldest
+        queued ones past ``offline_queue_size`` bytes.
+
+        :param list messages: ``(topic, msg, qos, retain)`` tuples.
+        """
+        queue = self._offline
+        for message in messages:
+            topic, msg, qos, retain = (tuple(message) + (0, False))[:4]
+            if not isinstance(topic, PreparedTopic):
+                topic = PreparedTopic(topic)
+            msg = self._valid_publish(msg, qos)
+            size = len(topic.prefix) + len(msg)
+            if size > self._offline_size:
+                self._offline_dropped += 1
+                continue
+            if topic.latest:
+                for i, entry in enumerate(queue):
+                    if entry[0].topic == topic.topic:
+                        self._offline_bytes -= len(entry[0].prefix) + len(entry[1])
+                        del queue[i]
+                        self._offline_dropped += 1
+                        break
+            while self._offline_bytes + size > self._offline_size:
+                entry = queue.pop(0)
+                self._offline_bytes -= len(entry[0].prefix) + len(entry[1])
+                self._offline_dropped += 1
+            queue.append((topic, msg, qos, retain))
+            self._offline_bytes += size
+
+    def _flush_offline(self):
+        """Publishes the queued messages with a single write, as many as the
+        in-flight window has room for."""
+        queue = self._offline
+        count = len(queue)
+        if self._max_inflight:
+            room = self._max_inflight - len(self._inflight)
+            for count, entry in enumerate(queue):
+                room -= entry[2]
+                if room < 0:
+                    break
+            else:
+                count = len(queue)
+        if not count:
+            return
+        batch = queue[:count]
+        del queue[:count]
+        for entry in batch:
+            self._offline_bytes -= len(entry[0].prefix) + len(entry[1])
+        if self.logger is not None:
+            self.logger.debug("Sending %d messages queued while offline", count)
+        self.publish_many(batch)
+
+    @property
+    def offline_stats(self):
+        """Returns ``(queued, dropped)``: how many messages wait to be sent once
+        connected, and how many were dropped or replaced to respect
+        ``offline_queue_size``."""
+        return len(self._offline), self._offline_dropped
+
+    def _encode_publishes(self, messages):
+        """Encodes PUBLISH packets into the scratch buffer and adds the QoS 1 ones
+        to the in-flight table. Returns the total size, the validated messages
+        and the packet ids awaiting a PUBACK.
+
+        :param list messages: ``(topic, msg, qos, retain)`` tuples.
+        """
+        packets = []
+        size = 0
+        acks = 0
+        for message in messages:
+            topic, msg, qos, retain = (tuple(message) + (0, False))[:4]
+            if not isinstance(topic, PreparedTopic):
+                topic = PreparedTopic(topic)
+            msg = self._valid_publish(msg, qos)
+            size += 5 + len(topic.prefix) + 2 + len(msg)
+            packets.append((topic.topic, topic.prefix, msg, qos, retain))
+            acks += qos
+        if self._max_inflight and len(self._inflight) + acks > self._max_inflight:
+            raise MMQTTException(
+                "In-flight window of {} messages is full.".format(self._max_inflight)
+            )
+
+        buf = self._tx_reserve(size)
+        i = 0
+        pending = []
+        for topic, prefix, msg, qos, retain in packets:
+            start = i
+            remaining_length = len(prefix) + len(msg)
+            if qos > 0:
+                # packet identifier where QoS level is 1 or 2. [3.3.2.2]
+                remaining_length += 2
+                self._pid = self._pid + 1 if self._pid < 0xFFFF else 1
+
+            # fixed header. [3.3.1.2], [3.3.1.3]
+            buf[i] = 0x30 | retain | qos << 1
+            i = self._encode_remaining_length(buf, i + 1, remaining_length)
+            buf[i : i + len(prefix)] = prefix
+            i += len(prefix)
+            if qos > 0:
+                buf[i] = self._pid >> 8
+                buf[i + 1] = self._pid & 0xFF
+                i += 2
+            buf[i : i + len(msg)] = msg
+            i += len(msg)
+            if qos > 0:
+                # Keep a copy of the packet around to retransmit it
+                packet = bytearray(buf[start:i]) if self._max_inflight else None
+                self._inflight[self._pid] = [topic, packet, time.monotonic()]
+                pending.append(self._pid)
+
+            self._trace(1, buf[start], remaining_length, self._pid if qos else 0)
+            if self._debug:
+                self.logger.debug(
+                    "Sending PUBLISH to %s, %d bytes, QoS %d", topic, len(msg), qos
+                )
+        return i, packets, pending
+
+    def _handle_puback(self, pid):
+        """Completes the in-flight QoS 1 message a PUBACK is for.
+
+        :param int pid: Packet identifier of the PUBACK.
+        """
+        entry = self._inflight.pop(pid, None)
+        if entry is not None and self.on_publish is not None:
+            self.on_publish(self, self._user_data, entry[0], pid)
+
+    def _retransmit(self):
+        """Resends, with the DUP flag, in-flight messages whose PUBACK is overdue."""
+        now = time.monotonic()
+        for pid, entry in self._inflight.items():
+            if entry[1] is not None and now - entry[2] > self._recv_timeout:
+                if self._debug:
+                    self.logger.debug("Retransmitting PUBLISH with PID %d", pid)
+                entry[1][0] |= 0x08  # DUP [3.3.1.1]
+                entry[2] = now
+                self._send_all(entry[1])
+                self._trace(1, entry[1][0], len(entry[1]), pid)
+
+    @staticmethod
+    def prepare_topic(topic, latest=False):
+        """Validates and encodes a topic that is published to repeatedly. Passing
+        the returned `PreparedTopic` to `publish` or `publish_many` leaves them
+        only the payload to encode.
+
+        :param str topic: Unique topic identifier.
+        :param bool latest: While offline, a new message replaces the one queued
+            for this topic instead of being queued after it, as for telemetry.
+        """
+        return PreparedTopic(topic, latest)
+
+    @staticmethod
+    def _valid_publish(msg, qos):
+        """Validates the payload of a PUBLISH, returning it as bytes.
+
+        :param str|int|float|bytes msg: Data to send to the broker.
+        :param int qos: Quality of Service level for the message.
+
+        """
         # check msg/qos kwargs
         if msg is None:
             raise MMQTTException("Message can not be None.")
@@ -627,70 +1099,13 @@ class MQTT:
         assert (
             0 <= qos <= 1
         ), "Quality of Service Level 2 is unsupported by this library."
+        return msg
 
-        # fixed header. [3.3.1.2], [3.3.1.3]
-        pub_hdr_fixed = bytearray([0x30 | retain | qos << 1])
-
-        # variable header = 2-byte Topic length (big endian)
-        pub_hdr_var = bytearray(struct.pack(">H", len(topic.encode("utf-8"))))
-        pub_hdr_var.extend(topic.encode("utf-8"))  # Topic name
-
-        remaining_length = 2 + len(msg) + len(topic.encode("utf-8"))
-        if qos > 0:
-            # packet identifier where QoS level is 1 or 2. [3.3.2.2]
-            remaining_length += 2
-            self._pid = self._pid + 1 if self._pid < 0xFFFF else 1
-            pub_hdr_var.append(self._pid >> 8)
-            pub_hdr_var.append(self._pid & 0xFF)
-
-        # Calculate remaining length [2.2.3]
-        if remaining_length > 0x7F:
-            while remaining_length > 0:
-                encoded_byte = remaining_length % 0x80
-                remaining_length = remaining_length // 0x80
-                if remaining_length > 0:
-                    encoded_byte |= 0x80
-                pub_hdr_fixed.append(encoded_byte)
-        else:
-            pub_hdr_fixed.append(remaining_length)
-
-        if self.logger is not None:
-            self.logger.debug(
-                "Sending PUBLISH\nTopic: %s\nMsg: %s\
-                                \nQoS: %d\nRetain? %r",
-                topic,
-                msg,
-                qos,
-                retain,
-            )
-        self._sock.send(pub_hdr_fixed)
-        self._sock.send(pub_hdr_var)
-        self._sock.send(msg)
-        if qos == 0 and self.on_publish is not None:
-            self.on_publish(self, self._user_data, topic, self._pid)
-        if qos == 1:
-            stamp = time.monotonic()
-            while True:
-                op = self._wait_for_msg()
-                if op == 0x40:
-                    sz = self._sock_exact_recv(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self._sock_exact_recv(2)
-                    rcv_pid = rcv_pid[0] << 0x08 | rcv_pid[1]
-                    if self._pid == rcv_pid:
-                        if self.on_publish is not None:
-                            self.on_publish(self, self._user_data, topic, rcv_pid)
-                        return
-
-                if op is None:
-                    if time.monotonic() - stamp > self._recv_timeout:
-                        raise MMQTTException(
-                            f"No data received from broker for {self._recv_timeout} seconds."
-                        )
-
-    def subscribe(self, topic, qos=0):
+    def subscribe(self, topic, qos=0, payload_type=None):
         """Subscribes to a topic on the MQTT Broker.
-        This method can subscribe to one topics or multiple topics.
+        This method can subscribe to one topics or multiple topics. Multiple
+        topics are sent in a single SUBSCRIBE packet and acknowledged by a
+        single SUBACK, so a list costs one round trip.
 
         :param str|tuple|list topic: Unique MQTT topic identifier string. If
                                      this is a `tuple`, then the tuple should
@@ -701,9 +1116,44 @@ class MQTT:
         :param int qos: Quality of Service level for the topic, defaults to
                         zero. Conventional options are ``0`` (send at most once), ``1``
                         (send at least once), or ``2`` (send exactly once).
+        :param type payload_type: How messages on these topics are passed to
+                        callbacks: `str`, `bytes`, `bytearray`, or `memoryview`
+                        (no copy, valid only during the callback when
+                        ``recv_buffer_size`` is set). Defaults to ``None``
+                        (as set by ``use_binary_mode``, or by an earlier
+                        subscription to the same topic).
 
         """
+        if self._off_thread():
+            return self._call(self.subscribe, topic, qos, payload_type)
         self._connected()
+        self._valid_payload_type(payload_type)
+        size, topics, packet_id_bytes = self._encode_subscribe(topic, qos)
+        self._send_packet(size)
+        stamp = time.monotonic()
+        while True:
+            op = self._wait_for_msg()
+            if op == 0x90:
+                rc = self._rx_body
+                if rc[0] != packet_id_bytes[0] or rc[1] != packet_id_bytes[1]:
+                    continue
+                self._handle_suback(topics, rc)
+                self._set_payload_type(topics, payload_type)
+                return
+
+            if op is None:
+                if time.monotonic() - stamp > self._recv_timeout:
+                    raise MMQTTException(
+                        f"No data received from broker for {self._recv_timeout} seconds."
+                    )
+
+    def _encode_subscribe(self, topic, qos):
+        """Encodes a SUBSCRIBE packet into the scratch buffer. Returns its size,
+        the ``(topic, qos)`` list subscribed to and the packet id bytes.
+
+        :param str|tuple|list topic: Topic or topics, see `subscribe`.
+        :param int qos: Quality of Service level for the topic.
+        """
         topics = None
         if isinstance(topic, tuple):
             topic, qos = topic
@@ -720,34 +1170,65 @@ class MQTT:
                 self._valid_topic(t)
                 topics.append((t, q))
         # Assemble packet
+        encoded = [t.encode("utf-8") for t, q in topics]
         packet_length = 2 + (2 * len(topics)) + (1 * len(topics))
-        packet_length += sum(len(topic.encode("utf-8")) for topic, qos in topics)
-        packet_length_byte = packet_length.to_bytes(1, "big")
+        packet_length += sum(len(t) for t in encoded)
         self._pid = self._pid + 1 if self._pid < 0xFFFF else 1
         packet_id_bytes = self._pid.to_bytes(2, "big")
         # Packet with variable and fixed headers
-        packet = MQTT_SUB + packet_length_byte + packet_id_bytes
+        buf = self._tx_reserve(5 + packet_length)
+        buf[0] = MQTT_SUB[0]
+        i = self._encode_remaining_length(buf, 1, packet_length)
+        buf[i : i + 2] = packet_id_bytes
+        i += 2
         # attaching topic and QOS level to the packet
-        for t, q in topics:
-            topic_size = len(t.encode("utf-8")).to_bytes(2, "big")
-            qos_byte = q.to_bytes(1, "big")
-            packet += topic_size + t.encode() + qos_byte
+        for t, (_, q) in zip(encoded, topics):
+            i = self._encode_str(buf, i, t)
+            buf[i] = q
+            i += 1
+        self._trace(1, buf[0], packet_length, self._pid)
         if self.logger is not None:
             for t, q in topics:
                 self.logger.debug("SUBSCRIBING to topic %s with QoS %d", t, q)
-        self._sock.send(packet)
-        stamp = time.monotonic()
+        return i, topics, packet_id_bytes
+
+    def _handle_suback(self, topics, rc):
+        """Completes a subscription.
+
+        :param list topics: ``(topic, qos)`` list that was subscribed to.
+        :param memoryview rc: Body of the SUBACK packet.
+        """
+        # packet id followed by one return code per topic [3.9.3]
+        if len(rc) != 2 + len(topics):
+            raise MMQTTException("SUBACK does not match SUBSCRIBE.")
+        for (t, _), granted_qos in zip(topics, rc[2:]):
+            if granted_qos == 0x80:
+                raise MMQTTException("SUBACK Failure for {}!".format(t))
+            if self.on_subscribe is not None:
+                self.on_subscribe(self, self._user_data, t, granted_qos)
+            self._subscribed_topics.append(t)
+
+    def unsubscribe(self, topic):
+        """Unsubscribes from a MQTT topic.
+
+        :param str|list topic: Unique MQTT topic identifier string or list.
+
+        """
+        if self._off_thread():
+            return self._call(self.unsubscribe, topic)
+        size, topics, packet_id_bytes = self._encode_unsubscribe(topic)
+        self._send_packet(size)
+        if self.logger is not None:
+            self.logger.debug("Waiting for UNSUBACK...")
         while True:
+            stamp = time.monotonic()
             op = self._wait_for_msg()
-            if op == 0x90:
-                rc = self._sock_exact_recv(4)
-                assert rc[1] == packet[2] and rc[2] == packet[3]
-                if rc[3] == 0x80:
-                    raise MMQTTException("SUBACK Failure!")
-                for t, q in topics:
-                    if self.on_subscribe is not None:
-                        self.on_subscribe(self, self._user_data, t, q)
-                    self._subscribed_topics.append(t)
+            if op == 176:
+                rc = self._rx_body
+                # [MQTT-3.32]
+                if rc[0] != packet_id_bytes[0] or rc[1] != packet_id_bytes[1]:
+                    continue
+                self._handle_unsuback(topics)
                 return
 
             if op is None:
@@ -756,11 +1237,11 @@ class MQTT:
                         f"No data received from broker for {self._recv_timeout} seconds."
                     )
 
-    def unsubscribe(self, topic):
-        """Unsubscribes from a MQTT topic.
-
-        :param str|list topic: Unique MQTT topic identifier string or list.
+    def _encode_unsubscribe(self, topic):
+        """Encodes an UNSUBSCRIBE packet into the scratch buffer. Returns its size,
+        the topics unsubscribed from and the packet id bytes.
 
+        :param str|list topic: Topic or topics, see `unsubscribe`.
         """
         topics = None
         if isinstance(topic, str):
@@ -779,38 +1260,55 @@ class MQTT:
         # Assemble packet
         packet_length = 2 + (2 * len(topics))
         packet_length += sum(len(topic.encode("utf-8")) for topic in topics)
-        packet_length_byte = packet_length.to_bytes(1, "big")
         self._pid = self._pid + 1 if self._pid < 0xFFFF else 1
         packet_id_bytes = self._pid.to_bytes(2, "big")
-        packet = MQTT_UNSUB + packet_length_byte + packet_id_bytes
+        buf = self._tx_reserve(5 + packet_length)
+        buf[0] = MQTT_UNSUB[0]
+        i = self._encode_remaining_length(buf, 1, packet_length)
+        buf[i : i + 2] = packet_id_bytes
+        i += 2
         for t in topics:
-            topic_size = len(t.encode("utf-8")).to_bytes(2, "big")
-            packet += topic_size + t.encode()
+            i = self._encode_str(buf, i, t.encode("utf-8"))
+        self._trace(1, buf[0], packet_length, self._pid)
         if self.logger is not None:
             for t in topics:
                 self.logger.debug("UNSUBSCRIBING from topic %s", t)
-        self._sock.send(packet)
-        if self.logger is not None:
-            self.logger.debug("Waiting for UNSUBACK...")
-        while True:
-            stamp = time.monotonic()
-            op = self._wait_for_msg()
-            if op == 176:
-                rc = self._sock_exact_recv(3)
-                assert rc[0] == 0x02
-                # [MQTT-3.32]
-                assert rc[1] == packet_id_bytes[0] and rc[2] == packet_id_bytes[1]
-                for t in topics:
-                    if self.on_unsubscribe is not None:
-                        self.on_unsubscribe(self, self._user_data, t, self._pid)
-                    self._subscribed_topics.remove(t)
-                return
+        return i, topics, packet_id_bytes
 
-            if op is None:
-                if time.monotonic() - stamp > self._recv_timeout:
-                    raise MMQTTException(
-                        f"No data received from broker for {self._recv_timeout} seconds."
-                    )
+    @staticmethod
+    def _valid_payload_type(payload_type):
+        """Validates a payload type.
+
+        :param type payload_type: Payload type of a subscription.
+        """
+        if payload_type not in (None, str, bytes, bytearray, memoryview):
+            raise MMQTTException("Payload type must be str, bytes or memoryview.")
+
+    def _set_payload_type(self, topics, payload_type):
+        """Records the payload type of subscriptions.
+
+        :param list topics: ``(topic, qos)`` list that was subscribed to.
+        :param type payload_type: Payload type, ``None`` to keep the current one.
+        """
+        if payload_type is None:
+            return
+        for t, _ in topics:
+            self._payload_types[t] = payload_type
+        self._payload_typed = True
+
+    def _handle_unsuback(self, topics):
+        """Completes an unsubscription.
+
+        :param list topics: Topics that were unsubscribed from.
+        """
+        for t in topics:
+            if self.on_unsubscribe is not None:
+                self.on_unsubscribe(self, self._user_data, t, self._pid)
+            self._subscribed_topics.remove(t)
+            try:
+                del self._payload_types[t]
+            except KeyError:
+                pass
 
     def reconnect(self, resub_topics=True):
         """Attempts to reconnect to the MQTT broker.
@@ -818,9 +1316,11 @@ class MQTT:
         :param bool resub_topics: Resubscribe to previously subscribed topics.
 
         """
+        if self._off_thread():
+            return self._call(self.reconnect, resub_topics)
         if self.logger is not None:
             self.logger.debug("Attempting to reconnect with MQTT broker")
-        self.connect()
+        self.connect(clean_session=self._clean_session)
         if self.logger is not None:
             self.logger.debug("Reconnected with broker")
         if resub_topics:
@@ -830,33 +1330,146 @@ class MQTT:
                 )
             subscribed_topics = self._subscribed_topics.copy()
             self._subscribed_topics = []
-            while subscribed_topics:
-                feed = subscribed_topics.pop()
-                self.subscribe(feed)
+            if subscribed_topics:
+                self.subscribe([(feed, 0) for feed in subscribed_topics])
 
-    def loop(self, timeout=0):
-        # pylint: disable = too-many-return-statements
+    def reconnect_step(self, resub_topics=True):
+        """Non-blocking reconnect. Makes a single connection attempt once the delay
+        since the previous one has passed, and returns right away otherwise, so
+        the caller keeps control between attempts. The delay starts at zero and
+        doubles, with jitter, from ``MQTT_RECONNECT_MIN`` up to ``MQTT_RECONNECT_MAX``
+        seconds. The ``clean_session`` of the last `connect` is reused: with
+        ``False``, the broker keeps the subscriptions and they are not sent again.
+        Returns ``True`` once connected.
+
+        Call it after `loop` or a publish failed, until it returns ``True``.
+
+        :param bool resub_topics: Resubscribe to previously subscribed topics if
+            the broker did not keep them. ``on_connect`` may do it instead, based
+            on its ``flags``.
+
+        """
+        now = time.monotonic()
+        if self._down_since is None:
+            self._down_since = now
+            self._retry_at = now
+            self._backoff = 0
+            self._is_connected = False
+        if now < self._retry_at:
+            return False
+
+        # Unacknowledged QoS 1 messages are sent again, with the DUP flag
+        for entry in self._inflight.values():
+            entry[2] = 0
+        subscribed_topics = self._subscribed_topics
+        self._subscribed_topics = []
+        try:
+            session_present = self._connect(self._clean_session, retries=1)
+        except (OSError, RuntimeError, MMQTTException) as e:
+            self._subscribed_topics = subscribed_topics
+            self._backoff = min(
+                max(self._backoff * 2, MQTT_RECONNECT_MIN), MQTT_RECONNECT_MAX
+            )
+            self._retry_at = time.monotonic() + uniform(0.5, 1) * self._backoff
+            if self.logger is not None:
+                self.logger.debug(
+                    "Reconnect failed, next attempt in %.1fs: %s",
+                    self._retry_at - time.monotonic(),
+                    e,
+                )
+            return False
+
+        self._reconnect_time = time.monotonic() - self._down_since
+        self._reconnects += 1
+        self._down_since = None
+        if session_present:
+            for topic in subscribed_topics:
+                if topic not in self._subscribed_topics:
+                    self._subscribed_topics.append(topic)
+        elif resub_topics:
+            topics = [t for t in subscribed_topics if t not in self._subscribed_topics]
+            if topics:
+                self.subscribe([(t, 0) for t in topics])
+        return True
+
+    @property
+    def reconnect_stats(self):
+        """Returns ``(reconnects, seconds)``: how many times `reconnect_step`
+        reconnected, and how long the last outage took from its first call,
+        ``None`` before any."""
+        return self._reconnects, self._reconnect_time
+
+    def poll(self, timeout=0):
+        """Waits for incoming data without reading it. Uses ``select`` on sockets
+        that support it and ``available()`` on ESP32SPI sockets.
+        Returns `True` once there is data to read, `False` if none arrived
+        within ``timeout``, or `None` if the socket can not be polled.
+
+        :param float timeout: How long to wait for data, in seconds.
+
+        """
+        if self._parser is not None and self._parser.pending():
+            return True
+        sock = self._sock
+        if hasattr(sock, "available"):
+            stamp = time.monotonic()
+            while not sock.available():
+                if time.monotonic() - stamp >= timeout:
+                    return False
+                time.sleep(MQTT_POLL_INTERVAL)
+            return True
+        if select is not None and hasattr(sock, "fileno"):
+            readable, _, _ = select.select([sock], [], [], timeout)
+            return bool(readable)
+        return None
+
+    def loop(self, timeout=0, max_messages=0, max_time=None):
+        # pylint: disable = too-many-return-statements, too-many-branches
         """Non-blocking message loop. Use this method to
         check incoming subscription messages.
+        Blocks until data arrives or ``timeout`` elapses, then returns as soon
+        as the data waiting has been processed, or the budget given by
+        ``max_messages`` and ``max_time`` is used up. `loop_stats` then tells
+        how many messages were handled and whether more are waiting.
         Returns response codes of any messages received.
 
         :param int timeout: Socket timeout, in seconds.
+        :param int max_messages: Most messages to handle, defaults to ``0`` (no limit).
+        :param float max_time: Most time to spend handling messages, in seconds.
+            Defaults to ``recv_timeout``.
 
         """
 
+        self._connected()
         if self._timestamp == 0:
             self._timestamp = time.monotonic()
         current_time = time.monotonic()
-        if current_time - self._timestamp >= self.keep_alive:
-            self._timestamp = 0
+        if not self._ping_sent and current_time - self._timestamp >= self.keep_alive:
+            self._timestamp = current_time
             # Handle KeepAlive by expecting a PINGREQ/PINGRESP from the server
-            if self.logger is not None:
+            if self._debug:
                 self.logger.debug(
                     "KeepAlive period elapsed - requesting a PINGRESP from the server..."
                 )
-            rcs = self.ping()
-            return rcs
+            self._send_ping()
+
+        if self._inflight:
+            self._retransmit()
+        if self._offline and self._is_connected:
+            self._flush_offline()
+
+        self._loop_handled = 0
+        self._loop_pending = False
+        ready = self.poll(timeout)
+        if ready is False:
+            self._check_pingresp()
+            return None
+        if ready:
+            # Data is waiting, only wait for the rest of a packet
+            timeout = self._socket_timeout
 
+        if max_time is None:
+            max_time = self._recv_timeout
         stamp = time.monotonic()
         self._sock.settimeout(timeout)
         rcs = []
@@ -865,20 +1478,205 @@ class MQTT:
             rc = self._wait_for_msg(timeout)
             if rc is None:
                 break
-            if time.monotonic() - stamp > self._recv_timeout:
-                if self.logger is not None:
+            rcs.append(rc)
+            more = self.poll()
+            if more is False:
+                break
+            if len(rcs) == max_messages or time.monotonic() - stamp > max_time:
+                # Unpollable sockets are assumed to have more
+                self._loop_pending = True
+                if self._debug:
                     self.logger.debug(
-                        f"Loop timed out, message queue not empty after {self._recv_timeout}s"
+                        f"Loop budget used up after {len(rcs)} messages, more pending"
                     )
                 break
-            rcs.append(rc)
 
+        self._loop_handled = len(rcs)
+        if not self._loop_pending:
+            # Only once everything waiting was read, which may hold the PINGRESP
+            self._check_pingresp()
         return rcs if rcs else None
 
+    def _check_pingresp(self):
+        """Drops the connection if the PINGRESP to the last PINGREQ is overdue.
+        The PINGRESP is matched as it is received, see _handle_pingresp.
+        """
+        if (
+            self._ping_sent
+            and time.monotonic() - self._ping_sent > self._recv_timeout
+        ):
+            # The link is half-open
+            self._drop_connection()
+            raise MMQTTException("PINGRESP not returned from broker.")
+
+    def _drop_connection(self):
+        """Closes the socket of a dead connection, so that later calls keep
+        failing until the client reconnects.
+        """
+        self._ping_sent = 0
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._is_connected = False
+
+    @property
+    def loop_stats(self):
+        """Returns ``(handled, pending)`` for the last `loop` call: how many
+        messages it handled, and whether it returned with more waiting because
+        its budget was used up."""
+        return self._loop_handled, self._loop_pending
+
+    def loop_start(self, workers=0):
+        """Starts a background thread that runs the network loop, for hosts with
+        ``threading`` such as CPython. While it runs, `loop` must not be called,
+        publishes from other threads are queued for the thread to send in batches,
+        and `subscribe`, `unsubscribe`, `ping`, `reconnect` and `disconnect` made
+        from other threads are run by it, blocking the caller until done.
+        The thread ends on `loop_stop`, `disconnect` or a connection error.
+
+        :param int workers: Number of threads message callbacks are run on, in no
+            guaranteed order. Defaults to ``0`` (run them on the network thread).
+
+        """
+        if threading is None or select is None:
+            raise MMQTTException("loop_start requires threading and select.")
+        if self._thread is not None:
+            raise MMQTTException("Network thread is already running.")
+        self._connected()
+        self._lock = threading.Lock()
+        self._outbox = []
+        self._wake = os.pipe()
+        if workers:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread_stop = False
+        self._thread = threading.Thread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        """Stops the network thread started by `loop_start`, once the messages
+        it has queued are sent and the callbacks running are done."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._thread_stop = True
+        os.write(self._wake[1], b"\0")
+        if thread is not threading.current_thread():
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        os.close(self._wake[0])
+        os.close(self._wake[1])
+        self._thread = None
+
+    def _off_thread(self):
+        """Returns True if the network thread runs and the caller is another thread."""
+        return (
+            self._thread is not None
+            and self._outbox is not None
+            and threading.current_thread() is not self._thread
+        )
+
+    def _submit(self, item):
+        """Queues :item for the network thread, waking it up if it was idle"""
+        with self._lock:
+            if self._outbox is None:
+                raise MMQTTException("Network thread has stopped.")
+            self._outbox.append(item)
+            wake = len(self._outbox) == 1
+        if wake:
+            os.write(self._wake[1], b"\0")
+
+    def _call(self, method, *args):
+        """Runs :method on the network thread and returns its result"""
+        item = (method, args, [threading.Event(), None, None])
+        self._submit(item)
+        done = item[2]
+        done[0].wait()
+        if done[2] is not None:
+            raise done[2]
+        return done[1]
+
+    @staticmethod
+    def _acks(messages):
+        """Returns how many of ``(topic, msg, qos, retain)`` :messages are QoS 1"""
+        return sum((tuple(m) + (0, False))[2] for m in messages)
+
+    def _run_outbox(self):
+        """Sends the queued publishes, batched within the in-flight window, and
+        runs the queued calls, in the order they were made"""
+        with self._lock:
+            items, self._outbox = self._outbox, []
+        batch = []
+        room = self._max_inflight - len(self._inflight)
+        for n, (method, args, *done) in enumerate(items):
+            if method is None:
+                acks = self._acks(args)
+                if self._max_inflight and acks > room:
+                    # Wait for PUBACKs, keeping what is left at the front of the queue
+                    if batch:
+                        self.publish_many(batch)
+                    with self._lock:
+                        self._outbox[0:0] = items[n:]
+                    return
+                room -= acks
+                batch.extend(args)
+                continue
+            if batch:
+                self.publish_many(batch)
+                batch = []
+            done = done[0]
+            try:
+                done[1] = method(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                done[2] = e
+            done[0].set()
+        if batch:
+            self.publish_many(batch)
+
+    def _thread_main(self):
+        """Network thread: sends what other threads queued, and reads the socket"""
+        wake = self._wake[0]
+        try:
+            while self._is_connected:
+                self._run_outbox()
+                if self._thread_stop or not self._is_connected:
+                    break
+                readable, _, _ = select.select(
+                    [self._sock, wake], [], [], min(self.keep_alive, 1)
+                )
+                if wake in readable:
+                    os.read(wake, 64)
+                self.loop()
+        except (OSError, MMQTTException) as e:
+            if self.logger is not None:
+                self.logger.warning("Network thread stopped: {}".format(e))
+            self._is_connected = False
+            if self.on_disconnect is not None:
+                self.on_disconnect(self, self._user_data, 1)
+        # Fail the calls nobody will run anymore, later ones run on their caller
+        with self._lock:
+            items, self._outbox = self._outbox, None
+        for _, _, *done in items:
+            if done:
+                done[0][2] = MMQTTException("MiniMQTT is not connected")
+                done[0][0].set()
+
     def _wait_for_msg(self, timeout=0.1):
         # pylint: disable = too-many-return-statements
 
         """Reads and processes network events."""
+        if self._parser is not None:
+            try:
+                op = self._parse_next()
+                if op is None and self._rx_fill():
+                    op = self._parse_next()
+            except ValueError as error:
+                raise MMQTTException(error) from error
+            return op
+
         # CPython socket module contains a timeout attribute
         if hasattr(self._socket_pool, "timeout"):
             try:
@@ -896,53 +1694,207 @@ class MQTT:
 
         # Block while we parse the rest of the response
         self._sock.settimeout(timeout)
-        if res in [None, b"", b"\x00"]:
+        if not res or res[0] == 0x00:
             # If we get here, it means that there is nothing to be received
             return None
-        if res[0] == MQTT_PINGRESP:
-            if self.logger is not None:
-                self.logger.debug("Got PINGRESP")
-            sz = self._sock_exact_recv(1)[0]
-            if sz != 0x00:
-                raise MMQTTException(
-                    "Unexpected PINGRESP returned from broker: {}.".format(sz)
-                )
-            return MQTT_PINGRESP
-        if res[0] & 0xF0 != 0x30:
-            return res[0]
         sz = self._recv_len()
+        body = self._sock_exact_recv(sz) if sz else bytearray()
+        return self._handle_packet(res[0], sz, memoryview(body))
+
+    def _parse_next(self):
+        """Processes the next packet in the receive buffer, or the next bytes of
+        the payload being streamed. Returns the packet type, or ``None`` if more
+        bytes are needed.
+        """
+        if self._stream is not None:
+            chunk = self._parser.next_chunk()
+            if chunk is None:
+                return None
+            self._stream_data(chunk)
+            return MQTT_PUBLISH
+        packet = self._parser.next_packet()
+        if packet is None:
+            return None
+        return self._handle_packet(*packet)
+
+    def _handle_packet(self, header, length, body):
+        """Processes a received packet. The body of packets other than PUBLISH is
+        left in ``_rx_body`` for whoever waits on them.
+
+        :param int header: First byte of the packet.
+        :param int length: Remaining Length of the packet.
+        :param memoryview body: The packet after its fixed header, shorter than
+            ``length`` if it did not fit in the receive buffer.
+        """
+        self._rx_packets += 1
+        if header & 0xF0 != 0x30:
+            self._rx_body = body
+            if self._trace_buf is not None:
+                pid = body[0] << 8 | body[1] if header & 0xF0 in (0x40, 0x90, 0xB0) else 0
+                self._trace(0, header, length, pid)
+            if header == MQTT_PINGRESP:
+                if self._debug:
+                    self.logger.debug("Got PINGRESP")
+                if length != 0x00:
+                    raise MMQTTException(
+                        "Unexpected PINGRESP returned from broker: {}.".format(length)
+                    )
+                self._handle_pingresp()
+            elif header == 0x40:
+                self._handle_puback(body[0] << 0x08 | body[1])
+            return header
+
         # topic length MSB & LSB
-        topic_len = self._sock_exact_recv(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self._sock_exact_recv(topic_len)
-        topic = str(topic, "utf-8")
-        sz -= topic_len + 2
+        topic_len = (body[0] << 8) | body[1]
+        start = topic_len + 2
         pid = 0
-        if res[0] & 0x06:
-            pid = self._sock_exact_recv(2)
-            pid = pid[0] << 0x08 | pid[1]
-            sz -= 0x02
-        # read message contents
-        raw_msg = self._sock_exact_recv(sz)
-        msg = raw_msg if self._use_binary_mode else str(raw_msg, "utf-8")
-        if self.logger is not None:
-            self.logger.debug(
-                "Receiving SUBSCRIBE \nTopic: %s\nMsg: %s\n", topic, raw_msg
-            )
-        self._handle_on_message(self, topic, msg)
-        if res[0] & 0x06 == 0x02:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self._sock.send(pkt)
-        elif res[0] & 6 == 4:
+        if header & 0x06 and start + 2 <= len(body):
+            pid = body[start] << 0x08 | body[start + 1]
+            start += 2
+        self._trace(0, header, length, pid)
+        topic = self._topic_str(body, topic_len)
+        if self._streaming:
+            streams = self._on_stream_filtered.iter_match(topic)
+            if streams:
+                qos_pid = pid if header & 0x06 else 0
+                self._stream = [streams, topic, 0, length - start, qos_pid]
+                self._stream_data(body[start:])
+                return header
+        if len(body) < length:
+            if self.logger is not None:
+                self.logger.warning(
+                    "Dropped PUBLISH of %d bytes, receive buffer is %d bytes",
+                    length,
+                    len(self._parser.buf),
+                )
+        else:
+            # read message contents
+            msg = body[start:]
+            payload_type = None
+            if self._payload_typed:
+                payload_types = self._payload_types.iter_match(topic)
+                if payload_types:
+                    payload_type = payload_types[0]
+            if payload_type is None:
+                if not self._use_binary_mode:
+                    msg = str(msg, "utf-8")
+                elif self._parser is None:
+                    msg = bytearray(msg)
+            elif payload_type is str:
+                msg = str(msg, "utf-8")
+            elif payload_type is not memoryview:
+                msg = payload_type(msg)
+            if self._debug:
+                self.logger.debug(
+                    "Received PUBLISH on %s, %d bytes", topic, length - start
+                )
+            self._handle_on_message(self, topic, msg)
+        if header & 0x06 == 0x02:
+            self._send_puback(pid)
+        elif header & 6 == 4:
             assert 0
-        return res[0]
+        return header
+
+    def _topic_str(self, body, topic_len):
+        """Returns the topic name of a received PUBLISH. Names received before
+        are compared in place and returned as the same `str`, without decoding.
+
+        :param memoryview body: Body of the PUBLISH packet.
+        :param int topic_len: Length of the topic name, in bytes.
+        """
+        name = body[2 : topic_len + 2]
+        known = self._topics.get(topic_len)
+        if known is not None:
+            for encoded, topic in known:
+                if name == encoded:
+                    return topic
+        topic = str(name, "utf-8")
+        if self._topics_count < MQTT_TOPIC_CACHE_SIZE:
+            self._topics.setdefault(topic_len, []).append((bytes(name), topic))
+            self._topics_count += 1
+        return topic
+
+    def _send_puback(self, pid):
+        """Acknowledges a QoS 1 PUBLISH.
+
+        :param int pid: Packet identifier of the PUBLISH.
+        """
+        pkt = self._rx_puback
+        struct.pack_into("!H", pkt, 2, pid)
+        self._send_all(pkt)
+        self._trace(1, pkt[0], 2, pid)
+
+    def _trace(self, out, header, size, pid):
+        """Records a packet event in the trace ring buffer, if there is one.
+
+        :param int out: ``1`` for a packet sent, ``0`` for one received.
+        :param int header: First byte of the packet.
+        :param int size: Remaining Length of the packet.
+        :param int pid: Packet identifier, ``0`` if none.
+        """
+        buf = self._trace_buf
+        if buf is None:
+            return
+        stamp = int(time.monotonic() * 1000) & 0xFFFFFFFF
+        struct.pack_into(
+            MQTT_TRACE_EVENT, buf, self._trace_next, out, header, pid, size, stamp
+        )
+        self._trace_next = (self._trace_next + MQTT_TRACE_EVENT_SIZE) % len(buf)
+        self._trace_count += 1
+
+    def trace(self):
+        """Returns the traced packet events, oldest first, as
+        ``(out, header, pid, size, milliseconds)`` tuples."""
+        buf = self._trace_buf
+        if buf is None:
+            return []
+        count = min(self._trace_count, len(buf) // MQTT_TRACE_EVENT_SIZE)
+        offset = (self._trace_next - count * MQTT_TRACE_EVENT_SIZE) % len(buf)
+        events = []
+        for _ in range(count):
+            events.append(struct.unpack_from(MQTT_TRACE_EVENT, buf, offset))
+            offset = (offset + MQTT_TRACE_EVENT_SIZE) % len(buf)
+        return events
+
+    def dump_trace(self, out=print):
+        """Prints the traced packet events, oldest first, one per line.
+
+        :param function out: Called with each line, defaults to `print`.
+        """
+        for sent, header, pid, size, stamp in self.trace():
+            out(
+                "{:>10} {} {:<11} flags={:x} size={} pid={}".format(
+                    stamp,
+                    ">" if sent else "<",
+                    MQTT_PACKET_NAMES.get(header & 0xF0, "?"),
+                    header & 0x0F,
+                    size,
+                    pid,
+                )
+            )
+
+    def _stream_data(self, data):
+        """Hands the next bytes of the payload being streamed to its callbacks,
+        in chunks of their size, and completes the PUBLISH after the last ones.
+
+        :param memoryview data: Payload bytes, following those handed already.
+        """
+        stream = self._stream
+        streams, topic, offset, total, pid = stream
+        if data or not total:
+            for callback, chunk_size in streams:
+                for i in range(0, len(data), chunk_size) or (0,):
+                    callback(self, topic, data[i : i + chunk_size], offset + i, total)
+        stream[2] = offset + len(data)
+        if stream[2] >= total:
+            self._stream = None
+            if pid:
+                self._send_puback(pid)
 
     def _recv_len(self):
         """Unpack MQTT message length."""
         n = 0
         sh = 0
-        b = bytearray(1)
         while True:
             b = self._sock_exact_recv(1)[0]
             n |= (b & 0x7F) << sh
@@ -950,6 +1902,46 @@ class MQTT:
                 return n
             sh += 7
 
+    def _rx_fill(self):
+        """Reads whatever the socket has available into the free end of the
+        receive buffer with a single socket read. Returns the number of bytes
+        read, ``0`` if none arrived before the socket timeout.
+        """
+        space = self._parser.space()
+        self._rx_reads += 1
+        try:
+            if not self._backwards_compatible_sock:
+                # CPython/Socketpool Impl.
+                read = self._sock.recv_into(space, len(space))
+                if not read and space:
+                    # Timeouts raise, an empty read is the end of the stream
+                    self._drop_connection()
+                    raise MMQTTException("Connection closed by broker.")
+            else:  # ESP32SPI Impl.
+                avail = 0
+                if hasattr(self._sock, "available"):
+                    avail = self._sock.available()
+                data = self._sock.recv(min(max(avail, 1), len(space)))
+                read = len(data)
+                space[:read] = data
+        except OSError as error:
+            timeout = getattr(self._socket_pool, "timeout", None)
+            if (timeout and isinstance(error, timeout)) or error.errno in (
+                errno.ETIMEDOUT,
+                errno.EAGAIN,
+            ):
+                return 0
+            raise
+        self._parser.commit(read)
+        return read
+
+    @property
+    def recv_stats(self):
+        """Returns a ``(packets, socket_reads)`` tuple counting packets received
+        and the socket reads it took to receive them.
+        """
+        return self._rx_packets, self._rx_reads
+
     def _recv_into(self, buf, size=0):
         """Backwards-compatible _recv_into implementation."""
         if self._backwards_compatible_sock:
@@ -973,10 +1965,22 @@ class MQTT:
         :param int bufsize: number of bytes to receive
 
         """
+        self._rx_reads += 1
         if not self._backwards_compatible_sock:
             # CPython/Socketpool Impl.
             rc = bytearray(bufsize)
-            self._sock.recv_into(rc, bufsize)
+            view = memoryview(rc)
+            stamp = time.monotonic()
+            got = self._sock.recv_into(rc, bufsize)
+            while 0 < got < bufsize:
+                self._rx_reads += 1
+                got += self._sock.recv_into(view[got:], bufsize - got)
+                if time.monotonic() - stamp > self.keep_alive:
+                    raise MMQTTException(
+                        "Unable to receive {} bytes within {} seconds.".format(
+                            bufsize - got, self.keep_alive
+                        )
+                    )
         else:  # ESP32SPI Impl.
             stamp = time.monotonic()
             read_timeout = self.keep_alive
@@ -993,6 +1997,7 @@ class MQTT:
             assert to_read >= 0
             read_timeout = self.keep_alive
             while to_read > 0:
+                self._rx_reads += 1
                 recv = self._sock.recv(to_read)
                 to_read -= len(recv)
                 rc += recv
@@ -1004,18 +2009,69 @@ class MQTT:
                     )
         return rc
 
-    def _send_str(self, string):
-        """Encodes a string and sends it to a socket.
+    def _tx_reserve(self, size):
+        """Returns the scratch buffer outgoing packets are assembled in, grown to
+        hold at least ``size`` bytes. The buffer is reused across packets.
+
+        :param int size: Largest number of bytes the packet may take.
+        """
+        if len(self._tx_buf) < size:
+            self._tx_buf = bytearray(size)
+            self._tx_view = memoryview(self._tx_buf)
+        return self._tx_buf
 
-        :param str string: String to write to the socket.
+    def _send_packet(self, size):
+        """Sends the first ``size`` bytes of the scratch buffer with a single write.
 
+        :param int size: Number of bytes to send.
         """
-        if isinstance(string, str):
-            self._sock.send(struct.pack("!H", len(string.encode("utf-8"))))
-            self._sock.send(str.encode(string, "utf-8"))
-        else:
-            self._sock.send(struct.pack("!H", len(string)))
-            self._sock.send(string)
+        self._send_all(self._tx_view[:size])
+
+    def _send_all(self, data):
+        """Sends all of ``data``, with a single write unless the socket takes
+        less than asked for.
+
+        :param data: Bytes, `bytearray` or `memoryview` to send.
+        """
+        sent = self._sock.send(data)
+        # Sockets returning a count may send less than asked for
+        if sent is not None and sent < len(data):
+            view = memoryview(data)
+            while sent < len(data):
+                sent += self._sock.send(view[sent:])
+
+    @staticmethod
+    def _encode_remaining_length(buf, offset, length):
+        """Encodes a Remaining Length [2.2.3] into a buffer, returning the offset
+        after it.
+
+        :param bytearray buf: Destination buffer.
+        :param int offset: Where to write the first byte.
+        :param int length: Remaining Length to encode.
+        """
+        while True:
+            encoded_byte = length % 0x80
+            length = length // 0x80
+            # if there is more data to encode, set the top bit of the byte
+            if length > 0:
+                encoded_byte |= 0x80
+            buf[offset] = encoded_byte
+            offset += 1
+            if not length:
+                return offset
+
+    @staticmethod
+    def _encode_str(buf, offset, data):
+        """Encodes length-prefixed bytes into a buffer, returning the offset after them.
+
+        :param bytearray buf: Destination buffer.
+        :param int offset: Where to write the 2-byte length.
+        :param bytes data: Encoded string or binary data.
+        """
+        struct.pack_into("!H", buf, offset, len(data))
+        offset += 2
+        buf[offset : offset + len(data)] = data
+        return offset + len(data)
 
     @staticmethod
     def _valid_topic(topic):
@@ -1069,9 +2125,12 @@ class MQTT:
         """
         self.logger = logger.getLogger("log")
         self.logger.setLevel(log_level)
+        # DEBUG is 10 in both logging and adafruit_logging
+        self._debug = log_level <= 10
 
     def disable_logger(self):
         """Disables logging."""
         if not self.logger:
             raise MMQTTException("Can not disable logger, no logger found.")
         self.logger = None
+        self._debug = False
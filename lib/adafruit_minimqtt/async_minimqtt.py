@@ -0,0 +1,324 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`async_minimqtt`
+====================================================================================
+
+asyncio flavour of the MiniMQTT client. It shares the packet encoding and
+parsing of `MQTT`, and replaces its blocking socket reads with a reader task.
+"""
+
+import asyncio
+from .adafruit_minimqtt import (
+    MQTT,
+    MMQTTException,
+    MQTT_DISCONNECT,
+    MQTT_TLS_PORT,
+)
+
+
+class _StreamSocket:
+    """Adapts an asyncio StreamWriter to the ``send`` the packet code uses.
+    Writes are buffered by the writer, see `AsyncMQTT._drain`."""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def send(self, data):
+        """Queue :data for sending"""
+        self._writer.write(bytes(data))
+
+    def close(self):
+        """Close the stream"""
+        self._writer.close()
+
+
+class AsyncMQTT(MQTT):
+    """MQTT client for asyncio applications.
+
+    A reader task started by `connect` parses incoming packets, wakes up the
+    coroutines waiting on acknowledgements and sends the keep alive pings, so
+    `loop` and `ping` are not used. Received messages go to the ``on_message``
+    and topic callbacks, and can also be consumed with ``async for``::
+
+        async with AsyncMQTT("broker", is_ssl=False) as client:
+            await client.subscribe("sensors/#")
+            async for topic, message in client:
+                print(topic, message)
+
+    Takes the same arguments as `MQTT`, plus:
+
+    :param int recv_buffer_size: Size of the receive buffer, defaults to ``4096``.
+    :param int max_messages: How many received messages are kept for ``async for``
+        before the oldest ones are dropped.
+
+    """
+
+    def __init__(self, broker, *, recv_buffer_size=4096, max_messages=32, **kwargs):
+        super().__init__(broker, recv_buffer_size=recv_buffer_size, **kwargs)
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+        # Coroutines waiting on an acknowledgement: (type, pid) -> [event, body]
+        self._waiters = {}
+        self._messages = []
+        self._max_messages = max_messages
+        self._message_ready = asyncio.Event()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        if self.is_connected():
+            await self.disconnect()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """Returns the next ``(topic, message)`` received, ending once the
+        connection is closed and all messages were consumed."""
+        while not self._messages:
+            if not self.is_connected():
+                raise StopAsyncIteration
+            self._message_ready.clear()
+            await self._message_ready.wait()
+        return self._messages.pop(0)
+
+    # pylint: disable=arguments-differ
+    async def connect(self, clean_session=True, host=None, port=None, keep_alive=None):
+        """Initiates connection with the MQTT Broker.
+
+        :param bool clean_session: Establishes a persistent session.
+        :param str host: Hostname or IP address of the remote broker.
+        :param int port: Network port of the remote broker.
+        :param int keep_alive: Maximum period allowed for communication, in seconds.
+
+        """
+        if host:
+            self.broker = host
+        if port:
+            self.port = port
+        if keep_alive:
+            self.keep_alive = keep_alive
+
+        if self.logger is not None:
+            self.logger.debug("Attempting to establish MQTT connection...")
+        kwargs = {}
+        if self.port == MQTT_TLS_PORT:
+            kwargs["ssl"] = self._ssl_context or True
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.broker, self.port, **kwargs),
+                self._recv_timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise MMQTTException("Unable to connect to broker: {}".format(e)) from e
+        self._sock = _StreamSocket(self._writer)
+        self._parser.reset()
+        self._stream = None
+        self._ping_sent = 0
+        self._tasks = [
+            asyncio.create_task(self._read_loop()),
+            asyncio.create_task(self._ping_loop()),
+        ]
+
+        waiter = self._expect(0x20, 0)
+        if self.logger is not None:
+            self.logger.debug("Sending CONNECT to broker...")
+        self._sock.send(self._connect_packet(clean_session))
+        return self._handle_connack(await self._wait(waiter))
+
+    async def disconnect(self):
+        """Disconnects the MiniMQTT client from the MQTT broker."""
+        self._connected()
+        if self.logger is not None:
+            self.logger.debug("Sending DISCONNECT packet to broker")
+        self._sock.send(MQTT_DISCONNECT)
+        try:
+            await self._writer.drain()
+        except OSError as e:
+            if self.logger is not None:
+                self.logger.warning("Unable to send DISCONNECT packet: {}".format(e))
+        self._close()
+        self._subscribed_topics = []
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, self._user_data, 0)
+
+    async def reconnect(self, resub_topics=True):
+        """Attempts to reconnect to the MQTT broker.
+
+        :param bool resub_topics: Resubscribe to previously subscribed topics.
+
+        """
+        subscribed_topics = self._subscribed_topics.copy()
+        self._close()
+        await self.connect()
+        self._subscribed_topics = []
+        if resub_topics and subscribed_topics:
+            await self.subscribe([(feed, 0) for feed in subscribed_topics])
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        """Publishes a message to a topic provided, see `MQTT.publish`.
+
+        :param str|PreparedTopic topic: Unique topic identifier.
+        :param str|int|float|bytes msg: Data to send to the broker.
+        :param bool retain: Whether the message is saved by the broker.
+        :param int qos: Quality of Service level for the message, defaults to zero.
+
+        """
+        await self.publish_many([(topic, msg, qos, retain)])
+
+    async def publish_many(self, messages):
+        """Publishes several messages with a single write, see `MQTT.publish_many`.
+
+        :param list messages: ``(topic, msg, qos, retain)`` tuples.
+
+        """
+        self._connected()
+        size, packets, pending = self._encode_publishes(messages)
+        waiters = []
+        if not self._max_inflight:
+            waiters = [self._expect(0x40, pid) for pid in pending]
+        self._send_packet(size)
+        await self._drain()
+        if self.on_publish is not None:
+            for topic, _, _, qos, _ in packets:
+                if qos == 0:
+                    self.on_publish(self, self._user_data, topic, self._pid)
+        try:
+            for waiter in waiters:
+                await self._wait(waiter)
+        finally:
+            for pid in pending:
+                self._waiters.pop((0x40, pid), None)
+                if not self._max_inflight:
+                    self._inflight.pop(pid, None)
+
+    async def subscribe(self, topic, qos=0, payload_type=None):
+        """Subscribes to a topic on the MQTT Broker, see `MQTT.subscribe`.
+
+        :param str|tuple|list topic: Unique MQTT topic identifier string or list.
+        :param int qos: Quality of Service level for the topic, defaults to zero.
+        :param type payload_type: How messages on these topics are passed.
+
+        """
+        self._connected()
+        self._valid_payload_type(payload_type)
+        size, topics, packet_id_bytes = self._encode_subscribe(topic, qos)
+        waiter = self._expect(0x90, int.from_bytes(packet_id_bytes, "big"))
+        self._send_packet(size)
+        self._handle_suback(topics, await self._wait(waiter))
+        self._set_payload_type(topics, payload_type)
+
+    async def unsubscribe(self, topic):
+        """Unsubscribes from a MQTT topic, see `MQTT.unsubscribe`.
+
+        :param str|list topic: Unique MQTT topic identifier string or list.
+
+        """
+        size, topics, packet_id_bytes = self._encode_unsubscribe(topic)
+        waiter = self._expect(0xB0, int.from_bytes(packet_id_bytes, "big"))
+        self._send_packet(size)
+        await self._wait(waiter)
+        self._handle_unsuback(topics)
+
+    def _handle_on_message(self, client, topic, message):
+        # The body is a view of the receive buffer, copy it for the consumer
+        if not isinstance(message, str):
+            message = bytes(message)
+        super()._handle_on_message(client, topic, message)
+        if len(self._messages) >= self._max_messages:
+            self._messages.pop(0)
+        self._messages.append((topic, message))
+        self._message_ready.set()
+
+    def _expect(self, kind, pid):
+        """Registers a waiter for the acknowledgement of type :kind and packet
+        id :pid, before the packet it acknowledges is sent"""
+        waiter = self._waiters[(kind, pid)] = [asyncio.Event(), None, kind, pid]
+        return waiter
+
+    async def _wait(self, waiter):
+        """Waits for :waiter to be resolved, returning the acknowledgement body"""
+        await self._drain()
+        try:
+            await asyncio.wait_for(waiter[0].wait(), self._recv_timeout)
+        except asyncio.TimeoutError:
+            raise MMQTTException(
+                f"No data received from broker for {self._recv_timeout} seconds."
+            ) from None
+        finally:
+            self._waiters.pop((waiter[2], waiter[3]), None)
+        if waiter[1] is None:
+            raise MMQTTException("Connection to broker lost.")
+        return waiter[1]
+
+    async def _drain(self):
+        """Waits until the writer has room for more packets"""
+        try:
+            await self._writer.drain()
+        except OSError as e:
+            raise MMQTTException("Unable to send to broker: {}".format(e)) from e
+
+    async def _read_loop(self):
+        """Reads and dispatches packets until the connection is closed"""
+        parser = self._parser
+        try:
+            while True:
+                data = await self._reader.read(len(parser.space()))
+                if not data:
+                    break
+                self._rx_reads += 1
+                parser.feed(data)
+                header = self._parse_next()
+                while header is not None:
+                    kind = header & 0xF0
+                    if kind in (0x20, 0x40, 0x90, 0xB0):
+                        body = self._rx_body
+                        pid = 0 if kind == 0x20 else body[0] << 8 | body[1]
+                        waiter = self._waiters.pop((kind, pid), None)
+                        if waiter is not None:
+                            waiter[1] = bytes(body)
+                            waiter[0].set()
+                    header = self._parse_next()
+        except (OSError, ValueError, MMQTTException) as e:
+            if self.logger is not None:
+                self.logger.warning("Connection to broker lost: {}".format(e))
+        finally:
+            self._connection_lost()
+
+    async def _ping_loop(self):
+        """Sends a PINGREQ every keep alive period, closing the connection if
+        the previous one was not answered"""
+        while True:
+            await asyncio.sleep(self.keep_alive)
+            if self._ping_sent:
+                if self.logger is not None:
+                    self.logger.warning("PINGRESP not returned from broker.")
+                self._sock.close()
+                return
+            if self._inflight:
+                self._retransmit()
+            self._send_ping()
+
+    def _connection_lost(self):
+        """Marks the session closed and fails whatever waits on it"""
+        self._is_connected = False
+        for waiter in self._waiters.values():
+            waiter[0].set()
+        self._waiters = {}
+        self._message_ready.set()
+
+    def _close(self):
+        """Closes the stream and stops the tasks of the current connection"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._connection_lost()
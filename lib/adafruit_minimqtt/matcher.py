@@ -11,14 +11,19 @@ https://github.com/eclipse/paho.mqtt.python/blob/master/src/paho/mqtt/matcher.py
 * Author(s): Yoch (https://github.com/yoch)
 """
 
+from collections import OrderedDict
+
 
 class MQTTMatcher:
     """Intended to manage topic filters including wildcards.
 
-    Internally, MQTTMatcher use a prefix tree (trie) to store
-    values associated with filters, and has an iter_match()
-    method to iterate efficiently over all filters that match
+    Internally, MQTTMatcher keeps filters without wildcards in a dict,
+    uses a prefix tree (trie) to store values associated with wildcard
+    filters, and caches the result of the most recent lookups. It has an
+    iter_match() method to iterate efficiently over all filters that match
     some topic name.
+
+    :param int cache_size: How many topics to remember the matches of.
     """
 
     # pylint: disable=too-few-public-methods
@@ -31,12 +36,19 @@ class MQTTMatcher:
             self.children = {}
             self.content = None
 
-    def __init__(self):
+    def __init__(self, cache_size=32):
         self._root = self.Node()
+        self._exact = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
 
     def __setitem__(self, key, value):
         """Add a topic filter :key to the prefix tree
         and associate it to :value"""
+        self._cache.clear()
+        if "+" not in key and "#" not in key:
+            self._exact[key] = value
+            return
         node = self._root
         for sym in key.split("/"):
             node = node.children.setdefault(sym, self.Node())
@@ -44,6 +56,8 @@ class MQTTMatcher:
 
     def __getitem__(self, key):
         """Retrieve the value associated with some topic filter :key"""
+        if key in self._exact:
+            return self._exact[key]
         try:
             node = self._root
             for sym in key.split("/"):
@@ -56,12 +70,18 @@ class MQTTMatcher:
 
     def __delitem__(self, key):
         """Delete the value associated with some topic filter :key"""
+        self._cache.clear()
+        if key in self._exact:
+            del self._exact[key]
+            return
         lst = []
         try:
             parent, node = None, self._root
             for k in key.split("/"):
                 parent, node = node, node.children[k]
                 lst.append((parent, k, node))
+            if node.content is None:
+                raise KeyError(key)
             node.content = None
         except KeyError:
             raise KeyError(key) from None
@@ -72,26 +92,49 @@ class MQTTMatcher:
                 del parent.children[k]
 
     def iter_match(self, topic):
-        """Return an iterator on all values associated with filters
+        """Return an iterable on all values associated with filters
         that match the :topic"""
+        cache = self._cache
+        matches = cache.pop(topic, None)
+        if matches is None:
+            matches = self._match(topic)
+            if len(cache) >= self._cache_size:
+                cache.pop(next(iter(cache)))
+        # (re)insert as the most recently used entry
+        cache[topic] = matches
+        return matches
+
+    def _match(self, topic):
+        """Walk the exact filters and the trie, returning a tuple of the values
+        associated with filters that match the :topic, in the order of a
+        recursive walk: exact filters, then per level the exact part, "+"
+        and last "#" """
+        matches = []
+        if topic in self._exact:
+            matches.append(self._exact[topic])
+        if not self._root.children:
+            return tuple(matches)
         lst = topic.split("/")
         normal = not topic.startswith("$")
-
-        def rec(node, i=0):
+        # Entries are (node, level), or (None, value) for a "#" match, which
+        # comes after the matches under its node
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if node is None:
+                matches.append(i)
+                continue
+            if "#" in node.children and (normal or i > 0):
+                content = node.children["#"].content
+                if content is not None:
+                    stack.append((None, content))
             if i == len(lst):
                 if node.content is not None:
-                    yield node.content
+                    matches.append(node.content)
             else:
                 part = lst[i]
-                if part in node.children:
-                    for content in rec(node.children[part], i + 1):
-                        yield content
                 if "+" in node.children and (normal or i > 0):
-                    for content in rec(node.children["+"], i + 1):
-                        yield content
-            if "#" in node.children and (normal or i > 0):
-                content = node.children["#"].content
-                if content is not None:
-                    yield content
-
-        return rec(self._root)
+                    stack.append((node.children["+"], i + 1))
+                if part in node.children:
+                    stack.append((node.children[part], i + 1))
+        return tuple(matches)
@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`parser`
+====================================================================================
+
+Incremental MQTT packet parser over a fixed-size buffer.
+"""
+
+
+class MQTTParser:
+    """Resumable MQTT packet parser.
+
+    Bytes are added with feed(), or received straight into space() and
+    committed with commit(), in pieces of any size. next_packet() only
+    returns packets that are complete, and keeps its progress across calls
+    otherwise. Packets larger than the buffer are returned truncated to
+    what fits, and the rest of them is discarded as it arrives, unless
+    taken with next_chunk().
+
+    :param int size: Size of the buffer, in bytes.
+    """
+
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # Bytes in [head:tail] are waiting to be parsed
+        self.head = 0
+        self.tail = 0
+        # Bytes of a truncated packet still to be discarded
+        self._skip = 0
+
+    def space(self):
+        """Return a memoryview of the free end of the buffer, moving unparsed
+        bytes to its front first"""
+        if self.head == self.tail:
+            self.head = self.tail = 0
+        elif self.head:
+            pending = self.tail - self.head
+            self.view[0:pending] = self.view[self.head : self.tail]
+            self.head, self.tail = 0, pending
+        return self.view[self.tail :]
+
+    def commit(self, nbytes):
+        """Account for :nbytes written at the start of space()"""
+        self.tail += nbytes
+
+    def feed(self, data):
+        """Copy as much of :data as fits into the buffer, returning how many
+        bytes were taken"""
+        space = self.space()
+        taken = min(len(data), len(space))
+        space[:taken] = data[:taken]
+        self.commit(taken)
+        return taken
+
+    def reset(self):
+        """Discard everything buffered, e.g. on a new connection"""
+        self.head = self.tail = self._skip = 0
+
+    def pending(self):
+        """Return True if next_packet() has something to return"""
+        if self._skip:
+            return self.head != self.tail
+        return self._peek() is not None
+
+    def _peek(self):
+        """Decode the fixed header at head, returning the Remaining Length and
+        the offset of the packet body, or None if more bytes are needed"""
+        buf, pos, tail = self.buf, self.head + 1, self.tail
+        length = shift = 0
+        while pos < tail:
+            byte = buf[pos]
+            pos += 1
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                end = pos + length
+                if end <= tail or tail - self.head == len(buf):
+                    return length, pos
+                return None
+            shift += 7
+            if shift > 21:
+                raise ValueError("Malformed Remaining Length")
+        return None
+
+    def next_packet(self):
+        """Return the next packet as (header, length, body), where :body is a
+        memoryview of the buffer valid until the buffer is next written to,
+        and shorter than the Remaining Length :length for a truncated packet.
+        Return None if no complete packet is buffered yet."""
+        if self._skip:
+            skipped = min(self._skip, self.tail - self.head)
+            self.head += skipped
+            self._skip -= skipped
+            if self._skip:
+                return None
+        peeked = self._peek()
+        if peeked is None:
+            return None
+        length, start = peeked
+        header = self.buf[self.head]
+        end = min(start + length, self.tail)
+        self._skip = start + length - end
+        self.head = end
+        return header, length, self.view[start:end]
+
+    def next_chunk(self):
+        """Return a memoryview of the buffered bytes that follow the truncated
+        packet next_packet() returned last, valid until the buffer is next
+        written to, instead of discarding them. Return None if none are
+        buffered."""
+        taken = min(self._skip, self.tail - self.head)
+        if not taken:
+            return None
+        start = self.head
+        self.head += taken
+        self._skip -= taken
+        return self.view[start : self.head]
@@ -0,0 +1,146 @@
+"""Counters, gauges and latency histograms kept in preallocated arrays, so that
+recording them does not allocate, reported as JSON or packed into bytes."""
+
+import struct
+import time
+from array import array
+
+# Histogram bucket 0 counts durations under 1us, bucket i those from 2**(i-1)
+# up to 2**i microseconds, and the last one all longer ones (over 4s)
+BUCKETS = 24
+# Histogram slots: count, sum in s, sum remainder in us, max in us, buckets.
+# Whole seconds in a uint32 last 136 years, milliseconds would wrap in 49 days
+_COUNT = 0
+_SUM_S = 1
+_SUM_US = 2
+_MAX_US = 3
+_HIST_SIZE = 4 + BUCKETS
+# pack() header: format version, number of counters, gauges and histograms
+PACK_VERSION = 2
+PACK_HEADER = "<BBBB"
+
+
+def now():
+    """Returns a timestamp to pass to `Metrics.observe_since`, in nanoseconds."""
+    return time.monotonic_ns()
+
+
+class Metrics:
+    """Registry of named metrics. Names are registered once, with `counter`,
+    `gauge` and `histogram`, before they are updated; updating a name that
+    was not registered raises KeyError."""
+
+    def __init__(self):
+        self._counter_slots = {}
+        self._gauge_slots = {}
+        self._histogram_slots = {}
+        self._counters = array("I")
+        self._gauges = array("f")
+        self._histograms = array("I")
+
+    def counter(self, *names):
+        """Registers counters, starting at 0"""
+        for name in names:
+            if name not in self._counter_slots:
+                self._counter_slots[name] = len(self._counters)
+                self._counters.append(0)
+
+    def gauge(self, *names):
+        """Registers gauges, starting at 0"""
+        for name in names:
+            if name not in self._gauge_slots:
+                self._gauge_slots[name] = len(self._gauges)
+                self._gauges.append(0)
+
+    def histogram(self, *names):
+        """Registers latency histograms, starting empty"""
+        for name in names:
+            if name not in self._histogram_slots:
+                self._histogram_slots[name] = len(self._histograms)
+                self._histograms.extend(array("I", [0] * _HIST_SIZE))
+
+    def inc(self, name, value=1):
+        """Adds :value to the counter :name"""
+        self._counters[self._counter_slots[name]] += value
+
+    def set(self, name, value):
+        """Sets the gauge :name to :value"""
+        self._gauges[self._gauge_slots[name]] = value
+
+    def observe(self, name, micros):
+        """Adds a duration of :micros microseconds to the histogram :name"""
+        hist, base = self._histograms, self._histogram_slots[name]
+        hist[base + _COUNT] += 1
+        remainder = hist[base + _SUM_US] + micros
+        hist[base + _SUM_S] += remainder // 1000000
+        hist[base + _SUM_US] = remainder % 1000000
+        if micros > hist[base + _MAX_US]:
+            hist[base + _MAX_US] = micros
+        bucket = 0
+        while micros and bucket < BUCKETS - 1:
+            micros >>= 1
+            bucket += 1
+        hist[base + 4 + bucket] += 1
+
+    def observe_since(self, name, start):
+        """Adds the time elapsed since :start, a value of `now`, to the
+        histogram :name"""
+        self.observe(name, min((time.monotonic_ns() - start) // 1000, 0xFFFFFFFF))
+
+    def counters(self):
+        """Returns the counters as a dict"""
+        counters = self._counters
+        return {name: counters[slot] for name, slot in self._counter_slots.items()}
+
+    def as_dict(self):
+        """Returns all metrics as a dict that can be serialized to JSON.
+        Histograms hold their count, total and max time in milliseconds, and
+        the non-empty buckets as ``[upper bound in us, count]`` pairs."""
+        gauges, hist = self._gauges, self._histograms
+        histograms = {}
+        for name, base in self._histogram_slots.items():
+            histograms[name] = {
+                "count": hist[base + _COUNT],
+                "sum_ms": hist[base + _SUM_S] * 1000 + hist[base + _SUM_US] // 1000,
+                "max_ms": hist[base + _MAX_US] / 1000,
+                "buckets": [
+                    [1 << i, hist[base + 4 + i]]
+                    for i in range(BUCKETS)
+                    if hist[base + 4 + i]
+                ],
+            }
+        return {
+            "counters": self.counters(),
+            "gauges": {name: gauges[slot] for name, slot in self._gauge_slots.items()},
+            "histograms": histograms,
+        }
+
+    def layout(self):
+        """Returns the names of the metrics in the order `pack` writes them,
+        for decoding its output"""
+        return {
+            "version": PACK_VERSION,
+            "buckets": BUCKETS,
+            "counters": sorted(self._counter_slots, key=self._counter_slots.get),
+            "gauges": sorted(self._gauge_slots, key=self._gauge_slots.get),
+            "histograms": sorted(self._histogram_slots, key=self._histogram_slots.get),
+        }
+
+    def pack(self):
+        """Returns all metrics as bytes: a `PACK_HEADER` with the format version
+        and the number of counters, gauges and histograms, then the counters as
+        little endian uint32, the gauges as float32 and the histograms as
+        uint32 ``count, sum_s, sum_us, max_us`` and `BUCKETS` bucket counts.
+        Metric names are given by `layout`."""
+        return (
+            struct.pack(
+                PACK_HEADER,
+                PACK_VERSION,
+                len(self._counters),
+                len(self._gauges),
+                len(self._histogram_slots),
+            )
+            + bytes(self._counters)
+            + bytes(self._gauges)
+            + bytes(self._histograms)
+        )
@@ -0,0 +1,110 @@
+"""Sensor readings kept in fixed-size ring buffers, so memory use stays the
+same however long the station runs, and aggregated over that window. Also
+decides when a reading is worth publishing, see `Deadband`."""
+
+import time
+from array import array
+
+
+class Sampler:
+    """Ring buffer of the last ``size`` readings of a sensor.
+
+    `sample` takes a reading, `aggregate` returns the min, max and mean of
+    the readings in the buffer and an exponential moving average of all of
+    them.
+
+    :param read: Returns a reading, as a number.
+    :param int size: How many readings to keep.
+    :param float alpha: Weight of a new reading in the moving average.
+    """
+
+    def __init__(self, read, size, alpha=0.1):
+        self._read = read
+        self._buf = array("f", [0] * size)
+        self._next = 0
+        self._count = 0
+        self._alpha = alpha
+        self.ema = None
+        self.last = None
+
+    def __len__(self):
+        return self._count
+
+    def sample(self):
+        """Takes a reading and adds it, returning it"""
+        value = self._read()
+        self.add(value)
+        return value
+
+    def add(self, value):
+        """Adds a reading, replacing the oldest one once the buffer is full"""
+        buf = self._buf
+        buf[self._next] = value
+        self._next = (self._next + 1) % len(buf)
+        if self._count < len(buf):
+            self._count += 1
+        if self.ema is None:
+            self.ema = value
+        else:
+            self.ema += self._alpha * (value - self.ema)
+        self.last = value
+
+    def aggregate(self):
+        """Returns ``(min, max, mean, ema)`` of the buffered readings, or None
+        if there are none"""
+        count = self._count
+        if not count:
+            return None
+        buf = self._buf
+        low = high = total = buf[0]
+        for i in range(1, count):
+            value = buf[i]
+            total += value
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+        return low, high, total / count, self.ema
+
+
+class Deadband:
+    """Report by exception: a value is due for publishing once it moved by
+    ``threshold`` or more from the one last published, but never sooner than
+    ``min_interval`` after it, and anyway ``max_interval`` after it, as a
+    heartbeat.
+
+    :param float threshold: Smallest change worth publishing.
+    :param float min_interval: Shortest time between publishes, in seconds.
+    :param float max_interval: Longest time between publishes, in seconds.
+    :param clock: Returns the current time in seconds, defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, threshold, min_interval, max_interval, clock=time.monotonic):
+        self._threshold = threshold
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._clock = clock
+        self._value = None
+        self._stamp = 0
+
+    def due(self, value):
+        """Returns True if :value is to be published. It stays due until
+        `published` is called, so a failed publish is retried."""
+        if self._value is None:
+            return True
+        elapsed = self._clock() - self._stamp
+        if elapsed < self._min_interval:
+            return False
+        return (
+            abs(value - self._value) >= self._threshold
+            or elapsed >= self._max_interval
+        )
+
+    def published(self, value):
+        """Takes :value as the last value published, from now"""
+        self._value = value
+        self._stamp = self._clock()
+
+    def force(self):
+        """Makes the next value due, whatever it is"""
+        self._stamp -= self._max_interval
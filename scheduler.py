@@ -0,0 +1,139 @@
+"""Runs named functions at fixed intervals, keeping the next deadlines in a
+min-heap so that finding what is due does not scan every entry."""
+
+import time
+
+try:
+    from heapq import heappop, heappush
+except ImportError:
+    # CircuitPython builds without heapq
+
+    def heappush(heap, item):
+        heap.append(item)
+        pos = len(heap) - 1
+        while pos:
+            parent = (pos - 1) >> 1
+            if heap[parent] <= item:
+                break
+            heap[pos] = heap[parent]
+            pos = parent
+        heap[pos] = item
+
+    def heappop(heap):
+        last = heap.pop()
+        if not heap:
+            return last
+        top, heap[0] = heap[0], last
+        pos, size = 0, len(heap)
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if last <= heap[child]:
+                break
+            heap[pos] = heap[child]
+            pos = child
+        heap[pos] = last
+        return top
+
+
+# Entry fields: deadline, sequence (ties run in order added), name, interval, fun.
+# Cancelled entries stay in the heap with no name until they reach the top.
+_DEADLINE = 0
+_SEQ = 1
+_NAME = 2
+_INTERVAL = 3
+_FUN = 4
+
+
+class Scheduler:
+    """Named interval timers.
+
+    A function added with `add` runs every ``interval`` seconds once it is
+    returned by `due`, which the caller runs, so a failure can be retried
+    sooner with `retry`.
+
+    :param clock: Returns the current time in seconds, defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap = []
+        self._entries = {}
+        self._seq = 0
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, interval, fun, delay=0):
+        """Runs :fun every :interval seconds, the first time in :delay seconds.
+        Replaces any entry already called :name."""
+        self.cancel(name)
+        self._push(name, interval, fun, self._clock() + delay)
+
+    def cancel(self, name):
+        """Stops running :name. Returns False if it was not scheduled."""
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return False
+        entry[_NAME] = None
+        heap = self._heap
+        if len(heap) > 2 * len(self._entries) + 8:
+            # Mostly cancelled entries, drop them. In place, as due() may be
+            # iterating over the heap. A sorted list is a valid heap.
+            heap[:] = sorted(e for e in heap if e[_NAME] is not None)
+        return True
+
+    def reschedule(self, name, delay=None, interval=None):
+        """Moves the next run of :name to :delay seconds from now, a whole
+        interval by default, e.g. when its work was done some other way.
+        Use a :delay of ``0`` to run it as soon as possible. Also changes its
+        interval, if :interval is given."""
+        entry = self._entries[name]
+        if interval is None:
+            interval = entry[_INTERVAL]
+        if delay is None:
+            delay = interval
+        self.add(name, interval, entry[_FUN], delay)
+
+    def retry(self, name, delay):
+        """Runs :name again in :delay seconds, after it failed. The interval
+        it was added with applies again from the next run."""
+        entry = self._entries.get(name)
+        if entry is not None:
+            self.add(name, entry[_INTERVAL], entry[_FUN], delay)
+
+    def next_deadline(self):
+        """Returns the clock time the next entry is due at, ``None`` if there
+        are none."""
+        heap = self._heap
+        while heap and heap[0][_NAME] is None:
+            heappop(heap)
+        return heap[0][_DEADLINE] if heap else None
+
+    def due(self):
+        """Yields ``(name, interval, fun)`` for every entry due, after moving
+        its next run a whole interval from now. Entries pushed meanwhile wait
+        for the next call, even when already due, as with a zero interval."""
+        now = self._clock()
+        last = self._seq
+        heap = self._heap
+        while heap and heap[0][_DEADLINE] <= now and heap[0][_SEQ] <= last:
+            entry = heappop(heap)
+            name = entry[_NAME]
+            if name is None:
+                continue
+            interval, fun = entry[_INTERVAL], entry[_FUN]
+            self._push(name, interval, fun, self._clock() + interval)
+            yield name, interval, fun
+
+    def _push(self, name, interval, fun, deadline):
+        self._seq += 1
+        entry = [deadline, self._seq, name, interval, fun]
+        self._entries[name] = entry
+        heappush(self._heap, entry)
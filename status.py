@@ -0,0 +1,126 @@
+"""Status telemetry encoder: fields that rarely change are sent whole and only
+when they do, the others as deltas of what was sent before, as JSON or in a
+compact binary form, CBOR (RFC 8949) restricted to the types used here.
+tools/status_decode.py rebuilds the full status on the host side."""
+
+import json
+import struct
+
+
+def cbor_dumps(obj):
+    """Returns :obj encoded as CBOR. Supports dict, list, tuple, str, bytes,
+    int, float (sent as float32), bool and None."""
+    out = bytearray()
+    _cbor_encode(out, obj)
+    return bytes(out)
+
+
+def _cbor_head(out, major, value):
+    major <<= 5
+    if value < 24:
+        out.append(major | value)
+    elif value < 0x100:
+        out.append(major | 24)
+        out.append(value)
+    elif value < 0x10000:
+        out.append(major | 25)
+        out.extend(struct.pack(">H", value))
+    elif value < 0x100000000:
+        out.append(major | 26)
+        out.extend(struct.pack(">I", value))
+    else:
+        out.append(major | 27)
+        out.extend(struct.pack(">Q", value))
+
+
+def _cbor_encode(out, obj):
+    # bool first, it is a subclass of int
+    if obj is True or obj is False:
+        out.append(0xF5 if obj else 0xF4)
+    elif obj is None:
+        out.append(0xF6)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            _cbor_head(out, 0, obj)
+        else:
+            _cbor_head(out, 1, -1 - obj)
+    elif isinstance(obj, float):
+        out.append(0xFA)
+        out.extend(struct.pack(">f", obj))
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        _cbor_head(out, 3, len(data))
+        out.extend(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        _cbor_head(out, 2, len(obj))
+        out.extend(obj)
+    elif isinstance(obj, (list, tuple)):
+        _cbor_head(out, 4, len(obj))
+        for item in obj:
+            _cbor_encode(out, item)
+    elif isinstance(obj, dict):
+        _cbor_head(out, 5, len(obj))
+        for key, value in obj.items():
+            _cbor_encode(out, key)
+            _cbor_encode(out, value)
+    else:
+        raise TypeError("Can not encode {} as CBOR".format(type(obj)))
+
+
+class StatusEncoder:
+    """Encodes status messages.
+
+    `encode_static` returns the rarely changing fields, to publish retained,
+    only when one of them changed. `encode` returns the other fields with
+    ``seq``, a sequence number: every ``full_every`` messages all of them and
+    ``"full": True``, otherwise only the fields that changed since the last
+    message. Fields holding a dict, such as counters, are diffed one level
+    down. Fields that are no longer given are not reported as removed.
+
+    :param bool binary: Encode as CBOR instead of JSON.
+    :param int full_every: Send all fields every this many messages.
+    """
+
+    def __init__(self, binary=False, full_every=6):
+        self._dumps = cbor_dumps if binary else json.dumps
+        self._full_every = full_every
+        self._since_full = full_every
+        self._static = None
+        self._last = {}
+        self._seq = 0
+
+    def force_full(self):
+        """Sends all fields in the next messages, static ones included, e.g.
+        when a full status was requested or the last one was not sent"""
+        self._since_full = self._full_every
+        self._static = None
+
+    def encode_static(self, fields):
+        """Returns :fields encoded, or None if unchanged since the last call"""
+        if fields == self._static:
+            return None
+        self._static = fields
+        return self._dumps(fields)
+
+    def encode(self, fields):
+        """Returns the encoded message for :fields, which must not be modified
+        afterwards as the next message is diffed against them"""
+        self._seq += 1
+        if self._since_full >= self._full_every:
+            self._since_full = 0
+            message = dict(fields)
+            message["full"] = True
+        else:
+            message = {}
+            last = self._last
+            for key, value in fields.items():
+                previous = last.get(key)
+                if value == previous:
+                    continue
+                if isinstance(value, dict) and isinstance(previous, dict):
+                    value = {k: v for k, v in value.items() if previous.get(k) != v}
+                message[key] = value
+        self._since_full += 1
+        self._last = fields
+        message["seq"] = self._seq
+        return self._dumps(message)
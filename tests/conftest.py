@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Runs the tests on CPython, from this directory with ``python3 -m pytest``:
+puts the project, its lib and tools directories on the path, and provides the
+``micropython`` builtin the library imports."""
+
+import os
+import socket
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "lib"), os.path.join(ROOT, "tools")]
+# Last, as code.py would shadow the standard library module pdb imports
+sys.path.append(ROOT)
+try:
+    import micropython  # pylint: disable=unused-import
+except ImportError:
+    sys.modules["micropython"] = types.SimpleNamespace(const=lambda value: value)
+
+# pylint: disable=wrong-import-position
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+from fake_broker import FakeBroker
+
+
+class Clock:
+    """Virtual clock, moved by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """A Clock at 0"""
+    return Clock()
+
+
+@pytest.fixture
+def broker():
+    """A FakeBroker listening on localhost"""
+    fake = FakeBroker()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def make_client(broker):  # pylint: disable=redefined-outer-name
+    """Returns a function making MQTT clients of the broker fixture, connected
+    unless ``connect=False`` is passed. Other arguments go to MQTT."""
+
+    def make(connect=True, **kwargs):
+        kwargs.setdefault("socket_pool", socket)
+        kwargs.setdefault("socket_timeout", 0.1)
+        kwargs.setdefault("recv_timeout", 2)
+        client = MQTT.MQTT("127.0.0.1", port=broker.port, is_ssl=False, **kwargs)
+        if connect:
+            client.connect()
+        return client
+
+    return make
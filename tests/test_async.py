@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""AsyncMQTT against the fake broker"""
+
+import asyncio
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+from adafruit_minimqtt.async_minimqtt import AsyncMQTT
+
+
+@pytest.fixture
+def make_async(broker):
+    """Returns a function building AsyncMQTT clients for the broker, to call
+    from within the event loop"""
+
+    def make(**kwargs):
+        kwargs.setdefault("socket_timeout", 0.1)
+        kwargs.setdefault("recv_timeout", 2)
+        return AsyncMQTT("127.0.0.1", port=broker.port, is_ssl=False, **kwargs)
+
+    return make
+
+
+def test_subscribe_publish_receive(broker, make_async):
+    published = []
+
+    async def run():
+        async with make_async() as client:
+            assert client.is_connected()
+            client.on_publish = lambda *args: published.append(args[2])
+            await client.subscribe([("t/#", 1), ("other", 0)])
+            await client.publish("t/a", b"1", qos=1)
+            await client.publish_many([("t/b", "2"), ("other", 3, 1)])
+            received = []
+            async for topic, message in client:
+                received.append((topic, message))
+                if len(received) == 3:
+                    break
+            return received
+
+    received = asyncio.run(run())
+    assert received == [("t/a", "1"), ("t/b", "2"), ("other", "3")]
+    assert broker.received == [("t/a", b"1", 1), ("t/b", b"2", 0), ("other", b"3", 1)]
+    assert sorted(published) == ["other", "t/a", "t/b"]
+    # CONNECT, SUBSCRIBE, the PUBLISHes, then DISCONNECT
+    assert broker.wait_for(lambda: broker.packets[-1][0] == 0xE0)
+    assert [header for header, _ in broker.packets] == [
+        0x10,
+        0x82,
+        0x32,
+        0x30,
+        0x32,
+        0xE0,
+    ]
+
+
+def test_unsubscribe(broker, make_async):
+    async def run():
+        async with make_async() as client:
+            await client.subscribe("t")
+            await client.unsubscribe("t")
+            assert broker.wait_for(lambda: not broker.sessions[-1].filters)
+            broker.publish("t", b"dropped")
+            await client.subscribe("u")
+            broker.publish("u", b"kept")
+            return await client.__anext__()
+
+    assert asyncio.run(run()) == ("u", "kept")
+
+
+def test_puback_timeout(broker, make_async):
+    broker.no_puback = True
+
+    async def run():
+        async with make_async(recv_timeout=0.5) as client:
+            with pytest.raises(MQTT.MMQTTException, match="No data received"):
+                await client.publish("t", b"x", qos=1)
+            assert client.is_connected()
+
+    asyncio.run(run())
+
+
+def test_broker_eof(broker, make_async):
+    broker.no_puback = True
+
+    async def run():
+        client = make_async()
+        await client.connect()
+        await client.subscribe("t")
+        broker.publish("t", b"first")
+        publish = asyncio.create_task(client.publish("t", b"x", qos=1))
+        received = [await client.__anext__(), await client.__anext__()]
+        # Sent before the end of the stream, so still received
+        broker.publish("t", b"last")
+        broker.sessions[-1].drop()
+        # The waiting publish fails, and iterating ends after what was received
+        with pytest.raises(MQTT.MMQTTException, match="lost"):
+            await publish
+        assert not client.is_connected()
+        received += [message async for message in client]
+        with pytest.raises(MQTT.MMQTTException, match="not connected"):
+            await client.publish("t", b"y")
+        return received
+
+    assert asyncio.run(run()) == [("t", "first"), ("t", "x"), ("t", "last")]
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Keep alive pings sent from MQTT.loop"""
+
+import time
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+
+
+def test_ping_answered(make_client):
+    client = make_client(keep_alive=1, recv_timeout=1)
+    stop = time.monotonic() + 2.5
+    while time.monotonic() < stop:
+        client.loop(0.1)
+    assert client.is_connected()
+    assert client.ping_rtt is not None
+    client.disconnect()
+
+
+def test_no_pingresp_drops_connection(broker, make_client):
+    broker.no_pingresp = True
+    client = make_client(keep_alive=1, recv_timeout=1)
+    stop = time.monotonic() + 5
+    with pytest.raises(MQTT.MMQTTException, match="PINGRESP"):
+        while time.monotonic() < stop:
+            client.loop(0.1)
+    assert not client.is_connected()
+    # Every later call fails too, until the client reconnects
+    for _ in range(3):
+        with pytest.raises(MQTT.MMQTTException, match="not connected"):
+            client.loop(0.1)
+
+    broker.no_pingresp = False
+    stop = time.monotonic() + 5
+    while not client.reconnect_step() and time.monotonic() < stop:
+        time.sleep(0.05)
+    assert client.is_connected()
+    client.loop(0.1)
+    client.disconnect()
+
+
+def test_late_loop_reads_pingresp_first(broker, make_client):
+    client = make_client(keep_alive=1, recv_timeout=1)
+    broker.no_pingresp = True
+    client.loop()
+    time.sleep(1)
+    client.loop()  # sends the PINGREQ
+    assert broker.wait_for(lambda: broker.packets[-1][0] == 0xC0)
+    # The PINGRESP arrives in time, but is only read past the deadline
+    broker.sessions[-1].send(b"\xd0\x00")
+    time.sleep(1.5)
+    client.loop()
+    assert client.is_connected()
+    assert client.ping_rtt is not None
+    client.disconnect()
+
+
+def test_broker_eof_drops_connection(broker, make_client):
+    client = make_client(keep_alive=60, recv_buffer_size=256)
+    broker.sessions[-1].drop()
+    with pytest.raises(MQTT.MMQTTException, match="closed by broker"):
+        client.loop(1)
+    assert not client.is_connected()
+    with pytest.raises(MQTT.MMQTTException, match="not connected"):
+        client.loop(0.1)
@@ -0,0 +1,99 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""matcher.MQTTMatcher against the recursive trie it replaced"""
+
+import random
+
+import pytest
+
+from adafruit_minimqtt.matcher import MQTTMatcher
+from mqtt_bench import RecursiveMatcher
+
+
+def random_filters(rand, count):
+    """Filters over a small vocabulary, so that many overlap"""
+    levels = ["a", "b", "c", "+", "$SYS"]
+    filters = {"#", "+", "$SYS/#"}
+    while len(filters) < count:
+        parts = [rand.choice(levels) for _ in range(rand.randint(1, 4))]
+        parts = [p for i, p in enumerate(parts) if p != "$SYS" or i == 0]
+        if parts and rand.random() < 0.3:
+            parts.append("#")
+        if parts:
+            filters.add("/".join(parts))
+    return sorted(filters)
+
+
+def random_topics(rand, count):
+    """Topics over the same vocabulary, including $SYS ones and empty levels"""
+    levels = ["a", "b", "c", "d", ""]
+    topics = []
+    for _ in range(count):
+        parts = [rand.choice(levels) for _ in range(rand.randint(1, 5))]
+        if rand.random() < 0.2:
+            parts[0] = "$SYS"
+        topics.append("/".join(parts))
+    return topics
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_matches_in_same_order(seed):
+    rand = random.Random(seed)
+    matcher = MQTTMatcher(cache_size=8)
+    reference = RecursiveMatcher()
+    for value, topic_filter in enumerate(random_filters(rand, 60)):
+        matcher[topic_filter] = value
+        reference[topic_filter] = value
+    # Twice, so that the cached matches are checked too
+    for topic in random_topics(rand, 300) * 2:
+        assert matcher.iter_match(topic) == tuple(reference.iter_match(topic))
+
+
+def test_order():
+    matcher = MQTTMatcher()
+    for value, topic_filter in enumerate(["#", "a/#", "a/+", "a/b", "+/b"]):
+        matcher[topic_filter] = value
+    # Exact, then per level the exact part, "+" and "#", deepest first
+    assert matcher.iter_match("a/b") == (3, 2, 1, 4, 0)
+
+
+def test_sys_topics():
+    matcher = MQTTMatcher()
+    for topic_filter in ["#", "+/uptime", "$SYS/#", "$SYS/+", "$SYS/uptime"]:
+        matcher[topic_filter] = topic_filter
+    # Wildcards at the first level do not match topics starting with $
+    assert matcher.iter_match("$SYS/uptime") == ("$SYS/uptime", "$SYS/+", "$SYS/#")
+    assert matcher.iter_match("$SYS") == ("$SYS/#",)
+    assert matcher.iter_match("sys/uptime") == ("+/uptime", "#")
+
+
+@pytest.mark.parametrize("topic_filter", ["a/b", "a/+", "a/#"])
+def test_cache_invalidated(topic_filter):
+    matcher = MQTTMatcher()
+    matcher["#"] = 0
+    assert matcher.iter_match("a/b") == (0,)
+    matcher[topic_filter] = 1
+    assert matcher.iter_match("a/b") == (1, 0)
+    matcher[topic_filter] = 2
+    assert matcher.iter_match("a/b") == (2, 0)
+    assert matcher[topic_filter] == 2
+    del matcher[topic_filter]
+    assert matcher.iter_match("a/b") == (0,)
+    with pytest.raises(KeyError):
+        del matcher[topic_filter]
+    with pytest.raises(KeyError):
+        matcher[topic_filter]  # pylint: disable=pointless-statement
+
+
+def test_least_recently_used_evicted():
+    matcher = MQTTMatcher(cache_size=2)
+    matcher["+"] = 0
+    for topic in ["t1", "t2", "t1", "t3"]:
+        assert matcher.iter_match(topic) == (0,)
+    # t2 was the least recently used
+    assert list(matcher._cache) == ["t1", "t3"]  # pylint: disable=protected-access
+    matcher["t1"] = 1
+    assert not matcher._cache  # pylint: disable=protected-access
+    assert matcher.iter_match("t1") == (1, 0)
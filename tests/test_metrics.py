@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""metrics.Metrics, and its packed form decoded by tools/status_decode.py"""
+
+import pytest
+
+import metrics
+import status_decode
+
+
+def make_metrics():
+    stats = metrics.Metrics()
+    stats.counter("connect", "publish")
+    stats.gauge("mem_free")
+    stats.histogram("main_loop", "mqtt_loop")
+    return stats
+
+
+def test_unknown_name():
+    stats = make_metrics()
+    with pytest.raises(KeyError):
+        stats.inc("missing")
+    with pytest.raises(KeyError):
+        stats.observe("missing", 1)
+
+
+def test_histogram():
+    stats = make_metrics()
+    for micros in (0, 1, 3, 1500, 2500):
+        stats.observe("main_loop", micros)
+    hist = stats.as_dict()["histograms"]["main_loop"]
+    assert hist["count"] == 5
+    assert hist["sum_ms"] == 4
+    assert hist["max_ms"] == 2.5
+    assert hist["buckets"] == [[1, 1], [2, 1], [4, 1], [2048, 1], [4096, 1]]
+
+
+def test_sum_past_49_days():
+    # A uint32 of milliseconds wraps after 49.7 days of total time
+    stats = make_metrics()
+    day_us = 86400 * 10**6
+    hour_us = 3600 * 10**6
+    for _ in range(100 * 24):
+        stats.observe("main_loop", hour_us + 250)
+    hist = stats.as_dict()["histograms"]["main_loop"]
+    assert hist["sum_ms"] == (100 * day_us + 100 * 24 * 250) // 1000
+    assert hist["max_ms"] == (hour_us + 250) / 1000
+
+
+def test_pack_round_trip():
+    stats = make_metrics()
+    stats.inc("connect")
+    stats.inc("publish", 7)
+    stats.set("mem_free", 4096)
+    for micros in (10, 20, 5 * 10**6 + 123):
+        stats.observe("mqtt_loop", micros)
+    unpacked = status_decode.unpack_metrics(stats.layout(), stats.pack())
+    expected = stats.as_dict()
+    assert unpacked["counters"] == expected["counters"]
+    assert unpacked["gauges"] == expected["gauges"]
+    hist = unpacked["histograms"]["mqtt_loop"]
+    assert hist["sum_ms"] == pytest.approx(5000.153)
+    assert hist["count"] == 3
+    assert hist["buckets"] == expected["histograms"]["mqtt_loop"]["buckets"]
+    assert unpacked["histograms"]["main_loop"]["count"] == 0
+
+
+def test_other_version_rejected():
+    stats = make_metrics()
+    layout = dict(stats.layout(), version=1)
+    with pytest.raises(ValueError, match="format 2 is not 1"):
+        status_decode.unpack_metrics(layout, stats.pack())
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Messages published while disconnected, queued until the next connection"""
+
+import time
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+
+
+def test_queued_until_connected(broker, make_client):
+    client = make_client(connect=False, offline_queue_size=1024)
+    client.publish("a", b"1")
+    client.publish("b", b"2", qos=1)
+    assert client.offline_stats == (2, 0)
+    client.connect()
+    assert client.offline_stats == (0, 0)
+    assert broker.wait_for(lambda: len(broker.received) == 2)
+    assert broker.received == [("a", b"1", 0), ("b", b"2", 1)]
+    # Sent with a single write
+    assert broker.sessions[-1].published == 2
+    client.disconnect()
+
+
+def test_latest_replaces_queued(broker, make_client):
+    client = make_client(connect=False, offline_queue_size=1024)
+    temp = client.prepare_topic("temp", latest=True)
+    client.publish(temp, b"1")
+    client.publish("log", b"x")
+    client.publish(temp, b"2")
+    client.publish(temp, b"3")
+    assert client.offline_stats == (2, 2)
+    client.connect()
+    assert broker.wait_for(lambda: len(broker.received) == 2)
+    assert broker.received == [("log", b"x", 0), ("temp", b"3", 0)]
+    client.disconnect()
+
+
+def test_queue_bound(broker, make_client):
+    # Each message takes 3 bytes of encoded topic and 8 of payload
+    client = make_client(connect=False, offline_queue_size=20)
+    for payload in (b"p1______", b"p2______", b"p3______"):
+        client.publish("t", payload)
+    assert client.offline_stats == (1, 2)
+    client.publish("t", b"x" * 30)  # larger than the whole queue
+    assert client.offline_stats == (1, 3)
+    client.connect()
+    assert broker.wait_for(lambda: len(broker.received) == 1)
+    assert broker.received == [("t", b"p3______", 0)]
+    client.disconnect()
+
+
+def test_inflight_resent_before_queued(broker, make_client):
+    client = make_client(max_inflight=4, offline_queue_size=1024, recv_buffer_size=256)
+    temp = client.prepare_topic("temp", latest=True)
+    broker.no_puback = True
+    client.publish(temp, b"0", qos=1)
+    assert broker.wait_for(lambda: len(broker.received) == 1)
+    broker.sessions[-1].drop()
+    with pytest.raises(MQTT.MMQTTException, match="closed by broker"):
+        client.loop(1)
+    client.publish(temp, b"4", qos=1)
+    assert client.offline_stats == (1, 0)
+
+    broker.no_puback = False
+    stop = time.monotonic() + 5
+    while not client.reconnect_step() and time.monotonic() < stop:
+        time.sleep(0.05)
+    assert broker.wait_for(lambda: len(broker.received) == 3)
+    # The unacknowledged 0 again, with the DUP flag, then the newer 4
+    assert [payload for _, payload, _ in broker.received] == [b"0", b"0", b"4"]
+    assert [header for header, _ in broker.packets if header & 0xF0 == 0x30] == [
+        0x32,
+        0x3A,
+        0x32,
+    ]
+    client.loop(0.5)
+    client.disconnect()
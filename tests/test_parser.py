@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""adafruit_minimqtt.parser.MQTTParser fed packets in pieces"""
+
+import pytest
+
+from adafruit_minimqtt.parser import MQTTParser
+from fake_broker import publish_packet
+
+PACKETS = [
+    b"\x20\x02\x00\x00",  # CONNACK
+    b"\xd0\x00",  # PINGRESP
+    b"\x40\x02\x12\x34",  # PUBACK
+    publish_packet("a/b", b"hello"),
+    publish_packet("/sensor/temperature_house", b"72", qos=1, pid=7),
+    publish_packet("big", bytes(range(256)) * 2),  # 2-byte Remaining Length
+    b"\x90\x03\x00\x01\x00",  # SUBACK
+]
+STREAM = b"".join(PACKETS)
+
+
+def parse(parser):
+    """Returns the complete packets buffered, as (header, length, body)"""
+    packets = []
+    packet = parser.next_packet()
+    while packet is not None:
+        header, length, body = packet
+        packets.append((header, length, bytes(body)))
+        packet = parser.next_packet()
+    return packets
+
+
+def expected(packets):
+    result = []
+    for packet in packets:
+        parser = MQTTParser(1024)
+        parser.feed(packet)
+        result.extend(parse(parser))
+    return result
+
+
+EXPECTED = expected(PACKETS)
+
+
+def test_whole_stream():
+    parser = MQTTParser(1024)
+    assert parser.feed(STREAM) == len(STREAM)
+    assert parse(parser) == EXPECTED
+    assert not parser.pending()
+    assert EXPECTED[3] == (0x30, 10, b"\x00\x03a/bhello")
+
+
+@pytest.mark.parametrize("split", range(1, len(STREAM)))
+def test_split_at_every_byte(split):
+    parser = MQTTParser(1024)
+    parser.feed(STREAM[:split])
+    packets = parse(parser)
+    # Nothing incomplete is returned, and progress is kept across calls
+    assert packets == EXPECTED[: len(packets)]
+    parser.feed(STREAM[split:])
+    assert packets + parse(parser) == EXPECTED
+
+
+def test_one_byte_at_a_time():
+    parser = MQTTParser(64)
+    packets = []
+    for byte in STREAM:
+        parser.feed(bytes([byte]))
+        packets.extend(parse(parser))
+    # The 64 byte buffer truncates the large PUBLISH to what fits after its
+    # 3 byte fixed header, the others fit
+    assert [p[:2] for p in packets] == [p[:2] for p in EXPECTED]
+    assert packets[5][2] == EXPECTED[5][2][:61]
+    assert packets[:5] + packets[6:] == EXPECTED[:5] + EXPECTED[6:]
+
+
+@pytest.mark.parametrize("split", range(1, len(STREAM), 7))
+def test_space_and_commit(split):
+    # Bytes received straight into the buffer, as the client does
+    parser = MQTTParser(1024)
+    packets = []
+    for piece in (STREAM[:split], STREAM[split:]):
+        space = parser.space()
+        space[: len(piece)] = piece
+        parser.commit(len(piece))
+        packets.extend(parse(parser))
+    assert packets == EXPECTED
+
+
+def test_truncated_packet_is_skipped():
+    parser = MQTTParser(64)
+    big = publish_packet("big", bytes(200))
+    stream = big + PACKETS[3]
+    packets, pos = [], 0
+    while pos < len(stream):
+        pos += parser.feed(stream[pos : pos + 50])
+        packets.extend(parse(parser))
+    header, length, body = packets[0]
+    assert (header, length, len(body)) == (0x30, len(big) - 3, 61)
+    assert body == big[3:64]
+    assert packets[1:] == [EXPECTED[3]]
+
+
+def test_next_chunk():
+    parser = MQTTParser(32)
+    big = publish_packet("big", bytes(range(100)))
+    parser.feed(big[:32])
+    header, length, body = parser.next_packet()
+    received = bytes(body)
+    while len(received) < length:
+        chunk = parser.next_chunk()
+        if chunk is None:
+            taken = len(big) - 2 - len(received)
+            parser.feed(big[2 + len(received) :][: min(taken, 32)])
+            continue
+        received += bytes(chunk)
+    assert received == big[2:]
+    assert parser.next_chunk() is None
+
+
+def test_malformed_remaining_length():
+    parser = MQTTParser(16)
+    parser.feed(b"\x30\xff\xff\xff\xff\x01")
+    with pytest.raises(ValueError):
+        parser.next_packet()
+
+
+def test_reset():
+    parser = MQTTParser(64)
+    parser.feed(STREAM[:10])
+    parser.reset()
+    parser.feed(PACKETS[1])
+    assert parse(parser) == [EXPECTED[1]]
@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Memory allocated receiving messages with recv_buffer_size"""
+
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+from fake_broker import publish_packet
+
+MESSAGES = 100
+PAYLOAD = bytes(800)
+LIB = os.path.dirname(MQTT.__file__)
+
+
+def library_memory():
+    """Bytes currently allocated from the library's files"""
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, os.path.join(LIB, "*"))]
+    )
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+@pytest.mark.parametrize("use_binary_mode", [True, False])
+@pytest.mark.parametrize("qos", [0, 1])
+def test_steady_state(broker, make_client, qos, use_binary_mode):
+    client = make_client(recv_buffer_size=1024, use_binary_mode=use_binary_mode)
+    received = [0]
+
+    def on_message(_client, _topic, message):
+        assert len(message) == len(PAYLOAD)
+        received[0] += 1
+
+    client.on_message = on_message
+
+    def receive(count):
+        """Handles :count messages one loop() at a time, returning the
+        highest memory peak of a call"""
+        target = received[0] + count
+        stop = time.monotonic() + 10
+        peak = 0
+        while received[0] < target and time.monotonic() < stop:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                start = tracemalloc.get_traced_memory()[0]
+            client.loop(0.1, max_messages=1)
+            if tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+        assert received[0] == target
+        return peak
+
+    # Sent up front, so that the broker thread stays idle while measuring
+    packets = b"".join(
+        publish_packet("sensor/temp", PAYLOAD, qos, pid + 1)
+        for pid in range(10 + MESSAGES)
+    )
+    broker.sessions[-1].send(packets)
+    # Warm up the topic cache and the matcher
+    receive(10)
+    tracemalloc.start()
+    try:
+        before = library_memory()
+        peak = receive(MESSAGES)
+        retained = library_memory() - before
+    finally:
+        tracemalloc.stop()
+
+    # Nothing is kept per message, only a few counters grow past small ints
+    assert retained < 512
+    if use_binary_mode and qos == 0:
+        # The payload stays in the receive buffer: only the memoryview slices
+        # and tuples of a packet are allocated, about 0.5 KB on CPython, and
+        # freed before the next one
+        assert peak < len(PAYLOAD)
+    client.disconnect()
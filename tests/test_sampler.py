@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""sampler.Sampler and sampler.Deadband, fed by fake sensors"""
+
+import itertools
+import random
+import tracemalloc
+
+import pytest
+
+from sampler import Deadband, Sampler
+
+
+class Sensor:
+    """Fake sensor, returning the readings given and counting them"""
+
+    def __init__(self, readings):
+        self._readings = iter(readings)
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        return next(self._readings)
+
+
+def test_empty():
+    sampler = Sampler(Sensor([]), 4)
+    assert len(sampler) == 0
+    assert sampler.aggregate() is None
+    assert sampler.last is None and sampler.ema is None
+
+
+def test_window():
+    # Whole and half numbers, exact as the float32 the buffer holds
+    readings = [3, 1.5, 7, -2, 4, 10, 0.5, 6]
+    sensor = Sensor(readings)
+    sampler = Sampler(sensor, 4, alpha=0.5)
+    for count, reading in enumerate(readings, start=1):
+        assert sampler.sample() == reading
+        assert sampler.last == reading
+        assert len(sampler) == min(count, 4)
+        window = readings[max(0, count - 4) : count]
+        low, high, mean, _ = sampler.aggregate()
+        assert (low, high) == (min(window), max(window))
+        assert mean == pytest.approx(sum(window) / len(window))
+    assert sensor.reads == len(readings)
+
+
+def test_ema():
+    rand = random.Random(24)
+    readings = [rand.uniform(15, 30) for _ in range(200)]
+    sampler = Sampler(Sensor(readings), 8, alpha=0.3)
+    ema = None
+    for reading in readings:
+        sampler.sample()
+        ema = reading if ema is None else ema + 0.3 * (reading - ema)
+        assert sampler.ema == pytest.approx(ema)
+    assert sampler.aggregate()[3] == sampler.ema
+
+
+def test_constant_memory():
+    rand = random.Random(7)
+    sampler = Sampler(lambda: rand.uniform(-40, 85), 120)
+    for _ in range(200):
+        sampler.sample()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(5000):
+            sampler.sample()
+        sampler.aggregate()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(sampler) == 120
+    # Only the last reading and the average, as floats, are held
+    assert retained < 256
+
+
+def publish(deadband, value):
+    """Publishes :value if due, as code.py does, returning whether it was"""
+    if deadband.due(value):
+        deadband.published(value)
+        return True
+    return False
+
+
+def test_deadband_threshold_and_intervals(clock):
+    deadband = Deadband(1.0, min_interval=10, max_interval=60, clock=clock)
+    assert publish(deadband, 20.0)  # the first value always is
+    clock.now = 5
+    assert not publish(deadband, 30.0)  # too soon, however large the change
+    clock.now = 10
+    assert not publish(deadband, 20.5)
+    assert publish(deadband, 21.0)
+    clock.now = 30
+    assert not publish(deadband, 21.9)
+    assert publish(deadband, 20.0)
+    # Heartbeat once max_interval passed without a large enough change
+    clock.now = 89
+    assert not publish(deadband, 20.0)
+    clock.now = 90
+    assert publish(deadband, 20.0)
+
+
+def test_deadband_failed_publish(clock):
+    deadband = Deadband(1.0, min_interval=10, max_interval=60, clock=clock)
+    assert deadband.due(20.0)
+    clock.now = 5
+    # Not published: still due, and the next one is measured from the first
+    assert deadband.due(20.0)
+    deadband.published(20.0)
+    assert not deadband.due(25.0)
+    clock.now = 15
+    assert deadband.due(25.0)
+    assert not deadband.due(20.5)
+    # A failure leaves the value due at the next sample
+    clock.now = 20
+    assert deadband.due(25.0)
+
+
+def test_deadband_force(clock):
+    deadband = Deadband(5.0, min_interval=10, max_interval=600, clock=clock)
+    assert publish(deadband, 1.0)
+    clock.now = 20
+    assert not publish(deadband, 1.0)
+    deadband.force()
+    assert publish(deadband, 1.0)
+    assert not publish(deadband, 1.0)
+
+
+def test_report_by_exception(clock):
+    # A slow drift with noise, sampled every 5 s, as code.py does
+    rand = random.Random(3)
+    temperatures = (
+        20 + t / 600 + rand.uniform(-0.2, 0.2) for t in itertools.count(0, 5)
+    )
+    sampler = Sampler(Sensor(temperatures), 24, alpha=0.3)
+    deadband = Deadband(0.5, min_interval=30, max_interval=900, clock=clock)
+    published = []
+    for step in range(720):  # one hour
+        clock.now = step * 5
+        sampler.sample()
+        if publish(deadband, sampler.ema):
+            published.append((clock.now, sampler.ema))
+    # The EMA rises 6 degrees over the hour: about one publish per 0.5
+    # degree, instead of one per sample
+    assert 8 <= len(published) <= 20
+    for (t1, v1), (t2, v2) in zip(published, published[1:]):
+        assert t2 - t1 >= 30
+        assert abs(v2 - v1) >= 0.5 or t2 - t1 >= 900
+
+
+@pytest.mark.parametrize("swing, most", [(0, 48), (20, 144)])
+def test_daily_volume(clock, swing, most):
+    # code.py's DEADBANDS, over a day of 5 s samples: steady, or changing by
+    # far more than the threshold all the time
+    rand = random.Random(5)
+    deadband = Deadband(0.5, min_interval=10 * 60, max_interval=30 * 60, clock=clock)
+    count = 0
+    for step in range(24 * 720):
+        clock.now = step * 5
+        count += publish(deadband, 20 + rand.uniform(-swing, swing))
+    # At most as many as the status they were sent with every 10 minutes
+    assert count == most
@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""scheduler.Scheduler against a virtual clock"""
+
+import importlib
+import itertools
+import random
+import sys
+
+import pytest
+
+import scheduler
+
+
+@pytest.fixture(params=["heapq", "fallback"])
+def sched_module(request, monkeypatch):
+    """The scheduler module, with heapq and with its own heap functions"""
+    if request.param == "fallback":
+        monkeypatch.setitem(sys.modules, "heapq", None)
+    yield importlib.reload(scheduler)
+    monkeypatch.undo()
+    importlib.reload(scheduler)
+
+
+def run_until(sched, clock, end, on_run=None):
+    """Jumps from deadline to deadline until :end, returning the runs made as
+    (time, name)"""
+    runs = []
+    while True:
+        deadline = sched.next_deadline()
+        if deadline is None or deadline > end:
+            return runs
+        assert deadline >= clock.now
+        clock.now = deadline
+        for name, _, _ in sched.due():
+            runs.append((clock.now, name))
+            if on_run is not None:
+                on_run(name)
+
+
+def test_intervals(sched_module, clock):
+    sched = sched_module.Scheduler(clock)
+    sched.add("a", 10, None)
+    sched.add("b", 25, None, delay=5)
+    runs = run_until(sched, clock, 60)
+    assert [t for t, name in runs if name == "a"] == [0, 10, 20, 30, 40, 50, 60]
+    assert [t for t, name in runs if name == "b"] == [5, 30, 55]
+
+
+def test_cancel_reschedule_retry(sched_module, clock):
+    sched = sched_module.Scheduler(clock)
+    sched.add("a", 10, None)
+    sched.add("b", 10, None)
+    run_until(sched, clock, 0)
+    assert sched.cancel("b")
+    assert not sched.cancel("b")
+    assert "b" not in sched and len(sched) == 1
+
+    clock.now = 3
+    sched.reschedule("a", 0)
+    assert sched.next_deadline() == 3
+    sched.reschedule("a")
+    assert sched.next_deadline() == 13
+    sched.reschedule("a", 1, interval=100)
+    assert run_until(sched, clock, 200) == [(4, "a"), (104, "a")]
+
+    sched.retry("a", 2)
+    assert sched.next_deadline() == 106
+    assert run_until(sched, clock, 210) == [(106, "a"), (206, "a")]
+    sched.retry("missing", 2)
+    assert "missing" not in sched
+
+
+def test_retry_while_iterating(sched_module, clock):
+    # retry() compacts the heap once cancelled entries pile up; entries not
+    # run yet by due() must not be run twice afterwards
+    sched = sched_module.Scheduler(clock)
+    for name in "cdef":
+        sched.add(name, 100, None)
+
+    def on_run(name):
+        if name == "c":
+            for _ in range(25):
+                sched.retry("c", 50)
+
+    runs = run_until(sched, clock, 200, on_run)
+    assert [t for t, name in runs if name == "c"] == [0, 50, 100, 150, 200]
+    for name in "def":
+        assert [t for t, n in runs if n == name] == [0, 100, 200]
+    assert len(sched) == 4
+
+
+@pytest.mark.parametrize("now, interval", [(0, 0), (1e16, 0.5)])
+def test_due_again_waits_for_next_call(sched_module, clock, now, interval):
+    # clock() + interval <= now: zero, or lost to rounding at large times
+    clock.now = now
+    sched = sched_module.Scheduler(clock)
+    sched.add("a", interval, None)
+    sched.add("b", 10, None)
+
+    def run():
+        return [name for name, _, _ in itertools.islice(sched.due(), 10)]
+
+    assert run() == ["a", "b"]
+    # Due again at once, but only run once per call
+    assert sched.next_deadline() == now
+    assert run() == ["a"]
+    assert run() == ["a"]
+
+
+def test_thousands_of_timers(sched_module, clock):
+    rand = random.Random(42)
+    sched = sched_module.Scheduler(clock)
+    intervals = {}
+    for name in range(5000):
+        intervals[name] = rand.choice([1, 2.5, 7, 16, 60, 120])
+        sched.add(name, intervals[name], None, delay=rand.random() * intervals[name])
+    cancelled = set(rand.sample(range(5000), 2000))
+    for name in cancelled:
+        assert sched.cancel(name)
+
+    last = {}
+    retried = set()
+
+    def on_run(name):
+        if name in last:
+            expected = last[name] + (1 if name in retried else intervals[name])
+            assert clock.now == pytest.approx(expected)
+            retried.discard(name)
+        last[name] = clock.now
+        if name % 97 == 0 and rand.random() < 0.1:
+            sched.retry(name, 1)
+            retried.add(name)
+
+    runs = run_until(sched, clock, 300, on_run)
+    assert not cancelled & {name for _, name in runs}
+    assert set(last) == set(range(5000)) - cancelled
+    assert len(sched) == 3000
+    # Never twice at the same time, and about once per interval
+    assert len(runs) == len(set(runs))
+    assert len(runs) == pytest.approx(
+        sum(300 / intervals[name] for name in last), rel=0.05
+    )
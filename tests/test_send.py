@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Every packet sent whole over sockets that take a few bytes per send"""
+
+import socket
+import time
+
+
+class ShortSocket:
+    """Socket sending at most 3 bytes per call, as send() is allowed to"""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def send(self, data):
+        """Send the start of :data, returning how much was sent"""
+        return self._sock.send(bytes(data[:3]))
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class ShortPool:
+    """Stand-in for the socket module, making ShortSockets"""
+
+    @staticmethod
+    def socket(*args):
+        """Return a new ShortSocket"""
+        return ShortSocket(socket.socket(*args))
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+
+def test_short_sends(broker, make_client):
+    client = make_client(
+        socket_pool=ShortPool(),
+        keep_alive=1,
+        recv_timeout=1,
+        recv_buffer_size=256,
+        max_inflight=4,
+    )
+    client.subscribe("in", qos=1)
+    broker.no_puback = True
+    client.publish("out", b"x" * 100, qos=1)
+    broker.publish_to(broker.sessions[-1], "in", b"hello", qos=1, pid=9)
+    # Long enough for a PINGREQ and a retransmit of the PUBLISH
+    stop = time.monotonic() + 2.5
+    while time.monotonic() < stop:
+        client.loop(0.1)
+    client.disconnect()
+
+    assert broker.wait_for(lambda: broker.packets[-1][0] == 0xE0)
+    kinds = [header for header, _ in broker.packets]
+    assert kinds[:2] == [0x10, 0x82]
+    assert 0x40 in kinds  # PUBACK of pid 9
+    assert 0xC0 in kinds  # PINGREQ
+    # The PUBLISH, then its retransmits with the DUP flag
+    assert kinds.count(0x32) == 1 and 0x3A in kinds
+    assert broker.received[0] == ("out", b"x" * 100, 1)
+    assert all(message == broker.received[0] for message in broker.received)
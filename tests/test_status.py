@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""status.StatusEncoder and status.cbor_dumps, decoded by tools/status_decode.py"""
+
+import json
+import random
+
+import pytest
+
+import status_decode
+from status import StatusEncoder, cbor_dumps
+
+
+def wire(payload):
+    """:payload as published, JSON strings being sent as UTF-8"""
+    return payload.encode("utf-8") if isinstance(payload, str) else payload
+
+
+@pytest.mark.parametrize(
+    "obj, encoded",
+    [
+        # From RFC 8949, Appendix A
+        (0, "00"),
+        (23, "17"),
+        (24, "1818"),
+        (100, "1864"),
+        (1000, "1903e8"),
+        (1000000, "1a000f4240"),
+        (1000000000000, "1b000000e8d4a51000"),
+        (18446744073709551615, "1bffffffffffffffff"),
+        (-1, "20"),
+        (-100, "3863"),
+        (-1000, "3903e7"),
+        (-18446744073709551616, "3bffffffffffffffff"),
+        (1.5, "fa3fc00000"),
+        (False, "f4"),
+        (True, "f5"),
+        (None, "f6"),
+        (b"", "40"),
+        (b"\x01\x02\x03\x04", "4401020304"),
+        ("", "60"),
+        ("ü", "62c3bc"),
+        ([], "80"),
+        ((1, 2, 3), "83010203"),
+        ({}, "a0"),
+        ({"a": 1, "b": [2, 3]}, "a26161016162820203"),
+    ],
+)
+def test_cbor_encoding(obj, encoded):
+    assert cbor_dumps(obj).hex() == encoded
+
+
+def test_cbor_round_trip():
+    values = [0, 23, 24, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1]
+    values += [-1 - value for value in values]
+    obj = {
+        "ints": values,
+        "float": -0.25,
+        "bytes": bytes(range(256)),
+        "none": None,
+        "flags": [True, False],
+        "nested": {"text": "x" * 300, "empty": {}, "list": [[], [None]]},
+    }
+    assert status_decode.loads(cbor_dumps(obj)) == obj
+
+
+def test_cbor_unsupported_type():
+    with pytest.raises(TypeError):
+        cbor_dumps({1, 2})
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_deltas(binary):
+    encoder = StatusEncoder(binary=binary, full_every=3)
+
+    def loads(payload):
+        return status_decode.loads(wire(payload))
+
+    fields = {"uptime": 1, "rssi": -60, "counters": {"a": 1, "b": 2}}
+    assert loads(encoder.encode(fields)) == dict(fields, seq=1, full=True)
+
+    fields = {"uptime": 2, "rssi": -60, "counters": {"a": 1, "b": 3}}
+    # Dicts are diffed one level down
+    assert loads(encoder.encode(fields)) == {"uptime": 2, "counters": {"b": 3}, "seq": 2}
+    assert loads(encoder.encode(dict(fields))) == {"seq": 3}
+    # Every third message is full again
+    assert loads(encoder.encode(dict(fields))) == dict(fields, seq=4, full=True)
+    encoder.force_full()
+    assert loads(encoder.encode(dict(fields))) == dict(fields, seq=5, full=True)
+
+
+def test_static():
+    encoder = StatusEncoder()
+    info = {"ip": "10.0.0.2", "version": "1"}
+    assert json.loads(encoder.encode_static(info)) == info
+    assert encoder.encode_static(dict(info)) is None
+    info = dict(info, ip="10.0.0.3")
+    assert json.loads(encoder.encode_static(info)) == info
+    encoder.force_full()
+    assert json.loads(encoder.encode_static(info)) == info
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_decoded_status(binary):
+    rand = random.Random(binary)
+    encoder = StatusEncoder(binary=binary, full_every=5)
+    stations = status_decode.Stations()
+    # JSON has no bytes
+    values = ["p", None, -(2**40), 2**63, 0.5] + ([b"\x01"] if binary else [])
+    fields = {"uptime": 0, "name": "p", "raw": None, "off": None, "c": {}}
+    for step in range(50):
+        fields = dict(fields, uptime=step * 600)
+        key = rand.choice(["name", "raw", "off", "c"])
+        if key == "c":
+            fields["c"] = dict(fields["c"], **{rand.choice("xyz"): rand.randint(-5, 5)})
+        else:
+            fields[key] = rand.choice(values)
+        result = stations.update("/p/status", wire(encoder.encode(fields)))
+        assert result["seq"] == step + 1
+        assert result["status"] == fields
+
+
+def test_removed_nested_key():
+    # Removals are not sent: the decoded status keeps the key until the next
+    # full message
+    encoder = StatusEncoder(full_every=3)
+    stations = status_decode.Stations()
+    stations.update("/p/status", wire(encoder.encode({"c": {"x": 1, "y": 2}})))
+    result = stations.update("/p/status", wire(encoder.encode({"c": {"x": 1}})))
+    assert result["status"] == {"c": {"x": 1, "y": 2}}
+    stations.update("/p/status", wire(encoder.encode({"c": {"x": 1}})))
+    result = stations.update("/p/status", wire(encoder.encode({"c": {"x": 1}})))
+    assert result["status"] == {"c": {"x": 1}}
+
+
+def test_missed_message():
+    encoder = StatusEncoder()
+    stations = status_decode.Stations()
+    assert "error" in stations.update("/p/status", b'{"seq": 7, "a": 1}')
+    stations.update("/p/status", wire(encoder.encode({"a": 1})))
+    encoder.encode({"a": 2})  # lost
+    result = stations.update("/p/status", wire(encoder.encode({"a": 3})))
+    assert result["error"] == "missed a status message"
+    # Until the next full one
+    result = stations.update("/p/status", wire(encoder.encode({"a": 4})))
+    assert result["error"] == "waiting for a full status"
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""Payloads larger than the receive buffer, through MQTT.add_stream_callback"""
+
+import random
+import struct
+import time
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+
+SIZES = [0, 1, 31, 32, 33, 100, 127, 128, 129, 500, 1000, 4095, 5000]
+
+
+@pytest.mark.parametrize("qos", [0, 1])
+def test_stream_interleaved(broker, make_client, qos):
+    rand = random.Random(qos)
+    client = make_client(recv_buffer_size=128)
+    streamed, messages = [], []
+
+    def on_chunk(_client, topic, chunk, offset, total):
+        assert len(chunk) <= 32
+        if offset == 0:
+            streamed.append([topic, bytearray(), total])
+        current = streamed[-1]
+        assert (current[0], current[2]) == (topic, total)
+        assert offset == len(current[1])
+        current[1] += chunk
+
+    client.add_stream_callback("big", on_chunk, chunk_size=32)
+    client.on_message = lambda _client, topic, message: messages.append((topic, message))
+
+    sent = []
+    for pid, size in enumerate(SIZES, start=1):
+        payload = bytes(rand.getrandbits(8) for _ in range(size))
+        sent.append(payload)
+        broker.publish_to(broker.sessions[-1], "big", payload, qos, pid)
+        broker.publish_to(broker.sessions[-1], "small", str(size).encode())
+
+    stop = time.monotonic() + 10
+    while len(messages) < len(SIZES) and time.monotonic() < stop:
+        client.loop(0.1)
+
+    assert [(t, bytes(p), n) for t, p, n in streamed] == [
+        ("big", payload, len(payload)) for payload in sent
+    ]
+    assert messages == [("small", str(size)) for size in SIZES]
+
+    def pubacks():
+        return [
+            struct.unpack("!H", body)[0]
+            for header, body in broker.packets
+            if header == 0x40
+        ]
+
+    if qos:
+        assert broker.wait_for(lambda: len(pubacks()) == len(SIZES))
+    assert pubacks() == (list(range(1, len(SIZES) + 1)) if qos else [])
+    assert client.is_connected()
+    client.disconnect()
+
+
+def test_stream_requires_buffer(make_client):
+    client = make_client(connect=False)
+    with pytest.raises(MQTT.MMQTTException):
+        client.add_stream_callback("big", lambda *args: None)
@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""The network thread of MQTT.loop_start, fed from other threads"""
+
+import threading
+import time
+
+import pytest
+
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+
+
+def run_in_thread(target, timeout=5):
+    """Runs :target on a new thread, returning whether it finished in time"""
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return not worker.is_alive()
+
+
+@pytest.mark.parametrize("qos", [0, 1])
+def test_producer_threads(broker, make_client, qos):
+    client = make_client(recv_buffer_size=1024, max_inflight=8)
+    published = []
+    client.on_publish = lambda _client, _data, topic, _pid: published.append(topic)
+    client.loop_start()
+
+    def produce(n):
+        for i in range(50):
+            client.publish("out/{}".format(n), str(i), qos=qos)
+
+    producers = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    assert broker.wait_for(lambda: len(broker.received) == 200)
+    for n in range(4):
+        topic = "out/{}".format(n)
+        # In order per producer, as queued
+        assert [p for t, p, _ in broker.received if t == topic] == [
+            str(i).encode() for i in range(50)
+        ]
+    assert broker.wait_for(lambda: len(published) == 200)
+    client.loop_stop()
+    client.disconnect()
+
+
+def test_calls_run_on_network_thread(broker, make_client):
+    client = make_client(recv_buffer_size=1024)
+    messages = []
+    client.on_message = lambda _client, topic, message: messages.append(
+        (topic, message, threading.current_thread())
+    )
+    client.loop_start()
+    assert run_in_thread(lambda: client.subscribe("in"))
+    broker.publish("in", b"hello")
+    assert broker.wait_for(lambda: messages)
+    topic, message, thread = messages[0]
+    assert (topic, message) == ("in", "hello")
+    assert thread is client._thread  # pylint: disable=protected-access
+    assert run_in_thread(lambda: client.unsubscribe("in"))
+    assert run_in_thread(client.disconnect)
+    assert not client.is_connected()
+    client.loop_stop()
+
+
+def test_wake_pipe(broker, make_client):
+    # The network thread waits on select() for up to a second, a publish from
+    # another thread must not wait for that
+    client = make_client(keep_alive=60)
+    client.loop_start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    client.publish("out", b"now")
+    assert broker.wait_for(lambda: broker.received, timeout=1)
+    assert time.monotonic() - start < 0.5
+    client.loop_stop()
+    client.disconnect()
+
+
+def test_batches_wait_for_window(broker, make_client):
+    client = make_client(recv_buffer_size=1024, max_inflight=4)
+    client.loop_start()
+    for batch in range(6):
+        client.publish_many([("out", str(batch * 4 + i), 1) for i in range(4)])
+    assert broker.wait_for(lambda: len(broker.received) == 24)
+    assert [p for _, p, _ in broker.received] == [str(i).encode() for i in range(24)]
+    client.loop_stop()
+    client.disconnect()
+
+
+def test_batch_larger_than_window(broker, make_client):
+    client = make_client(recv_buffer_size=1024, max_inflight=4)
+    client.loop_start()
+    with pytest.raises(MQTT.MMQTTException, match="In-flight window"):
+        client.publish_many([("out", b"x", 1)] * 6)
+    # Nothing is stuck in the queue: later publishes and calls go through
+    client.publish_many([("out", b"y", 1)] * 4)
+    assert broker.wait_for(lambda: len(broker.received) == 4)
+    assert run_in_thread(client.disconnect)
+    assert not client.is_connected()
+    client.loop_stop()
@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`fake_broker`
+====================================================================================
+
+Just enough of an MQTT 3.1.1 broker, on localhost, for the benchmarks in
+tools/mqtt_bench.py and the tests under tests/.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+from adafruit_minimqtt.matcher import MQTTMatcher
+
+
+def remaining_length(length):
+    """Encode an MQTT Remaining Length"""
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def publish_packet(topic, payload, qos=0, pid=1, retain=False):
+    """Encode a PUBLISH packet"""
+    body = struct.pack("!H", len(topic)) + topic.encode("utf-8")
+    if qos:
+        body += struct.pack("!H", pid)
+    body += payload
+    header = 0x30 | qos << 1 | retain
+    return bytes([header]) + remaining_length(len(body)) + body
+
+
+class Session:
+    """A client connected to the FakeBroker"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.filters = set()
+        self.published = 0
+
+    def send(self, data):
+        """Send :data, unless the client went away"""
+        try:
+            with self.lock:
+                self.sock.sendall(data)
+        except OSError:
+            pass
+
+    def read(self, size):
+        """Read exactly :size bytes, or raise EOFError"""
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def drop(self):
+        """Close the connection, as a broker going away would"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class FakeBroker:
+    """QoS 0 and 1 routing, wildcard subscriptions and keep alive, one thread
+    per client. QoS 1 publishes are acknowledged and pings answered, unless
+    ``no_puback`` or ``no_pingresp`` are set. Messages are routed at QoS 0.
+
+    With :record, received packets are kept in ``packets`` as
+    ``(header, body)``, and published messages in ``received`` as
+    ``(topic, payload, qos)``.
+
+    :param bool record: Keep what clients send, for the tests to check.
+    """
+
+    def __init__(self, record=True):
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+        self.sessions = []
+        self.packets = []
+        self.received = []
+        self.no_puback = False
+        self.no_pingresp = False
+        self._record = record
+        self._subs = MQTTMatcher()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        """Stop accepting clients and drop the connected ones"""
+        self._server.close()
+        for session in self.sessions:
+            session.drop()
+
+    def wait_for(self, condition, timeout=5):
+        """Wait until :condition() is true, returning False on timeout"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = Session(sock)
+            self.sessions.append(session)
+            threading.Thread(target=self._serve, args=(session,), daemon=True).start()
+
+    def _serve(self, session):
+        try:
+            while True:
+                header = session.read(1)[0]
+                length = shift = 0
+                while True:
+                    byte = session.read(1)[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = session.read(length) if length else b""
+                if self._record:
+                    self.packets.append((header, body))
+                if not self._handle(session, header, body):
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._unsubscribe(session, list(session.filters))
+            session.sock.close()
+
+    def _handle(self, session, header, body):
+        kind = header & 0xF0
+        if kind == 0x10:
+            session.send(b"\x20\x02\x00\x00")
+        elif kind == 0x30:
+            topic_len = struct.unpack_from("!H", body)[0]
+            topic = body[2 : 2 + topic_len].decode("utf-8")
+            qos = header >> 1 & 3
+            start = 2 + topic_len
+            if qos:
+                if not self.no_puback:
+                    session.send(b"\x40\x02" + body[start : start + 2])
+                start += 2
+            session.published += 1
+            if self._record:
+                self.received.append((topic, body[start:], qos))
+            self.publish(topic, body[start:])
+        elif kind == 0x80:
+            pid, i, granted = body[:2], 2, bytearray()
+            while i < len(body):
+                topic_len = struct.unpack_from("!H", body, i)[0]
+                topic = body[i + 2 : i + 2 + topic_len].decode("utf-8")
+                granted.append(min(body[i + 2 + topic_len], 1))
+                i += 3 + topic_len
+                session.filters.add(topic)
+                with self._lock:
+                    try:
+                        self._subs[topic].add(session)
+                    except KeyError:
+                        self._subs[topic] = {session}
+            session.send(b"\x90" + remaining_length(2 + len(granted)) + pid + granted)
+        elif kind == 0xA0:
+            topics, i = [], 2
+            while i < len(body):
+                topic_len = struct.unpack_from("!H", body, i)[0]
+                topics.append(body[i + 2 : i + 2 + topic_len].decode("utf-8"))
+                i += 2 + topic_len
+            self._unsubscribe(session, topics)
+            session.send(b"\xb0\x02" + body[:2])
+        elif kind == 0xC0:
+            if not self.no_pingresp:
+                session.send(b"\xd0\x00")
+        elif kind == 0xE0:
+            return False
+        return True
+
+    def _unsubscribe(self, session, topics):
+        with self._lock:
+            for topic in topics:
+                session.filters.discard(topic)
+                try:
+                    self._subs[topic].discard(session)
+                except KeyError:
+                    pass
+
+    def publish(self, topic, payload):
+        """Route a QoS 0 PUBLISH to the subscribers of :topic"""
+        packet = None
+        with self._lock:
+            targets = set()
+            for sessions in self._subs.iter_match(topic):
+                targets.update(sessions)
+        for session in targets:
+            packet = packet or publish_packet(topic, payload)
+            session.send(packet)
+
+    @staticmethod
+    def publish_to(session, topic, payload, qos=0, pid=1):
+        """Send a PUBLISH to the client of :session"""
+        session.send(publish_packet(topic, payload, qos, pid))
+
+    @staticmethod
+    def burst(session, packet, count):
+        """Send :packet to :session :count times, in large writes"""
+        per_write = max(1, 65536 // len(packet))
+        while count > 0:
+            session.send(packet * min(per_write, count))
+            count -= per_write
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`mqtt_bench`
+====================================================================================
+
+Benchmarks of the vendored MiniMQTT client, run on CPython against a broker
+stand-in listening on localhost in the same process. Results are written as
+JSON, and can be compared with the JSON of an earlier run::
+
+    python3 tools/mqtt_bench.py -o after.json --compare before.json
+
+Rates are per second, times in milliseconds, and allocations in bytes, as
+traced by ``tracemalloc`` for the library files only.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+try:
+    import micropython  # pylint: disable=unused-import
+except ImportError:
+    # CircuitPython builtin the library uses for its constants
+    sys.modules["micropython"] = types.SimpleNamespace(const=lambda value: value)
+
+# pylint: disable=wrong-import-position
+from adafruit_minimqtt import adafruit_minimqtt as MQTT
+from adafruit_minimqtt.matcher import MQTTMatcher
+from fake_broker import FakeBroker, publish_packet
+
+try:
+    from adafruit_minimqtt.async_minimqtt import AsyncMQTT
+except ImportError:
+    # Trees without the asyncio client, bench_async is skipped
+    AsyncMQTT = None
+
+PAYLOAD_SIZES = (16, 256, 1024, 4096)
+
+
+PACKET_TYPES = {
+    1: "CONNECT",
+    3: "PUBLISH",
+    4: "PUBACK",
+    8: "SUBSCRIBE",
+    10: "UNSUBSCRIBE",
+    12: "PINGREQ",
+    14: "DISCONNECT",
+}
+
+
+class CountingSocket:
+    """Socket wrapper counting the calls to send and the bytes sent, by MQTT
+    packet type, as socket methods can not be replaced on the instance.
+
+    The bytes sent are split into packets as they go: a send is counted for
+    the packet it starts in, bytes for the packets they belong to."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sends = 0
+        self.bytes = 0
+        # Packet type: [packets, sends, bytes]
+        self.by_type = {}
+        self._kind = None
+        self._header = bytearray()
+        self._left = 0
+
+    def send(self, data):
+        """Count and send :data"""
+        sent = self._sock.send(data)
+        self.sends += 1
+        self.bytes += sent
+        data = memoryview(data)[:sent]
+        if sent:
+            if not self._left and not self._header:
+                self._kind = PACKET_TYPES.get(data[0] >> 4, str(data[0] >> 4))
+            self._stats(self._kind)[1] += 1
+        pos = 0
+        while pos < sent:
+            if self._left:
+                taken = min(self._left, sent - pos)
+                self._stats(self._kind)[2] += taken
+                self._left -= taken
+                pos += taken
+                continue
+            byte = data[pos]
+            pos += 1
+            self._header.append(byte)
+            if len(self._header) == 1:
+                self._kind = PACKET_TYPES.get(byte >> 4, str(byte >> 4))
+            elif not byte & 0x80:
+                # End of the Remaining Length
+                length = 0
+                for digit in reversed(self._header[1:]):
+                    length = length << 7 | digit & 0x7F
+                stats = self._stats(self._kind)
+                stats[0] += 1
+                stats[2] += len(self._header)
+                self._header = bytearray()
+                self._left = length
+        return sent
+
+    def _stats(self, kind):
+        return self.by_type.setdefault(kind, [0, 0, 0])
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class CountingPool:
+    """Stand-in for the socket module, making CountingSockets"""
+
+    def __init__(self):
+        self.sockets = []
+
+    def socket(self, *args):
+        """Return a new CountingSocket"""
+        sock = CountingSocket(socket.socket(*args))
+        self.sockets.append(sock)
+        return sock
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+
+def packet_stats(sockets):
+    """Send calls and bytes per packet sent by :sockets, by packet type"""
+    totals = {}
+    for sock in sockets:
+        for kind, counts in sock.by_type.items():
+            total = totals.setdefault(kind, [0, 0, 0])
+            for i, count in enumerate(counts):
+                total[i] += count
+    return {
+        kind: {
+            "packets": packets,
+            "sends_per_packet": round(sends / packets, 3),
+            "bytes_per_packet": round(size / packets, 1),
+        }
+        for kind, (packets, sends, size) in sorted(totals.items())
+        if packets
+    }
+
+
+def make_client(broker, **kwargs):
+    """Return a connected blocking client"""
+    kwargs.setdefault("socket_pool", socket)
+    client = MQTT.MQTT(
+        "127.0.0.1",
+        port=broker.port,
+        is_ssl=False,
+        socket_timeout=0.5,
+        **kwargs,
+    )
+    client.connect()
+    return client
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds else None
+
+
+def _lib_only(stats):
+    lib = os.path.join("lib", "adafruit_minimqtt")
+    return [stat for stat in stats if lib in stat.traceback[0].filename]
+
+
+class AllocationMeter:
+    """Peak bytes traced in the library per event, and bytes it kept at the end.
+
+    tracemalloc only reports live memory, so each event counts the peak above
+    what was live at the previous event: memory freed before the event ended
+    is still counted, reused memory only once."""
+
+    def __init__(self):
+        self.events = 0
+        self.peak_total = 0
+        self._base = 0
+        self._snapshot = None
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self
+
+    def event(self):
+        """Account for one event, e.g. from a message callback"""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_total += peak - self._base
+        self._base = current
+        tracemalloc.reset_peak()
+        self.events += 1
+
+    def __exit__(self, *exc):
+        diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "filename")
+        self.retained = sum(stat.size_diff for stat in _lib_only(diff))
+        tracemalloc.stop()
+
+    def result(self):
+        """Return the metrics as a dict"""
+        return {
+            "peak_bytes_per_msg": round(self.peak_total / max(self.events, 1), 1),
+            "retained_bytes": self.retained,
+        }
+
+
+def bench_connect(broker, count):
+    """CONNECT/CONNACK round trips, fresh socket each time"""
+    pool = CountingPool()
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client = make_client(broker, socket_pool=pool)
+        times.append((time.perf_counter() - start) * 1000)
+        client.disconnect()
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "max_ms": round(max(times), 3),
+        "packets": packet_stats(pool.sockets),
+    }
+
+
+def bench_subscribe(broker, topics):
+    """Subscribing to many topics, in one SUBSCRIBE and in one per topic"""
+    names = ["bench/sub/{}".format(i) for i in range(topics)]
+    pool = CountingPool()
+    client = make_client(broker, socket_pool=pool)
+    sock = pool.sockets[-1]
+    sock.by_type = {}
+    start = time.perf_counter()
+    client.subscribe([(name, 0) for name in names])
+    single = time.perf_counter() - start
+    client.unsubscribe(names)
+    listed = packet_stats([sock])
+    sock.by_type = {}
+    start = time.perf_counter()
+    for name in names:
+        client.subscribe(name)
+    each = time.perf_counter() - start
+    one_by_one = packet_stats([sock])
+    client.disconnect()
+    return {
+        "topics": topics,
+        "list_ms": round(single * 1000, 3),
+        "one_by_one_ms": round(each * 1000, 3),
+        "list_packets": listed,
+        "one_by_one_packets": one_by_one,
+    }
+
+
+def bench_fanout(broker, clients, messages):
+    """One publisher, the same message delivered to many subscribed clients"""
+    subscribers = []
+    received = [0]
+
+    def on_message(_client, _topic, _message):
+        received[0] += 1
+
+    for _ in range(clients):
+        client = make_client(broker, recv_buffer_size=1024)
+        client.on_message = on_message
+        client.subscribe("bench/fanout")
+        subscribers.append(client)
+    publisher = make_client(broker)
+    expected = clients * messages
+    start = time.perf_counter()
+    for i in range(messages):
+        publisher.publish("bench/fanout", i)
+    while received[0] < expected and time.perf_counter() - start < 30:
+        for client in subscribers:
+            client.loop()
+    elapsed = time.perf_counter() - start
+    for client in subscribers + [publisher]:
+        client.disconnect()
+    return {
+        "clients": clients,
+        "deliveries_per_s": _rate(received[0], elapsed),
+        "lost": expected - received[0],
+    }
+
+
+def bench_publish(broker, count):
+    """Publish rates at QoS 0 and 1, with plain and prepared topics"""
+    results = {}
+    cases = (
+        ("qos0", {}, 0, False, False),
+        ("qos0_prepared", {}, 0, True, False),
+        ("qos1_blocking", {}, 1, True, False),
+        ("qos1_window", {"max_inflight": 64, "recv_buffer_size": 4096}, 1, True, False),
+        ("qos1_batched", {"max_inflight": 64, "recv_buffer_size": 4096}, 1, True, True),
+    )
+    for name, kwargs, qos, prepared, batched in cases:
+        pool = CountingPool()
+        client = make_client(broker, socket_pool=pool, **kwargs)
+        topic = client.prepare_topic("bench/pub") if prepared else "bench/pub"
+        meter = AllocationMeter()
+        start = time.perf_counter()
+        with meter:
+            if batched:
+                for i in range(0, count, 8):
+                    while len(client._inflight) > 56:  # pylint: disable=protected-access
+                        client.loop()
+                    client.publish_many([(topic, i + j, qos) for j in range(8)])
+                    meter.event()
+            else:
+                for i in range(count):
+                    while kwargs and len(client._inflight) >= 64:  # pylint: disable=protected-access
+                        client.loop()
+                    client.publish(topic, i, qos=qos)
+                    meter.event()
+            while client._inflight:  # pylint: disable=protected-access
+                client.loop(0.01)
+        elapsed = time.perf_counter() - start
+        _, sends, size = pool.sockets[-1].by_type["PUBLISH"]
+        client.disconnect()
+        results[name] = dict(
+            msgs_per_s=_rate(count, elapsed),
+            sends_per_msg=round(sends / count, 3),
+            bytes_per_msg=round(size / count, 1),
+            **meter.result()
+        )
+        if batched:
+            results[name]["peak_bytes_per_msg"] = round(meter.peak_total / count, 1)
+    return results
+
+
+def _wait_published(session, count, timeout=60):
+    """Wait until the broker received :count publishes from :session"""
+    deadline = time.perf_counter() + timeout
+    while session.published < count and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+
+def bench_threads(broker, count, producers=(1, 4, 16)):
+    """Publish rates from producer threads while loop_start runs the network
+    loop, next to a single thread publishing and calling loop itself. Rates
+    are counted until the broker received every message."""
+    kwargs = {"max_inflight": 64, "recv_buffer_size": 4096}
+    results = {}
+    for qos in (0, 1):
+        client = make_client(broker, **kwargs)
+        session = broker.sessions[-1]
+        topic = client.prepare_topic("bench/threads")
+        start = time.perf_counter()
+        for i in range(count):
+            while len(client._inflight) >= 64:  # pylint: disable=protected-access
+                client.loop()
+            client.publish(topic, i, qos=qos)
+        while session.published < count and time.perf_counter() - start < 60:
+            client.loop(0.01)
+        result = {"single_msgs_per_s": _rate(count, time.perf_counter() - start)}
+        client.disconnect()
+
+        for threads in producers:
+            client = make_client(broker, **kwargs)
+            session = broker.sessions[-1]
+            topic = client.prepare_topic("bench/threads")
+            per_thread = count // threads
+
+            def produce(client=client, topic=topic, per_thread=per_thread, qos=qos):
+                for i in range(per_thread):
+                    client.publish(topic, i, qos=qos)
+
+            workers = [threading.Thread(target=produce) for _ in range(threads)]
+            client.loop_start()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            _wait_published(session, per_thread * threads)
+            elapsed = time.perf_counter() - start
+            client.loop_stop()
+            client.disconnect()
+            key = "threads_{}_msgs_per_s".format(threads)
+            result[key] = _rate(session.published, elapsed)
+        results["qos{}".format(qos)] = result
+    return results
+
+
+def bench_receive(broker, count):
+    """Receive rates and allocations across payload sizes, with the legacy
+    socket reads and with the read-ahead buffer"""
+    results = {}
+    for recv_buffer_size in (0, 8192):
+        for size in PAYLOAD_SIZES:
+            client = make_client(
+                broker, recv_buffer_size=recv_buffer_size, use_binary_mode=True
+            )
+            session = broker.sessions[-1]
+            meter = AllocationMeter()
+            client.on_message = lambda *args: meter.event()
+            packet = publish_packet("bench/recv", os.urandom(size))
+            with meter:
+                threading.Thread(
+                    target=broker.burst, args=(session, packet, count), daemon=True
+                ).start()
+                start = time.perf_counter()
+                while meter.events < count and time.perf_counter() - start < 60:
+                    client.loop(0.1)
+                elapsed = time.perf_counter() - start
+            packets, reads = client.recv_stats
+            client.disconnect()
+            mode = "buffered" if recv_buffer_size else "legacy"
+            results["{}_{}".format(mode, size)] = dict(
+                msgs_per_s=_rate(meter.events, elapsed),
+                mb_per_s=round(meter.events * size / elapsed / 1e6, 2),
+                reads_per_msg=round(reads / max(packets, 1), 3),
+                **meter.result()
+            )
+    return results
+
+
+def bench_topics(broker, count):
+    """Allocations over a long stream cycling through the topics code.py
+    receives, which are interned after their first message"""
+    topics = [
+        "/pyportal/ping",
+        "/pyportal/brightness",
+        "/pyportal/neopixel",
+        "/pyportal/blinkrate",
+        "/openweather/raw",
+        "/aio/local_time",
+        "/sensor/temperature_house",
+    ]
+    results = {}
+    for payload_type in (str, bytes, memoryview):
+        client = make_client(broker, recv_buffer_size=8192)
+        client.subscribe([(topic, 0) for topic in topics], payload_type=payload_type)
+        session = broker.sessions[-1]
+        meter = AllocationMeter()
+        client.on_message = lambda *args: meter.event()
+        packet = b"".join(publish_packet(topic, b"42") for topic in topics)
+        with meter:
+            broker.burst(session, packet, count // len(topics))
+            start = time.perf_counter()
+            while meter.events < count // len(topics) * len(topics):
+                if time.perf_counter() - start > 60:
+                    break
+                client.loop(0.1)
+        client.disconnect()
+        results[payload_type.__name__] = meter.result()
+    return results
+
+
+class RecursiveMatcher:
+    """Reference for bench_matcher: the trie MQTTMatcher used before it kept
+    exact filters in a dict and cached lookups, matching with recursive
+    generators"""
+
+    class Node:
+        """Individual node on the MQTT prefix tree."""
+
+        __slots__ = "children", "content"
+
+        def __init__(self):
+            self.children = {}
+            self.content = None
+
+    def __init__(self):
+        self._root = self.Node()
+
+    def __setitem__(self, key, value):
+        node = self._root
+        for sym in key.split("/"):
+            node = node.children.setdefault(sym, self.Node())
+        node.content = value
+
+    def iter_match(self, topic):
+        """Return an iterator on all values associated with filters
+        that match the :topic"""
+        lst = topic.split("/")
+        normal = not topic.startswith("$")
+
+        def rec(node, i=0):
+            if i == len(lst):
+                if node.content is not None:
+                    yield node.content
+            else:
+                part = lst[i]
+                if part in node.children:
+                    for content in rec(node.children[part], i + 1):
+                        yield content
+                if "+" in node.children and (normal or i > 0):
+                    for content in rec(node.children["+"], i + 1):
+                        yield content
+            if "#" in node.children and (normal or i > 0):
+                content = node.children["#"].content
+                if content is not None:
+                    yield content
+
+        return rec(self._root)
+
+
+def _matcher_filters():
+    """About 500 filters over a site of buildings and rooms, a third of them
+    with wildcards"""
+    filters = []
+    for b in range(10):
+        filters += ["site/b{}/room{}/temperature".format(b, r) for r in range(30)]
+        filters.append("site/b{}/+/humidity".format(b))
+        filters += ["+/b{}/room{}/motion".format(b, r) for r in range(10)]
+        filters += ["site/b{}/room{}/#".format(b, r) for r in range(5)]
+    filters += ["site/+/room{}/light".format(r) for r in range(30)]
+    filters += ["alerts/#", "$SYS/#"]
+    return filters
+
+
+def _matcher_topics(count):
+    """:count topics, sorted by what matches them"""
+    rand = random.Random(8)
+    kinds = ("temperature", "humidity", "light", "motion", "pressure")
+    exact, wildcard, miss = [], [], []
+    while len(exact) + len(wildcard) + len(miss) < count:
+        b, r = rand.randrange(12), rand.randrange(40)
+        kind = rand.choice(kinds)
+        topic = "site/b{}/room{}/{}".format(b, r, kind)
+        if kind == "temperature" and b < 10 and r < 30:
+            exact.append(topic)
+        elif b < 10 and (kind in ("humidity", "motion") or r < 5) or (
+            kind == "light" and r < 30
+        ):
+            wildcard.append(topic)
+        else:
+            miss.append(rand.choice((topic, "office/printer/{}".format(r))))
+    return exact, wildcard, miss
+
+
+def bench_matcher(count):
+    """MQTTMatcher dispatch cost per lookup, with hundreds of filters and
+    thousands of topics, next to the recursive matcher it replaced"""
+    filters = _matcher_filters()
+    exact, wildcard, miss = _matcher_topics(4000)
+    cases = {
+        # The few topics a station receives, over and over
+        "hot": (exact[:3] + wildcard[:3] + miss[:1]) * 4,
+        "exact_hit": exact,
+        "wildcard_hit": wildcard,
+        "miss": miss,
+        # Thousands of topics in turn, far more than the lookup cache holds
+        "cache_churn": exact + wildcard + miss,
+    }
+    matchers = {"ns_per_lookup": MQTTMatcher(), "recursive_ns": RecursiveMatcher()}
+    for matcher in matchers.values():
+        for i, topic_filter in enumerate(filters):
+            matcher[topic_filter] = i
+    for topic in cases["cache_churn"]:
+        expected = sorted(matchers["recursive_ns"].iter_match(topic))
+        assert sorted(matchers["ns_per_lookup"].iter_match(topic)) == expected, topic
+    results = {"filters": len(filters), "topics": len(cases["cache_churn"])}
+    for name, topics in cases.items():
+        result = {}
+        rounds = max(1, count // len(topics) // 3)
+        for label, matcher in matchers.items():
+            # Best of three, as the differences are small next to the noise
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for topic in topics:
+                        for _ in matcher.iter_match(topic):
+                            pass
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            result[label] = round(best * 1e9 / (rounds * len(topics)), 1)
+        result["speedup"] = round(result["recursive_ns"] / result["ns_per_lookup"], 2)
+        results[name] = result
+    return results
+
+
+def bench_async(broker, sessions, messages):
+    """Many AsyncMQTT sessions on one event loop, each publishing QoS 1 to a
+    topic it is subscribed to"""
+
+    async def session(i):
+        client = AsyncMQTT(
+            "127.0.0.1", port=broker.port, is_ssl=False, client_id="bench{}".format(i)
+        )
+        async with client:
+            await client.subscribe("bench/async/{}".format(i))
+            await client.publish_many(
+                [("bench/async/{}".format(i), n, 1) for n in range(messages)]
+            )
+            received = 0
+            async for _ in client:
+                received += 1
+                if received == messages:
+                    break
+            return received
+
+    async def run():
+        start = time.perf_counter()
+        received = await asyncio.gather(*(session(i) for i in range(sessions)))
+        return sum(received), time.perf_counter() - start
+
+    received, elapsed = asyncio.run(run())
+    return {
+        "sessions": sessions,
+        "round_trips_per_s": _rate(received, elapsed),
+        "total_ms": round(elapsed * 1000, 1),
+    }
+
+
+def run(quick=False):
+    """Run every benchmark, returning the results as a dict"""
+    scale = 10 if quick else 1
+    broker = FakeBroker(record=False)
+    try:
+        results = {
+            "connect": bench_connect(broker, 200 // scale),
+            "subscribe": bench_subscribe(broker, 50),
+            "fanout": bench_fanout(broker, 20, 1000 // scale),
+            "publish": bench_publish(broker, 20000 // scale),
+            "threads": bench_threads(broker, 20000 // scale),
+            "receive": bench_receive(broker, 20000 // scale),
+            "topics": bench_topics(broker, 14000 // scale),
+            "matcher": bench_matcher(200000 // scale),
+        }
+        if AsyncMQTT is not None:
+            results["async"] = bench_async(broker, 200 // scale, 20)
+    finally:
+        broker.close()
+    return results
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + key + ".")
+        else:
+            yield prefix + key, value
+
+
+def compare(before, after):
+    """Print the metrics of two runs side by side"""
+    old = dict(_flatten(before["results"]))
+    print("{:<45} {:>14} {:>14} {:>8}".format("metric", "before", "after", "change"))
+    for key, value in _flatten(after["results"]):
+        previous = old.get(key)
+        change = ""
+        if isinstance(value, (int, float)) and isinstance(previous, (int, float)):
+            if previous:
+                change = "{:+.1f}%".format((value - previous) * 100 / previous)
+        print("{:<45} {:>14} {:>14} {:>8}".format(key, str(previous), str(value), change))
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-o", "--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--quick", action="store_true", help="run a tenth of the iterations"
+    )
+    args = parser.parse_args()
+
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": run(args.quick),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), report)
+
+
+if __name__ == "__main__":
+    main()
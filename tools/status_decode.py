@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Flavio Fernandes
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`status_decode`
+====================================================================================
+
+Rebuilds the full status of every station from the delta status messages,
+JSON or CBOR, and unpacks binary metrics with their layout. Reads
+``topic hex_payload`` lines, as printed by::
+
+    mosquitto_sub -h $MQTT -F '%t %x' \\
+        -t "${PREFIX}/status/#" -t "${PREFIX}/metrics/#" | \\
+        python3 tools/status_decode.py
+
+with ``PREFIX`` the ``topic_prefix`` of the stations, ``/pyportal`` by
+default, and prints one JSON object per status, metrics or info message.
+"""
+
+import json
+import struct
+import sys
+
+# Mirrors PACK_HEADER in metrics.py
+PACK_HEADER = "<BBBB"
+
+
+class CBORDecoder:
+    """Decoder for the CBOR subset status.cbor_dumps writes"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, size):
+        start = self.pos
+        self.pos += size
+        if self.pos > len(self.data):
+            raise ValueError("Truncated CBOR")
+        return self.data[start : self.pos]
+
+    def _argument(self, info):
+        if info < 24:
+            return info
+        if info > 27:
+            raise ValueError("Unsupported CBOR argument {}".format(info))
+        size = 1 << (info - 24)
+        return int.from_bytes(self._take(size), "big")
+
+    def decode(self):
+        """Returns the next item"""
+        initial = self._take(1)[0]
+        major, info = initial >> 5, initial & 0x1F
+        if major == 7:
+            simple = {20: False, 21: True, 22: None}
+            if info in simple:
+                return simple[info]
+            if info == 25:
+                return struct.unpack(">e", self._take(2))[0]
+            if info == 26:
+                return struct.unpack(">f", self._take(4))[0]
+            if info == 27:
+                return struct.unpack(">d", self._take(8))[0]
+            raise ValueError("Unsupported CBOR simple value {}".format(info))
+        value = self._argument(info)
+        if major == 0:
+            return value
+        if major == 1:
+            return -1 - value
+        if major == 2:
+            return bytes(self._take(value))
+        if major == 3:
+            return bytes(self._take(value)).decode("utf-8")
+        if major == 4:
+            return [self.decode() for _ in range(value)]
+        if major == 5:
+            return {self.decode(): self.decode() for _ in range(value)}
+        raise ValueError("Unsupported CBOR major type {}".format(major))
+
+
+def loads(payload):
+    """Decodes a status payload, JSON or CBOR"""
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    return CBORDecoder(payload).decode()
+
+
+def unpack_metrics(layout, payload):
+    """Decodes metrics.Metrics.pack output, given its layout()"""
+    version, counters, gauges, histograms = struct.unpack_from(PACK_HEADER, payload)
+    if version != layout["version"]:
+        raise ValueError("Metrics format {} is not {}".format(version, layout["version"]))
+    buckets = layout["buckets"]
+    pos = struct.calcsize(PACK_HEADER)
+    values = struct.unpack_from("<{}I".format(counters), payload, pos)
+    pos += 4 * counters
+    result = {"counters": dict(zip(layout["counters"], values))}
+    values = struct.unpack_from("<{}f".format(gauges), payload, pos)
+    pos += 4 * gauges
+    result["gauges"] = dict(zip(layout["gauges"], values))
+    result["histograms"] = {}
+    for name in layout["histograms"][:histograms]:
+        values = struct.unpack_from("<{}I".format(4 + buckets), payload, pos)
+        pos += 4 * (4 + buckets)
+        count, sum_s, sum_us, max_us = values[:4]
+        result["histograms"][name] = {
+            "count": count,
+            "sum_ms": sum_s * 1000 + sum_us / 1000,
+            "max_ms": max_us / 1000,
+            "buckets": [[1 << i, n] for i, n in enumerate(values[4:]) if n],
+        }
+    return result
+
+
+class Stations:
+    """Latest full status of every station, by status topic"""
+
+    def __init__(self):
+        self.status = {}
+        self.seq = {}
+        self.layouts = {}
+
+    def update(self, topic, payload):
+        """Applies a message, returning what to print or None"""
+        if topic.endswith("/metrics/layout"):
+            self.layouts[topic[: -len("/layout")]] = json.loads(payload)
+            return None
+        if topic.endswith("/metrics"):
+            if payload[:1] == b"{":
+                return {"topic": topic, "metrics": json.loads(payload)}
+            if topic not in self.layouts:
+                return {"topic": topic, "error": "no layout received yet"}
+            return {"topic": topic, "metrics": unpack_metrics(self.layouts[topic], payload)}
+        if topic.endswith("/status/info"):
+            return {"topic": topic, "info": loads(payload)}
+        if not topic.endswith("/status"):
+            return None
+        return self._apply(topic, loads(payload))
+
+    def _apply(self, topic, message):
+        seq = message.pop("seq", None)
+        if message.pop("full", False):
+            self.status[topic] = message
+        elif topic not in self.status:
+            return {"topic": topic, "seq": seq, "error": "waiting for a full status"}
+        elif seq is not None and self.seq.get(topic) not in (None, seq - 1):
+            # A delta was missed, the status is incomplete until the next full one
+            del self.status[topic]
+            return {"topic": topic, "seq": seq, "error": "missed a status message"}
+        else:
+            status = self.status[topic]
+            for key, value in message.items():
+                if isinstance(value, dict) and isinstance(status.get(key), dict):
+                    status[key].update(value)
+                else:
+                    status[key] = value
+        self.seq[topic] = seq
+        return {"topic": topic, "seq": seq, "status": self.status[topic]}
+
+
+def main():
+    """Command line entry point"""
+    stations = Stations()
+    for line in sys.stdin:
+        try:
+            topic, payload = line.split()
+            result = stations.update(topic, bytes.fromhex(payload))
+        except ValueError as e:
+            result = {"line": line.strip(), "error": str(e)}
+        if result is not None:
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()